@@ -0,0 +1,91 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Moduły, których nie wolno importować podczas startu programu
+HEAVY_MODULES = ["llama_cpp", "numpy", "PyPDF2", "docx", "bs4"]
+
+# Scenariusze startu: nazwa -> kod wykonywany w nowym interpreterze
+SCENARIOS = {
+    "help": "import sys; sys.argv = ['main.py', '--help']\n"
+            "import main\n"
+            "try:\n"
+            "    main.main()\n"
+            "except SystemExit:\n"
+            "    pass",
+    "config": "from config import config; config.get('model')",
+    "cli_import": "import cli",
+    "gui_import": "import llm_gui",
+    "client": "import llm_daemon",
+}
+
+
+def _run_scenario(code: str) -> float:
+    """Uruchamia scenariusz w osobnym interpreterze i zwraca czas w milisekundach."""
+    check = (
+        f"\nimport sys\n"
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        f"if loaded:\n"
+        f"    sys.exit('Ciężkie moduły załadowane przy starcie: ' + ', '.join(loaded))\n"
+    )
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", code + check],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else
+                           f"kod wyjścia {result.returncode}")
+    return elapsed
+
+
+def main():
+    """
+    Mierzy czas startu programu w kilku scenariuszach i sprawdza, że żaden
+    z nich nie importuje biblioteki natywnej ani innych ciężkich modułów.
+
+    Zwraca kod wyjścia 1, jeśli któryś scenariusz się nie powiódł lub
+    przekroczył limit podany w --max-ms.
+    """
+    parser = argparse.ArgumentParser(description="Pomiar czasu startu synergiAI")
+    parser.add_argument("--runs", type=int, default=5, help="Liczba powtórzeń każdego scenariusza")
+    parser.add_argument("--max-ms", type=float, help="Maksymalna dopuszczalna mediana czasu startu (ms)")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"Scenariusze do zmierzenia: {', '.join(SCENARIOS)} (domyślnie wszystkie)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Nieznane scenariusze: {', '.join(unknown)}")
+
+    failed = False
+    for name in args.scenarios or SCENARIOS:
+        try:
+            times = [_run_scenario(SCENARIOS[name]) for _ in range(args.runs)]
+        except RuntimeError as e:
+            if name == "gui_import" and "tkinter" in str(e):
+                print(f"{name:12s} pominięty (brak tkinter)")
+                continue
+            print(f"{name:12s} BŁĄD: {e}")
+            failed = True
+            continue
+
+        median = statistics.median(times)
+        status = ""
+        if args.max_ms is not None and median > args.max_ms:
+            status = f"  PRZEKROCZONO LIMIT {args.max_ms:.0f} ms"
+            failed = True
+        print(f"{name:12s} mediana {median:7.1f} ms  min {min(times):7.1f} ms{status}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,10 @@ import json
 from pathlib import Path
 from typing import Dict, Any, Optional
 
+from llm_backend import model_path_available
 from llm_interface import SimpleLLMInterface
+from llm_search import INDEX_FILENAME, SearchIndex
+from llm_session_store import ChatLog, SessionStore
 from config import config
 
 
@@ -21,13 +24,13 @@ def load_or_select_model(interface: SimpleLLMInterface, model_path: Optional[str
     """
     if model_path:
         # Jeśli podano model, spróbuj go załadować
-        if not os.path.exists(model_path):
+        model_params = config.get_model_params()
+        if not model_path_available(model_path, model_params.get("backend")):
             print(f"Nie znaleziono pliku modelu: {model_path}")
             return False
 
-        model_params = config.get_model_params()
         print(f"Ładowanie modelu: {model_path}...")
-        return interface.load_model(model_path=model_path, **model_params)
+        return interface.submit_load_model(model_path, **model_params).result()
     else:
         # Pokaż ostatnio używane modele
         recent_models = interface.get_recent_models()
@@ -123,7 +126,7 @@ def load_or_select_model(interface: SimpleLLMInterface, model_path: Optional[str
         # Załaduj wybrany model
         model_params = config.get_model_params()
         print(f"Ładowanie modelu: {model_path}...")
-        return interface.load_model(model_path=model_path, **model_params)
+        return interface.submit_load_model(model_path, **model_params).result()
 
 
 def edit_parameters(param_group: str) -> Dict[str, Any]:
@@ -203,34 +206,278 @@ def edit_parameters(param_group: str) -> Dict[str, Any]:
     return params
 
 
-def run_cli(model_path: Optional[str] = None, **kwargs):
+def read_batch_prompts(input_path: str):
     """
-    Uruchamia interfejs wiersza poleceń dla SimpleLLM.
+    Odczytuje prompty z pliku: jeden prompt na linię lub JSONL z polem "prompt".
+
+    Args:
+        input_path: Ścieżka do pliku wejściowego
+
+    Returns:
+        Generator promptów
+    """
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            if line.lstrip().startswith("{"):
+                yield json.loads(line)["prompt"]
+            else:
+                yield line
+
+
+def load_grammar_options(grammar_path: Optional[str] = None, json_schema_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Wczytuje gramatykę GBNF lub schemat JSON ograniczający odpowiedzi modelu.
+
+    Args:
+        grammar_path: Plik z gramatyką GBNF
+        json_schema_path: Plik ze schematem JSON
+
+    Returns:
+        Parametry generowania ("grammar" lub "json_schema")
+    """
+    options = {}
+    if grammar_path:
+        with open(grammar_path, 'r', encoding='utf-8') as f:
+            options["grammar"] = f.read()
+    if json_schema_path:
+        with open(json_schema_path, 'r', encoding='utf-8') as f:
+            options["json_schema"] = json.load(f)
+    return options
+
+
+def run_batch(
+        input_path: str,
+        output_path: Optional[str] = None,
+        model_path: Optional[str] = None,
+        mode: str = "complete",
+        generation_overrides: Optional[Dict[str, Any]] = None,
+        **kwargs
+):
+    """
+    Przetwarza wsadowo prompty z pliku, uruchamiając jeden model na każdy węzeł NUMA.
+
+    Args:
+        input_path: Plik z promptami (tekst lub JSONL)
+        output_path: Plik wynikowy JSONL (domyślnie standardowe wyjście)
+        model_path: Ścieżka do modelu (domyślnie ostatnio używany)
+        mode: Tryb pracy: chat lub complete
+        generation_overrides: Parametry generowania nadpisujące konfigurację (np. gramatyka)
+        **kwargs: Dodatkowe parametry dla modelu
+    """
+    from llm_batch import BatchGenerator
+
+    if model_path is None:
+        recent_models = config.get("recent_models") or []
+        if not recent_models:
+            print("Nie podano modelu (--model) i brak ostatnio używanych modeli.")
+            return
+        model_path = recent_models[0]
+
+    model_params = config.get_model_params()
+    model_params.update({k: v for k, v in kwargs.items() if k in model_params})
+
+    generator = BatchGenerator(model_path, model_params)
+    print(f"Przetwarzanie wsadowe: {len(generator.cpu_sets)} procesów roboczych "
+          f"(procesory: {[len(cpus) for cpus in generator.cpu_sets]})")
+
+    generation_params = config.get_generation_params()
+    generation_params.update(generation_overrides or {})
+    system_prompt = config.get("system_prompt") if mode == "chat" else None
+
+    output = open(output_path, 'w', encoding='utf-8') if output_path else None
+    try:
+        prompts = read_batch_prompts(input_path)
+        for index, response, error in generator.run(prompts, mode=mode, system_prompt=system_prompt,
+                                                    **generation_params):
+            record = {"index": index, "response": response}
+            if error is not None:
+                record["error"] = error
+            line = json.dumps(record, ensure_ascii=False)
+            if output is not None:
+                output.write(line + "\n")
+                output.flush()
+                print(f"Ukończono prompt {index + 1}")
+            else:
+                print(line)
+    finally:
+        if output is not None:
+            output.close()
+
+
+def run_map_reduce(
+        input_path: str,
+        task: str,
+        output_path: Optional[str] = None,
+        model_path: Optional[str] = None,
+        mode: str = "chat",
+        chunk_tokens: Optional[int] = None,
+        **kwargs
+):
+    """
+    Przetwarza dokument większy niż kontekst modelu metodą map-reduce.
+
+    Fragmenty dokumentu są przetwarzane równolegle przez procesy robocze
+    (jeden model na węzeł NUMA), a postęp zapisywany w pliku obok wyniku -
+    ponowne uruchomienie tego samego polecenia wznawia przerwane zadanie.
+
+    Args:
+        input_path: Plik dokumentu (tekst, log, PDF, DOCX, HTML)
+        task: Polecenie dla dokumentu (np. "Streść najważniejsze informacje")
+        output_path: Plik wynikowy (domyślnie standardowe wyjście)
+        model_path: Ścieżka do modelu (domyślnie ostatnio używany)
+        mode: Tryb pracy: chat lub complete
+        chunk_tokens: Maksymalna liczba tokenów fragmentu (domyślnie dopasowana do kontekstu)
+        **kwargs: Dodatkowe parametry dla modelu
+    """
+    import sys
+    from llm_batch import BatchGenerator
+    from llm_core import SimpleLLM
+    from llm_mapreduce import MapReduceJob, default_chunk_tokens
+
+    if model_path is None:
+        recent_models = config.get("recent_models") or []
+        if not recent_models:
+            print("Nie podano modelu (--model) i brak ostatnio używanych modeli.")
+            return
+        model_path = recent_models[0]
+
+    model_params = config.get_model_params()
+    model_params.update({k: v for k, v in kwargs.items() if k in model_params})
+    generation_params = config.get_generation_params()
+    if chunk_tokens is None:
+        chunk_tokens = default_chunk_tokens(model_params.get("context_size", 4096),
+                                            generation_params.get("max_tokens", 512))
+
+    # Do dzielenia dokumentu wystarczy słownik modelu - wagi ładują tylko procesy robocze
+    tokenizer = SimpleLLM(model_path, vocab_only=True, verbose=False, backend=model_params.get("backend"),
+                          backend_options=model_params.get("backend_options"))
+    backend = tokenizer.get_tokenizer()
+
+    def count_tokens(text: str) -> int:
+        return len(backend.tokenize(text.encode("utf-8"), add_bos=False))
+
+    generator = BatchGenerator(model_path, model_params)
+    system_prompt = config.get("system_prompt") if mode == "chat" else None
+    checkpoint_path = (output_path or input_path) + ".mapreduce.jsonl"
+    job = MapReduceJob(input_path, task, count_tokens, chunk_tokens=chunk_tokens, checkpoint_path=checkpoint_path)
+    print(f"Map-reduce: fragmenty do {chunk_tokens} tokenów, {len(generator.cpu_sets)} procesów roboczych, "
+          f"postęp w {checkpoint_path}", file=sys.stderr)
+
+    def progress(job):
+        print(f"\r{job.stage}: {job.done} części, dokument {job.reader.progress:.0%}", end="", file=sys.stderr)
+
+    try:
+        result = job.run(lambda prompts: generator.run(prompts, mode=mode, system_prompt=system_prompt,
+                                                       **generation_params), progress=progress)
+    except RuntimeError as e:
+        print(f"\n{e}", file=sys.stderr)
+        return
+    finally:
+        tokenizer.close()
+    print(file=sys.stderr)
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(result + "\n")
+        print(f"Wynik zapisano w {output_path}", file=sys.stderr)
+    else:
+        print(result)
+
+
+# Nazwy parametrów modelu przyjmowane także pod nazwą argumentu SimpleLLM
+_MODEL_PARAM_ALIASES = {"n_threads": "n_cpu_threads"}
+
+
+def apply_model_overrides(overrides: Dict[str, Any]) -> None:
+    """Aktualizuje parametry modelu w konfiguracji na podstawie argumentów wiersza poleceń."""
+    if not overrides:
+        return
+    model_params = config.get_model_params()
+    for key, value in overrides.items():
+        key = _MODEL_PARAM_ALIASES.get(key, key)
+        if key in model_params:
+            # Konwersja na odpowiedni typ
+            if isinstance(model_params[key], bool):
+                model_params[key] = bool(value)
+            elif isinstance(model_params[key], int):
+                model_params[key] = int(value)
+            elif isinstance(model_params[key], float):
+                model_params[key] = float(value)
+            else:
+                model_params[key] = value
+    config.update_section("model", model_params)
+
+
+def run_daemon(
+        model_path: Optional[str] = None,
+        socket_path: Optional[str] = None,
+        generation_overrides: Optional[Dict[str, Any]] = None,
+        **kwargs
+):
+    """
+    Ładuje model i udostępnia go przez gniazdo Unix (llm_daemon), aby kolejne
+    zapytania z powłoki (python main.py --client) nie ładowały modelu od nowa.
 
     Args:
         model_path: Opcjonalna ścieżka do modelu
+        socket_path: Ścieżka gniazda (domyślnie llm_daemon.DEFAULT_SOCKET_PATH)
+        generation_overrides: Parametry generowania nadpisujące konfigurację (np. gramatyka)
         **kwargs: Dodatkowe parametry dla modelu
     """
+    from llm_daemon import ModelDaemon, DEFAULT_SOCKET_PATH
+
     interface = SimpleLLMInterface()
+    apply_model_overrides(kwargs)
+    if not load_or_select_model(interface, model_path):
+        print("Nie udało się załadować modelu. Wyjście.")
+        return
 
-    # Aktualizuj parametry modelu na podstawie argumentów wiersza poleceń
-    if kwargs:
-        model_params = config.get_model_params()
-        for key, value in kwargs.items():
-            if key in model_params:
-                # Konwersja na odpowiedni typ
-                if isinstance(model_params[key], bool):
-                    model_params[key] = bool(value)
-                elif isinstance(model_params[key], int):
-                    model_params[key] = int(value)
-                elif isinstance(model_params[key], float):
-                    model_params[key] = float(value)
-                else:
-                    model_params[key] = value
-        config.update_section("model", model_params)
+    daemon = ModelDaemon(interface, socket_path or DEFAULT_SOCKET_PATH, generation_overrides)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        print("\nZatrzymano demona.")
+    except RuntimeError as e:
+        print(e)
+    finally:
+        interface.executor.shutdown()
+
+
+def open_search_index(store: SessionStore) -> SearchIndex:
+    """Otwiera indeks wyszukiwania rozmów wskazany w konfiguracji."""
+    index_path = (config.get("search") or {}).get("index_path")
+    return SearchIndex(index_path or os.path.join(store.directory, INDEX_FILENAME))
 
+
+def run_cli(model_path: Optional[str] = None, generation_overrides: Optional[Dict[str, Any]] = None,
+            restore: Optional[str] = None, **kwargs):
+    """
+    Uruchamia interfejs wiersza poleceń dla SimpleLLM.
+
+    Args:
+        model_path: Opcjonalna ścieżka do modelu
+        generation_overrides: Parametry generowania nadpisujące konfigurację (np. gramatyka)
+        restore: Migawka sesji do przywrócenia (model, historia i KV cache)
+        **kwargs: Dodatkowe parametry dla modelu
+    """
+    generation_overrides = generation_overrides or {}
+    interface = SimpleLLMInterface()
+    apply_model_overrides(kwargs)
+
+    snapshot = None
+    if restore:
+        try:
+            snapshot = interface.submit_restore_snapshot(restore).result()
+        except Exception as e:
+            print(f"Nie udało się przywrócić sesji: {e}")
+            return
+        print(f"Przywrócono sesję z {restore}")
+        kwargs.setdefault("mode", (snapshot.get("extra") or {}).get("mode", "chat"))
     # Załaduj model lub pozwól użytkownikowi wybrać
-    if not load_or_select_model(interface, model_path):
+    elif not load_or_select_model(interface, model_path):
         print("Nie udało się załadować modelu. Wyjście.")
         return
 
@@ -240,10 +487,13 @@ def run_cli(model_path: Optional[str] = None, **kwargs):
 
     # Ustawienia generowania
     generation_params = config.get_generation_params()
+    generation_params.update(generation_overrides)
+    if generation_overrides:
+        print("Odpowiedzi ograniczone gramatyką: " + ", ".join(generation_overrides))
 
-    # Pobierz system prompt dla trybu chat
-    if mode == "chat":
-        system_prompt = config.get("system_prompt")
+    # Pobierz system prompt dla trybu chat (przywrócona sesja ma go w migawce)
+    system_prompt = config.get("system_prompt")
+    if mode == "chat" and snapshot is None:
         print(f"\nAktualny system prompt: {system_prompt}")
         print("Chcesz zmienić system prompt? (t/n): ", end="")
         if input().strip().lower() in ('t', 'tak', 'y', 'yes'):
@@ -261,6 +511,27 @@ def run_cli(model_path: Optional[str] = None, **kwargs):
     print("  model - edycja parametrów modelu")
     print("  save - zapisz konfigurację")
     print("  load - załaduj nowy model")
+    print("  new - nowa rozmowa (wyczyść historię)")
+    print("  search <tekst> - szukaj w zapisanych rozmowach")
+    print("  context <nr> - dołącz wynik wyszukiwania jako kontekst następnego prompta")
+    print("  snapshot <plik> - zapisz sesję razem z KV cache (przywracanie: --restore <plik>)")
+
+    # Wcześniejsze tury rozmowy przekazywane do modelu w trybie chat
+    history = []
+    # Rozmowa zapisywana przyrostowo w katalogu rozmów (plik powstaje po pierwszej turze)
+    session_store = SessionStore(config.get("sessions_dir"))
+    chat_log = session_store.create("Rozmowa CLI")
+    if snapshot is not None and snapshot.get("sessions"):
+        restored = snapshot["sessions"][0]
+        history = list(restored.get("history") or [])
+        if restored.get("log_path") and os.path.exists(restored["log_path"]):
+            chat_log = ChatLog(restored["log_path"])
+        print(f"Historia rozmowy: {len(history)} wiadomości")
+    search_settings = config.get("search") or {}
+    search_index = open_search_index(session_store)
+    search_hits = []
+    # Fragmenty innych rozmów dołączane przed następnym promptem
+    pending_context = ""
 
     while True:
         if mode == "chat":
@@ -287,7 +558,7 @@ def run_cli(model_path: Optional[str] = None, **kwargs):
         elif prompt.lower() == 'params':
             updated_params = edit_parameters("generation")
             interface.update_generation_params(updated_params)
-            generation_params = updated_params
+            generation_params = dict(updated_params, **generation_overrides)
             print("Parametry generowania zaktualizowane.")
         elif prompt.lower() == 'model':
             updated_params = edit_parameters("model")
@@ -298,31 +569,96 @@ def run_cli(model_path: Optional[str] = None, **kwargs):
                 print("Konfiguracja zapisana.")
             else:
                 print("Błąd podczas zapisywania konfiguracji.")
+        elif prompt.lower() == 'new':
+            history = []
+            chat_log.close()
+            chat_log = session_store.create("Rozmowa CLI")
+            print("Historia rozmowy wyczyszczona.")
+        elif prompt.lower().startswith('search '):
+            query = prompt[len('search '):].strip()
+            search_index.sync(session_store)
+            query_vector = None
+            if search_settings.get("semantic"):
+                try:
+                    query_vector = interface.submit_embed(query).result()
+                except Exception as e:
+                    print(f"Wyszukiwanie semantyczne niedostępne: {e}")
+            search_hits = search_index.search(query, limit=search_settings.get("limit") or 20,
+                                              query_vector=query_vector)
+            for number, hit in enumerate(search_hits, 1):
+                print(f"{number}. [{hit.title}] {hit.role}: {hit.snippet}")
+            if not search_hits:
+                print("Brak wyników.")
+        elif prompt.lower().startswith('context '):
+            try:
+                hit = search_hits[int(prompt.split()[1]) - 1]
+            except (ValueError, IndexError):
+                print("Podaj numer wyniku ostatniego wyszukiwania.")
+                continue
+            fragment = "\n".join(f"{entry['role']}: {entry['content']}" for entry in search_index.context(hit))
+            pending_context += f"Fragment rozmowy \"{hit.title}\":\n{fragment}\n\n"
+            print("Fragment zostanie dołączony do następnego prompta.")
+        elif prompt.lower().startswith('snapshot '):
+            snapshot_path = prompt[len('snapshot '):].strip()
+            session_entry = {"session_id": None, "title": "Rozmowa CLI", "history": history,
+                             "log_path": chat_log.path}
+            try:
+                size = interface.submit_save_snapshot(snapshot_path, [session_entry], extra={"mode": mode}).result()
+                print(f"Sesja zapisana w {snapshot_path} ({size / 1024 / 1024:.1f} MB).")
+            except Exception as e:
+                print(f"Nie udało się zapisać sesji: {e}")
         elif prompt.lower() == 'load':
             if load_or_select_model(interface):
                 print("Model załadowany pomyślnie.")
             else:
                 print("Nie udało się załadować modelu.")
         else:
-            # Generowanie odpowiedzi
+            # Generowanie odpowiedzi w wątku inferencji
             print("Generowanie...")
+            full_prompt = pending_context + prompt
+            pending_context = ""
             if mode == "chat":
-                response = interface.chat(
-                    prompt,
+                stream = interface.submit_chat(
+                    full_prompt,
                     system_prompt=system_prompt,
+                    history=history,
                     **generation_params
                 )
-                if not generation_params.get("stream", True):
-                    print(f"\nOdpowiedź:\n{response}\n")
+                header = "\nOdpowiedź:"
             else:
-                response = interface.complete(
-                    prompt,
+                stream = interface.submit_complete(
+                    full_prompt,
                     **generation_params
                 )
-                if not generation_params.get("stream", True):
-                    if isinstance(response, dict):
-                        response = response["choices"][0]["text"]
-                    print(f"\nWygenerowany tekst:\n{response}\n")
+                header = "\nWygenerowany tekst:"
+
+            print(header)
+            try:
+                response = ""
+                for chunk in stream:
+                    response += chunk
+                    print(chunk, end="", flush=True)
+                print("\n")
+                if mode == "chat":
+                    history = history + [
+                        {"role": "user", "content": prompt},
+                        {"role": "assistant", "content": response},
+                    ]
+                    try:
+                        chat_log.append("user", prompt)
+                        chat_log.append("assistant", response)
+                        search_index.index_log(chat_log)
+                        if search_settings.get("semantic"):
+                            interface.submit_index_embeddings(search_index)
+                    except OSError as e:
+                        print(f"Nie udało się zapisać tury rozmowy: {e}")
+                if stream.metrics is not None:
+                    print(f"[{stream.metrics.summary()}]")
+            except KeyboardInterrupt:
+                stream.cancel()
+                print("\nPrzerwano generowanie.")
+            except Exception as e:
+                print(f"\nBłąd generowania: {e}")
 
 
 if __name__ == "__main__":
@@ -20,6 +20,8 @@ DEFAULT_EMBEDDING = False
 DEFAULT_ROPE_SCALING_TYPE = None  # None, "linear", "yarn"
 DEFAULT_ROPE_FREQ_BASE = 10000.0
 DEFAULT_ROPE_FREQ_SCALE = 1.0
+DEFAULT_ISOLATED_PROCESS = False  # Uruchamianie modelu w osobnym procesie roboczym
+DEFAULT_BACKEND = "llama_cpp"  # Silnik inferencji: "llama_cpp" lub "fake" (testowy, bez modelu)
 
 # Domyślne parametry generowania tekstu
 DEFAULT_MAX_TOKENS = 512
@@ -36,6 +38,37 @@ DEFAULT_MODELS_DIR = os.path.expanduser("~/models")
 # Domyślny system prompt dla trybu czatu
 DEFAULT_SYSTEM_PROMPT = "Jesteś pomocnym asystentem AI."
 
+# Plik JSONL z pomiarami każdego generowania (None = wyłączony)
+DEFAULT_METRICS_LOG = None
+
+# Eksport metryk w formacie Prometheusa (None = wyłączony)
+DEFAULT_METRICS_PORT = None
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_FILE = None
+DEFAULT_METRICS_INTERVAL = 15.0
+
+# Magazyn KV cache bezczynnych sesji rozmów (karty w GUI, klienci demona)
+DEFAULT_SESSION_CACHE_MEMORY_MB = 1024  # budżet pamięci RAM na odłożone stany
+DEFAULT_SESSION_CACHE_SPILL_DIR = None  # katalog na stany wypchnięte z RAM (None = usuwane)
+DEFAULT_SESSION_CACHE_DISK_MB = None  # budżet katalogu na dysku (None = bez limitu)
+DEFAULT_SESSION_CACHE_COMPRESS = True
+
+# Prefill kontekstu i wpisywanego prompta w tle, zanim użytkownik zleci generowanie
+DEFAULT_SPECULATIVE_PREFILL = True
+
+# Katalog rozmów zapisywanych przyrostowo (pliki JSONL)
+DEFAULT_SESSIONS_DIR = os.path.expanduser("~/.simplellm_sessions")
+
+# Wyszukiwanie w zapisanych rozmowach
+DEFAULT_SEARCH_INDEX = None  # plik indeksu SQLite (None = index.sqlite w katalogu rozmów)
+DEFAULT_SEARCH_SEMANTIC = False  # embeddingi wiadomości (wymaga modelu załadowanego z embedding=True)
+DEFAULT_SEARCH_LIMIT = 20
+
+# Kolejka inferencji: wywłaszczanie zadań wsadowych i docelowe opóźnienia klas priorytetu
+DEFAULT_SCHEDULER_PREEMPTION = True
+DEFAULT_INTERACTIVE_LATENCY_TARGET = 1.0  # sekundy do pierwszego fragmentu odpowiedzi
+DEFAULT_BATCH_LATENCY_TARGET = None  # None = bez celu
+
 
 class Config:
     """Klasa zarządzająca konfiguracją aplikacji."""
@@ -57,7 +90,10 @@ class Config:
                 "embedding": DEFAULT_EMBEDDING,
                 "rope_scaling_type": DEFAULT_ROPE_SCALING_TYPE,
                 "rope_freq_base": DEFAULT_ROPE_FREQ_BASE,
-                "rope_freq_scale": DEFAULT_ROPE_FREQ_SCALE
+                "rope_freq_scale": DEFAULT_ROPE_FREQ_SCALE,
+                "isolated_process": DEFAULT_ISOLATED_PROCESS,
+                "backend": DEFAULT_BACKEND,
+                "backend_options": {}
             },
             # Parametry generowania
             "generation": {
@@ -75,7 +111,41 @@ class Config:
             # Ostatnio używany katalog modeli
             "last_models_dir": DEFAULT_MODELS_DIR,
             # Domyślny system prompt
-            "system_prompt": DEFAULT_SYSTEM_PROMPT
+            "system_prompt": DEFAULT_SYSTEM_PROMPT,
+            # Dziennik pomiarów generowania
+            "metrics_log": DEFAULT_METRICS_LOG,
+            # Eksport metryk: serwer HTTP /metrics i/lub okresowy zapis do pliku
+            "metrics": {
+                "port": DEFAULT_METRICS_PORT,
+                "host": DEFAULT_METRICS_HOST,
+                "file": DEFAULT_METRICS_FILE,
+                "interval": DEFAULT_METRICS_INTERVAL
+            },
+            # Prefill z wyprzedzeniem w GUI
+            "speculative_prefill": DEFAULT_SPECULATIVE_PREFILL,
+            # Katalog zapisanych rozmów
+            "sessions_dir": DEFAULT_SESSIONS_DIR,
+            # Indeks wyszukiwania rozmów: pełnotekstowy i opcjonalnie semantyczny
+            "search": {
+                "index_path": DEFAULT_SEARCH_INDEX,
+                "semantic": DEFAULT_SEARCH_SEMANTIC,
+                "limit": DEFAULT_SEARCH_LIMIT
+            },
+            # Kolejka inferencji: zapytania interaktywne wywłaszczają zadania wsadowe
+            "scheduler": {
+                "preemption": DEFAULT_SCHEDULER_PREEMPTION,
+                "latency_targets": {
+                    "interactive": DEFAULT_INTERACTIVE_LATENCY_TARGET,
+                    "batch": DEFAULT_BATCH_LATENCY_TARGET
+                }
+            },
+            # KV cache bezczynnych sesji: pamięć RAM z budżetem, nadmiar na dysku
+            "session_cache": {
+                "memory_mb": DEFAULT_SESSION_CACHE_MEMORY_MB,
+                "spill_dir": DEFAULT_SESSION_CACHE_SPILL_DIR,
+                "disk_mb": DEFAULT_SESSION_CACHE_DISK_MB,
+                "compress": DEFAULT_SESSION_CACHE_COMPRESS
+            }
         }
 
         # Wczytaj istniejącą konfigurację, jeśli istnieje
@@ -0,0 +1,565 @@
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+DEFAULT_BACKEND = "llama_cpp"
+
+_Llama = None
+
+
+def load_llama_class(install: bool = True):
+    """
+    Importuje klasę Llama z llama-cpp-python przy pierwszym użyciu.
+
+    Biblioteka natywna jest ładowana dopiero przy wczytywaniu modelu, dzięki
+    czemu start programu, --help i operacje na konfiguracji jej nie dotykają.
+
+    Args:
+        install: czy zainstalować brakującą bibliotekę przez pip (False - zgłoś ImportError)
+    """
+    global _Llama
+    if _Llama is None:
+        # sprawdzamy czy mamy zainstalowaną bibliotekę llama-cpp-python
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            if not install:
+                raise
+            print("Instalowanie wymaganych bibliotek...")
+            import subprocess
+
+            subprocess.check_call([sys.executable, "-m", "pip", "install", "llama-cpp-python"])
+            from llama_cpp import Llama
+        _Llama = Llama
+    return _Llama
+
+
+class InferenceBackend:
+    """
+    Interfejs silnika inferencji używanego przez SimpleLLM.
+
+    Backend przechowuje stan kontekstu (KV cache) jako ciąg przetworzonych
+    tokenów. SimpleLLM korzysta wyłącznie z poniższych metod, więc kolejne
+    silniki można dodać przez register_backend() bez zmian w SimpleLLM
+    i SimpleLLMInterface.
+    """
+
+    # Czy backend wymaga istniejącego pliku modelu
+    requires_model_file = True
+
+    def __init__(self, model_path: str, **params):
+        self.model_path = model_path
+
+    def n_ctx(self) -> int:
+        """Rozmiar kontekstu w tokenach."""
+        raise NotImplementedError
+
+    def n_vocab(self) -> int:
+        """Rozmiar słownika."""
+        raise NotImplementedError
+
+    def n_embd(self) -> int:
+        """Rozmiar wektora embeddingu."""
+        raise NotImplementedError
+
+    def metadata(self) -> Dict[str, str]:
+        """Metadane modelu (np. klucze GGUF)."""
+        return {}
+
+    def info(self) -> Dict[str, Any]:
+        """Dodatkowe informacje wyświetlane w get_info()."""
+        return {}
+
+    def special_tokens(self) -> Dict[str, str]:
+        """Tekst tokenów BOS i EOS (używany przez szablony czatu)."""
+        return {"bos_token": "", "eos_token": ""}
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        """Zamienia tekst (UTF-8) na tokeny."""
+        raise NotImplementedError
+
+    def detokenize(self, tokens: Sequence[int]) -> bytes:
+        """Zamienia tokeny na bajty UTF-8 (mogą kończyć się niepełnym znakiem)."""
+        raise NotImplementedError
+
+    def is_end_token(self, token: int) -> bool:
+        """Sprawdza, czy token kończy generowanie (EOS/EOT)."""
+        raise NotImplementedError
+
+    def kv_tokens(self) -> Sequence[int]:
+        """Tokeny aktualnie przechowywane w KV cache."""
+        raise NotImplementedError
+
+    def truncate(self, n_tokens: int) -> None:
+        """Obcina KV cache do pierwszych n_tokens tokenów."""
+        raise NotImplementedError
+
+    def prefill(self, tokens: Sequence[int]) -> None:
+        """Przetwarza tokeny prompta, dopisując je do KV cache."""
+        raise NotImplementedError
+
+    def decode(self, token: int) -> None:
+        """Przetwarza jeden wygenerowany token (krok dekodowania)."""
+        self.prefill([token])
+
+    def sample(
+            self,
+            top_k: int,
+            top_p: float,
+            temp: float,
+            repeat_penalty: float,
+            presence_penalty: float,
+            frequency_penalty: float,
+            grammar: Any = None
+    ) -> int:
+        """
+        Wybiera następny token na podstawie logitów ostatniej pozycji.
+
+        Jeśli podano gramatykę (z compile_grammar()), wybierane są tylko tokeny
+        przez nią dozwolone, a wybrany token przesuwa stan gramatyki.
+        """
+        raise NotImplementedError
+
+    def logits(self) -> Optional[Sequence[float]]:
+        """
+        Logity ostatniej przetworzonej pozycji (rozmiar n_vocab) lub None,
+        jeśli backend ich nie udostępnia. Wynik jest ważny do następnego
+        wywołania prefill() lub decode().
+        """
+        return None
+
+    def start_sampling(self, grammar: Any = None) -> None:
+        """Przygotowuje próbkowanie nowej odpowiedzi (np. zeruje stan gramatyki)."""
+
+    def compile_grammar(self, kind: str, source: str) -> Any:
+        """
+        Kompiluje gramatykę ograniczającą generowanie.
+
+        Args:
+            kind: "gbnf" (gramatyka GBNF) lub "json_schema" (schemat JSON jako tekst)
+            source: treść gramatyki lub schematu
+        """
+        raise NotImplementedError(f"Backend {type(self).__name__} nie obsługuje gramatyk")
+
+    def save_state(self) -> Any:
+        """
+        Zwraca kopię stanu kontekstu (KV cache), którą można przywrócić.
+
+        Stan musi dać się serializować modułem pickle - bezczynne sesje
+        są kompresowane i odkładane na dysk (llm_kv_store).
+        """
+        raise NotImplementedError
+
+    def load_state(self, state: Any) -> None:
+        """Przywraca stan zwrócony wcześniej przez save_state()."""
+        raise NotImplementedError
+
+    def embed(self, text: str) -> List[float]:
+        """Zwraca embedding tekstu."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Zwalnia zasoby backendu."""
+
+
+class LlamaCppBackend(InferenceBackend):
+    """Backend oparty na llama-cpp-python (pliki GGUF)."""
+
+    def __init__(
+            self,
+            model_path: str,
+            context_size: int = 4096,
+            n_gpu_layers: int = -1,
+            n_threads: Optional[int] = None,
+            batch_size: int = 512,
+            f16_kv: bool = True,
+            logits_all: bool = False,
+            vocab_only: bool = False,
+            use_mmap: bool = True,
+            use_mlock: bool = False,
+            embedding: bool = False,
+            rope_scaling_type: Optional[str] = None,
+            rope_freq_base: float = 10000.0,
+            rope_freq_scale: float = 1.0,
+            **params
+    ):
+        super().__init__(model_path)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model nie znaleziony: {model_path}")
+
+        # Przygotowanie parametrów RoPE
+        rope_scaling = None
+        if rope_scaling_type:
+            rope_scaling = {
+                "type": rope_scaling_type,
+                "factor": rope_freq_scale
+            }
+
+        Llama = load_llama_class()
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=context_size,
+            n_gpu_layers=n_gpu_layers,
+            n_threads=n_threads,
+            n_batch=batch_size,
+            f16_kv=f16_kv,
+            logits_all=logits_all,
+            vocab_only=vocab_only,
+            use_mmap=use_mmap,
+            use_mlock=use_mlock,
+            embedding=embedding,
+            rope_scaling=rope_scaling,
+            rope_freq_base=rope_freq_base,
+        )
+        self.logits_all = logits_all
+        self.is_end_token = self._make_end_token_check()
+        self._grammar_sampler = None
+
+    def _make_end_token_check(self):
+        """Zwraca funkcję rozpoznającą tokeny kończące generowanie (EOS/EOT)."""
+        eos = self.llm.token_eos()
+        try:
+            from llama_cpp import llama_token_is_eog
+            model = self.llm._model.model
+            llama_token_is_eog(model, eos)
+            return lambda token: token == eos or llama_token_is_eog(model, token)
+        except Exception:
+            # Starsze wersje llama-cpp-python znają tylko token EOS
+            return lambda token: token == eos
+
+    def n_ctx(self) -> int:
+        return self.llm.n_ctx()
+
+    def n_vocab(self) -> int:
+        return self.llm.n_vocab()
+
+    def n_embd(self) -> int:
+        return self.llm.n_embd()
+
+    def metadata(self) -> Dict[str, str]:
+        return dict(getattr(self.llm, "metadata", None) or {})
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "n_gpu_layers": getattr(self.llm, "n_gpu_layers", "nieznane"),
+            "n_threads": getattr(self.llm, "n_threads", "nieznane"),
+        }
+
+    def special_tokens(self) -> Dict[str, str]:
+        tokens = {}
+        for name, token in (("bos_token", self.llm.token_bos()), ("eos_token", self.llm.token_eos())):
+            try:
+                tokens[name] = self.llm.detokenize([token], special=True).decode("utf-8", errors="replace")
+            except TypeError:
+                # Starsze wersje llama-cpp-python nie zwracają tekstu tokenów specjalnych
+                tokens[name] = ""
+        return tokens
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self.llm.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens: Sequence[int]) -> bytes:
+        return self.llm.detokenize(tokens)
+
+    def kv_tokens(self) -> Sequence[int]:
+        return self.llm.input_ids[:self.llm.n_tokens]
+
+    def truncate(self, n_tokens: int) -> None:
+        self.llm.n_tokens = n_tokens
+
+    def prefill(self, tokens: Sequence[int]) -> None:
+        self.llm.eval(tokens)
+
+    def decode(self, token: int) -> None:
+        self.llm.eval([token])
+
+    def sample(self, top_k, top_p, temp, repeat_penalty, presence_penalty, frequency_penalty, grammar=None) -> int:
+        if grammar is not None and hasattr(self.llm, "_init_sampler"):
+            # llama-cpp-python 0.3+: Llama.sample() tworzy nowy sampler przy każdym
+            # wywołaniu, więc stan gramatyki trzeba trzymać we własnym samplerze
+            if self._grammar_sampler is None:
+                self._grammar_sampler = self.llm._init_sampler(
+                    top_k=top_k,
+                    top_p=top_p,
+                    temp=temp,
+                    repeat_penalty=repeat_penalty,
+                    presence_penalty=presence_penalty,
+                    frequency_penalty=frequency_penalty,
+                    grammar=grammar,
+                )
+            return self._grammar_sampler.sample(self.llm._ctx, -1)
+
+        kwargs = {"grammar": grammar} if grammar is not None else {}
+        return self.llm.sample(
+            top_k=top_k,
+            top_p=top_p,
+            temp=temp,
+            repeat_penalty=repeat_penalty,
+            presence_penalty=presence_penalty,
+            frequency_penalty=frequency_penalty,
+            **kwargs
+        )
+
+    def logits(self) -> Optional[Sequence[float]]:
+        if self.logits_all:
+            return self.llm.scores[self.llm.n_tokens - 1]
+        # Bez logits_all llama.cpp przechowuje tylko logity ostatniej pozycji -
+        # zwracamy widok bufora bez kopiowania
+        import numpy
+        return numpy.ctypeslib.as_array(self.llm._ctx.get_logits(), shape=(self.llm.n_vocab(),))
+
+    def start_sampling(self, grammar: Any = None) -> None:
+        self._grammar_sampler = None
+        # Starsze wersje przechowują stan parsowania w obiekcie gramatyki
+        reset = getattr(grammar, "reset", None)
+        if reset is not None:
+            reset()
+
+    def compile_grammar(self, kind: str, source: str) -> Any:
+        from llama_cpp import LlamaGrammar
+        if kind == "json_schema":
+            return LlamaGrammar.from_json_schema(source, verbose=False)
+        return LlamaGrammar.from_string(source, verbose=False)
+
+    def save_state(self) -> Any:
+        state = self.llm.save_state()
+        if not self.logits_all and len(state.scores) > 1:
+            # Bez logits_all potrzebne są tylko logity ostatniej pozycji, a llama-cpp-python
+            # kopiuje cały bufor n_batch x n_vocab. Jeden wiersz wystarcza - load_state
+            # rozgłasza go na wszystkie pozycje, a stan jest wielokrotnie mniejszy.
+            state.scores = state.scores[-1:].copy()
+        return state
+
+    def load_state(self, state: Any) -> None:
+        self.llm.load_state(state)
+
+    def embed(self, text: str) -> List[float]:
+        return self.llm.embed(text)
+
+    def close(self) -> None:
+        close = getattr(self.llm, "close", None)
+        if close is not None:
+            close()
+
+
+class FakeBackend(InferenceBackend):
+    """
+    Deterministyczny backend testowy, który nie wymaga pliku modelu.
+
+    Tokenami są bajty tekstu (plus tokeny BOS/EOS), a odpowiedzią jest zawsze
+    ten sam tekst, emitowany bajt po bajcie. Opóźnienia prefill i dekodowania
+    są symulowane przez time.sleep, co pozwala mierzyć i obciążać kolejkę
+    inferencji, strumieniowanie w GUI i warstwy cache na maszynach bez modeli.
+    """
+
+    requires_model_file = False
+
+    BOS = 0
+    EOS = 1
+    _BYTE_OFFSET = 2
+
+    def __init__(
+            self,
+            model_path: str = "fake",
+            context_size: int = 4096,
+            response: str = "To jest odpowiedź testowa. Zażółć gęślą jaźń.",
+            prefill_ms_per_token: float = 0.05,
+            decode_ms_per_token: float = 2.0,
+            embedding_size: int = 16,
+            grammar_response: str = "{}",
+            **params
+    ):
+        """
+        Args:
+            model_path: dowolna nazwa (plik nie jest odczytywany)
+            context_size: rozmiar kontekstu w tokenach
+            response: tekst generowany w odpowiedzi na każdy prompt
+            prefill_ms_per_token: symulowany czas przetwarzania tokenu prompta
+            decode_ms_per_token: symulowany czas jednego kroku dekodowania
+            embedding_size: rozmiar zwracanych embeddingów
+            grammar_response: tekst generowany, gdy podano gramatykę lub schemat JSON
+        """
+        super().__init__(model_path)
+        self.context_size = context_size
+        self.response = response.encode("utf-8")
+        self.grammar_response = grammar_response.encode("utf-8")
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.embedding_size = embedding_size
+        self._tokens: List[int] = []
+        self._grammar = None
+        # Pozycja końca ostatniego prompta - od niej liczona jest odpowiedź
+        self._prompt_end = 0
+
+    def n_ctx(self) -> int:
+        return self.context_size
+
+    def n_vocab(self) -> int:
+        return 256 + self._BYTE_OFFSET
+
+    def n_embd(self) -> int:
+        return self.embedding_size
+
+    def metadata(self) -> Dict[str, str]:
+        return {"general.architecture": "fake", "general.name": "fake"}
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "prefill_ms_per_token": self.prefill_ms_per_token,
+            "decode_ms_per_token": self.decode_ms_per_token,
+        }
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [byte + self._BYTE_OFFSET for byte in text]
+        return [self.BOS] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens: Sequence[int]) -> bytes:
+        return bytes(token - self._BYTE_OFFSET for token in tokens if token >= self._BYTE_OFFSET)
+
+    def is_end_token(self, token: int) -> bool:
+        return token == self.EOS
+
+    def kv_tokens(self) -> Sequence[int]:
+        return self._tokens
+
+    def truncate(self, n_tokens: int) -> None:
+        del self._tokens[n_tokens:]
+        self._prompt_end = min(self._prompt_end, n_tokens)
+
+    def _simulate(self, milliseconds: float) -> None:
+        if milliseconds > 0:
+            time.sleep(milliseconds / 1000)
+
+    def prefill(self, tokens: Sequence[int]) -> None:
+        if len(self._tokens) + len(tokens) > self.context_size:
+            raise ValueError("Przekroczono rozmiar kontekstu")
+        self._simulate(self.prefill_ms_per_token * len(tokens))
+        self._tokens.extend(tokens)
+        self._prompt_end = len(self._tokens)
+
+    def decode(self, token: int) -> None:
+        if len(self._tokens) >= self.context_size:
+            raise ValueError("Przekroczono rozmiar kontekstu")
+        self._simulate(self.decode_ms_per_token)
+        self._tokens.append(token)
+
+    def _next_token(self, grammar: Any) -> int:
+        response = self.response if grammar is None else self.grammar_response
+        position = len(self._tokens) - self._prompt_end
+        if position < len(response):
+            return response[position] + self._BYTE_OFFSET
+        return self.EOS
+
+    def sample(self, top_k, top_p, temp, repeat_penalty, presence_penalty, frequency_penalty, grammar=None) -> int:
+        return self._next_token(grammar)
+
+    def logits(self) -> Optional[Sequence[float]]:
+        # Następny token odpowiedzi jest zdecydowanie najbardziej prawdopodobny
+        values = [0.0] * self.n_vocab()
+        values[self.EOS] = 1.0
+        values[self._next_token(self._grammar)] = 8.0
+        return values
+
+    def start_sampling(self, grammar: Any = None) -> None:
+        self._grammar = grammar
+
+    def compile_grammar(self, kind: str, source: str) -> Any:
+        # Gramatyka nie jest interpretowana - z gramatyką backend zwraca grammar_response
+        return (kind, source)
+
+    def save_state(self) -> Any:
+        return list(self._tokens), self._prompt_end
+
+    def load_state(self, state: Any) -> None:
+        tokens, self._prompt_end = state
+        self._tokens = list(tokens)
+
+    def embed(self, text: str) -> List[float]:
+        # Wektor wyznaczony z SHA-256 tekstu, znormalizowany do długości 1
+        values = []
+        counter = 0
+        while len(values) < self.embedding_size:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(byte / 127.5 - 1.0 for byte in digest)
+            counter += 1
+        values = values[:self.embedding_size]
+        norm = math.sqrt(sum(value * value for value in values)) or 1.0
+        return [value / norm for value in values]
+
+
+# Maksymalna liczba skompilowanych gramatyk w pamięci
+GRAMMAR_CACHE_SIZE = 32
+
+_grammar_cache: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+_grammar_lock = threading.Lock()
+
+
+def compile_grammar_cached(
+        backend: InferenceBackend,
+        grammar: Optional[str] = None,
+        json_schema: Optional[Union[str, Dict[str, Any]]] = None
+) -> Any:
+    """
+    Kompiluje gramatykę GBNF lub schemat JSON, zapamiętując wynik według skrótu treści.
+
+    Ta sama gramatyka (np. schemat używany przy każdym zadaniu ekstrakcji)
+    jest kompilowana tylko raz, także po ponownym załadowaniu modelu.
+
+    Returns:
+        Skompilowana gramatyka lub None, jeśli nie podano żadnej
+    """
+    if grammar is None and json_schema is None:
+        return None
+    if grammar is not None and json_schema is not None:
+        raise ValueError("Podaj gramatykę albo schemat JSON, nie oba naraz")
+
+    if grammar is not None:
+        kind, source = "gbnf", grammar
+    else:
+        kind = "json_schema"
+        source = json_schema if isinstance(json_schema, str) else json.dumps(json_schema, sort_keys=True)
+
+    key = (type(backend).__name__, kind, hashlib.sha256(source.encode("utf-8")).hexdigest())
+    with _grammar_lock:
+        compiled = _grammar_cache.get(key)
+        if compiled is not None:
+            _grammar_cache.move_to_end(key)
+            return compiled
+
+    compiled = backend.compile_grammar(kind, source)
+    with _grammar_lock:
+        _grammar_cache[key] = compiled
+        while len(_grammar_cache) > GRAMMAR_CACHE_SIZE:
+            _grammar_cache.popitem(last=False)
+    return compiled
+
+
+# Rejestr dostępnych backendów: nazwa -> klasa
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    "llama_cpp": LlamaCppBackend,
+    "fake": FakeBackend,
+}
+
+
+def register_backend(name: str, backend_class: Type[InferenceBackend]) -> None:
+    """Rejestruje dodatkowy silnik inferencji pod podaną nazwą."""
+    BACKENDS[name] = backend_class
+
+
+def get_backend_class(name: Optional[str]) -> Type[InferenceBackend]:
+    """Zwraca klasę backendu o podanej nazwie (domyślnie llama_cpp)."""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Nieznany backend: {name} (dostępne: {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+def model_path_available(model_path: str, backend: Optional[str] = None) -> bool:
+    """Sprawdza, czy ścieżka modelu jest poprawna dla danego backendu."""
+    return not get_backend_class(backend).requires_model_file or os.path.exists(model_path)
@@ -0,0 +1,244 @@
+import glob
+import multiprocessing
+import os
+import queue
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from llm_backend import model_path_available
+
+
+def _parse_cpu_list(text: str) -> List[int]:
+    """Parsuje listę procesorów w formacie jądra Linux, np. '0-3,8-11'."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def detect_numa_nodes() -> List[List[int]]:
+    """
+    Wykrywa węzły NUMA i przypisane do nich procesory.
+
+    Uwzględniane są tylko procesory dostępne dla bieżącego procesu. Na
+    systemach bez informacji o NUMA (lub innych niż Linux) zwracany jest
+    jeden węzeł ze wszystkimi procesorami.
+
+    Returns:
+        Lista węzłów, każdy jako lista numerów procesorów
+    """
+    if hasattr(os, "sched_getaffinity"):
+        allowed = set(os.sched_getaffinity(0))
+    else:
+        allowed = set(range(multiprocessing.cpu_count()))
+
+    nodes = []
+    for node_dir in sorted(glob.glob("/sys/devices/system/node/node[0-9]*"),
+                           key=lambda path: int(path.rsplit("node", 1)[1])):
+        try:
+            with open(os.path.join(node_dir, "cpulist"), "r") as f:
+                cpus = [cpu for cpu in _parse_cpu_list(f.read()) if cpu in allowed]
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes.append(cpus)
+
+    if not nodes:
+        nodes = [sorted(allowed)]
+    return nodes
+
+
+def _batch_worker_main(
+        cpus: List[int],
+        model_kwargs: Dict[str, Any],
+        mode: str,
+        system_prompt: Optional[str],
+        generation_params: Dict[str, Any],
+        tasks,
+        results
+) -> None:
+    """Proces roboczy: ładuje model przypięty do procesorów węzła i przetwarza prompty."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    from llm_core import SimpleLLM
+    from llm_interface import SimpleLLMInterface
+
+    try:
+        interface = SimpleLLMInterface()
+        # Wagi modelu mapowane z pliku (mmap) są współdzielone przez wszystkie
+        # procesy poprzez pamięć podręczną stron systemu operacyjnego
+        interface.model = SimpleLLM(**dict(model_kwargs, n_threads=len(cpus), use_mmap=True))
+    except Exception as e:
+        results.put(("failed", None, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", None, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, prompt = task
+        try:
+            if mode == "chat":
+                response = interface.chat(prompt, system_prompt, **generation_params)
+            else:
+                response = interface._complete_text(prompt, **generation_params)
+            results.put(("done", index, response))
+        except Exception as e:
+            results.put(("error", index, f"{type(e).__name__}: {e}"))
+
+    interface.model.close()
+
+
+class BatchGenerator:
+    """
+    Równoległe generowanie wsadowe - jeden proces z modelem na każdy węzeł NUMA.
+
+    Każdy proces roboczy jest przypięty do procesorów swojego węzła i używa
+    tylu wątków, ile ma ten węzeł, dzięki czemu obliczenia nie przechodzą
+    przez połączenie między gniazdami procesorów. Prompty są rozdzielane
+    dynamicznie przez wspólną kolejkę, a wyniki zwracane w kolejności wejścia.
+    """
+
+    def __init__(
+            self,
+            model_path: str,
+            model_params: Optional[Dict[str, Any]] = None,
+            nodes: Optional[List[List[int]]] = None,
+            workers_per_node: int = 1
+    ):
+        """
+        Args:
+            model_path: ścieżka do lokalnego pliku modelu (GGUF format)
+            model_params: parametry modelu (jak w sekcji "model" konfiguracji)
+            nodes: listy procesorów dla procesów roboczych (domyślnie węzły NUMA)
+            workers_per_node: liczba procesów na węzeł (procesory węzła są dzielone)
+        """
+        model_params = model_params or {}
+        if not model_path_available(model_path, model_params.get("backend")):
+            raise FileNotFoundError(f"Model nie znaleziony: {model_path}")
+
+        self.model_path = model_path
+        self.model_kwargs = {
+            "model_path": model_path,
+            "context_size": model_params.get("context_size", 4096),
+            "n_gpu_layers": model_params.get("n_gpu_layers", -1),
+            "batch_size": model_params.get("batch_size", 512),
+            "f16_kv": model_params.get("f16_kv", True),
+            "rope_scaling_type": model_params.get("rope_scaling_type"),
+            "rope_freq_base": model_params.get("rope_freq_base", 10000.0),
+            "rope_freq_scale": model_params.get("rope_freq_scale", 1.0),
+            "backend": model_params.get("backend"),
+            "backend_options": model_params.get("backend_options"),
+        }
+
+        if nodes is None:
+            nodes = detect_numa_nodes()
+        self.cpu_sets = []
+        for cpus in nodes:
+            share = max(1, len(cpus) // workers_per_node)
+            for i in range(workers_per_node):
+                part = cpus[i * share:(i + 1) * share] or cpus
+                self.cpu_sets.append(part)
+
+    def run(
+            self,
+            prompts: Iterable[str],
+            mode: str = "complete",
+            system_prompt: Optional[str] = None,
+            **generation_params
+    ) -> Iterator[Tuple[int, str, Optional[str]]]:
+        """
+        Przetwarza strumień promptów i zwraca wyniki w kolejności wejścia.
+
+        Prompty są pobierane z iteratora na bieżąco, więc wejście nie musi
+        mieścić się w pamięci.
+
+        Args:
+            prompts: iterowalna kolekcja promptów
+            mode: "chat" lub "complete"
+            system_prompt: prompt systemowy dla trybu chat
+            **generation_params: parametry generowania
+
+        Returns:
+            Iterator krotek (indeks, odpowiedź, błąd lub None)
+        """
+        generation_params = dict(generation_params, stream=False)
+        mp = multiprocessing.get_context("spawn")
+        tasks = mp.Queue()
+        results = mp.Queue()
+
+        workers = []
+        for cpus in self.cpu_sets:
+            process = mp.Process(
+                target=_batch_worker_main,
+                args=(cpus, self.model_kwargs, mode, system_prompt, generation_params, tasks, results),
+                daemon=True
+            )
+            process.start()
+            workers.append(process)
+
+        try:
+            # Poczekaj, aż wszystkie procesy załadują model
+            for _ in workers:
+                status, _, error = self._get_result(results, workers)
+                if status == "failed":
+                    raise RuntimeError(f"Proces roboczy nie załadował modelu: {error}")
+
+            # Ogranicz liczbę zadań w locie, aby nie wczytywać całego wejścia naraz
+            max_in_flight = len(workers) * 4
+            prompt_iter = enumerate(prompts)
+            in_flight = 0
+            exhausted = False
+            next_index = 0
+            ready = {}
+
+            while True:
+                while not exhausted and in_flight < max_in_flight:
+                    try:
+                        tasks.put(next(prompt_iter))
+                        in_flight += 1
+                    except StopIteration:
+                        exhausted = True
+
+                if in_flight == 0:
+                    break
+
+                status, index, payload = self._get_result(results, workers)
+                in_flight -= 1
+                if status == "done":
+                    ready[index] = (payload, None)
+                else:
+                    ready[index] = ("", payload)
+
+                # Zwróć wszystkie wyniki, które mogą już wyjść w kolejności
+                while next_index in ready:
+                    response, error = ready.pop(next_index)
+                    yield next_index, response, error
+                    next_index += 1
+        finally:
+            for _ in workers:
+                tasks.put(None)
+            for process in workers:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
+
+    @staticmethod
+    def _get_result(results, workers) -> Tuple[str, Optional[int], Any]:
+        """Odbiera wynik od procesów roboczych, wykrywając ich awarię."""
+        while True:
+            try:
+                return results.get(timeout=0.5)
+            except queue.Empty:
+                dead = [p for p in workers if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"Proces roboczy zakończył się nieoczekiwanie (kod {dead[0].exitcode})"
+                    )
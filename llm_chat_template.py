@@ -0,0 +1,242 @@
+import functools
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Format używany, gdy model nie ma szablonu i nie rozpoznano architektury
+DEFAULT_FORMAT = "llama2"
+
+# Wbudowane formaty dla architektur z metadanych GGUF (general.architecture)
+ARCHITECTURE_FORMATS = {
+    "llama": "llama2",
+    "mistral": "llama2",
+    "qwen": "chatml",
+    "qwen2": "chatml",
+    "qwen2moe": "chatml",
+    "qwen3": "chatml",
+    "internlm2": "chatml",
+    "gemma": "gemma",
+    "gemma2": "gemma",
+    "gemma3": "gemma",
+    "phi3": "phi3",
+}
+
+# Znaczniki w treści szablonu Jinja pozwalające dobrać format bez biblioteki jinja2
+_TEMPLATE_MARKERS = [
+    ("<|im_start|>", "chatml"),
+    ("<|start_header_id|>", "llama3"),
+    ("<start_of_turn>", "gemma"),
+    ("<|user|>", "phi3"),
+    ("[INST]", "llama2"),
+]
+
+Message = Dict[str, str]
+
+
+def _system_and_first_user(messages: Sequence[Message], index: int) -> str:
+    """Treść wiadomości użytkownika, do której dołączany jest prompt systemowy."""
+    content = messages[index]["content"]
+    if index == 1 and messages[0]["role"] == "system" and messages[0]["content"]:
+        return f"{messages[0]['content']}\n\n{content}"
+    return content
+
+
+def _llama2_segment(messages: Sequence[Message], index: int, bos: str, eos: str) -> str:
+    message = messages[index]
+    if message["role"] == "system":
+        return ""
+    if message["role"] == "user":
+        # Przed pierwszą turą BOS dodaje tokenizer, przed kolejnymi wstawiamy go sami
+        first_turn = index == 0 or (index == 1 and messages[0]["role"] == "system")
+        prefix = "" if first_turn else bos
+        return f"{prefix}[INST] {_system_and_first_user(messages, index)} [/INST]"
+    return f" {message['content']}{eos}"
+
+
+def _chatml_segment(messages: Sequence[Message], index: int, bos: str, eos: str) -> str:
+    message = messages[index]
+    return f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n"
+
+
+def _llama3_segment(messages: Sequence[Message], index: int, bos: str, eos: str) -> str:
+    message = messages[index]
+    return f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n{message['content'].strip()}<|eot_id|>"
+
+
+def _gemma_segment(messages: Sequence[Message], index: int, bos: str, eos: str) -> str:
+    message = messages[index]
+    if message["role"] == "system":
+        return ""
+    role = "model" if message["role"] == "assistant" else "user"
+    return f"<start_of_turn>{role}\n{_system_and_first_user(messages, index)}<end_of_turn>\n"
+
+
+def _phi3_segment(messages: Sequence[Message], index: int, bos: str, eos: str) -> str:
+    message = messages[index]
+    return f"<|{message['role']}|>\n{message['content']}<|end|>\n"
+
+
+# Wbudowane formaty: nazwa -> (segment dla jednej wiadomości, prompt generowania)
+BUILTIN_FORMATS: Dict[str, Tuple[Callable[..., str], str]] = {
+    "llama2": (_llama2_segment, ""),
+    "chatml": (_chatml_segment, "<|im_start|>assistant\n"),
+    "llama3": (_llama3_segment, "<|start_header_id|>assistant<|end_header_id|>\n\n"),
+    "gemma": (_gemma_segment, "<start_of_turn>model\n"),
+    "phi3": (_phi3_segment, "<|assistant|>\n"),
+}
+
+
+def _raise_exception(message: str):
+    raise ValueError(message)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_template(source: str):
+    """
+    Kompiluje szablon Jinja z metadanych GGUF (wynik jest zapamiętywany).
+
+    Returns:
+        Skompilowany szablon lub None, jeśli biblioteka jinja2 nie jest dostępna
+    """
+    try:
+        from jinja2.sandbox import ImmutableSandboxedEnvironment
+    except ImportError:
+        return None
+
+    environment = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+    environment.globals["raise_exception"] = _raise_exception
+    return environment.from_string(source)
+
+
+def detect_format(template_source: Optional[str], architecture: Optional[str]) -> str:
+    """Dobiera wbudowany format na podstawie treści szablonu lub architektury modelu."""
+    if template_source:
+        for marker, name in _TEMPLATE_MARKERS:
+            if marker in template_source:
+                return name
+    return ARCHITECTURE_FORMATS.get(architecture or "", DEFAULT_FORMAT)
+
+
+class ChatTemplate:
+    """
+    Formatuje rozmowę zgodnie z szablonem czatu modelu.
+
+    Szablon Jinja z metadanych GGUF (``tokenizer.chat_template``) jest
+    kompilowany raz i zapamiętywany. Bez jinja2 lub gdy szablon zgłosi błąd,
+    używany jest wbudowany format dobrany do szablonu lub architektury.
+
+    Wbudowane formaty renderują kolejne tury przyrostowo: tekst historii jest
+    zapamiętywany i dopisywane są tylko nowe wiadomości. Początek prompta jest
+    więc identyczny bajt w bajt z poprzednim (wraz z odpowiedzią modelu),
+    dzięki czemu KV cache może zostać ponownie wykorzystany.
+    """
+
+    def __init__(
+            self,
+            template_source: Optional[str] = None,
+            architecture: Optional[str] = None,
+            bos_token: str = "",
+            eos_token: str = ""
+    ):
+        """
+        Args:
+            template_source: szablon Jinja z metadanych modelu (lub None)
+            architecture: architektura modelu (general.architecture)
+            bos_token: tekst tokenu BOS używany między turami
+            eos_token: tekst tokenu EOS kończącego odpowiedzi w historii
+        """
+        self.template_source = template_source
+        self.format_name = detect_format(template_source, architecture)
+        self.bos_token = bos_token
+        self.eos_token = eos_token
+        self._compiled = compile_template(template_source) if template_source else None
+
+        # Zapamiętana historia (bez promptu generowania) i jej tekst
+        self._cached_messages: Tuple[Tuple[str, str], ...] = ()
+        self._cached_text = ""
+
+    @classmethod
+    def from_model_info(cls, info: Dict[str, Any]) -> "ChatTemplate":
+        """Tworzy szablon z informacji zwróconych przez get_chat_template_info() modelu."""
+        return cls(
+            template_source=info.get("template"),
+            architecture=info.get("architecture"),
+            bos_token=info.get("bos_token", ""),
+            eos_token=info.get("eos_token", ""),
+        )
+
+    @property
+    def name(self) -> str:
+        """Nazwa używanego formatu (do wyświetlania)."""
+        return "gguf" if self._compiled is not None else self.format_name
+
+    def render(self, messages: Sequence[Message], add_generation_prompt: bool = True) -> str:
+        """
+        Renderuje rozmowę do tekstu prompta.
+
+        Args:
+            messages: lista wiadomości {"role": ..., "content": ...}
+            add_generation_prompt: czy dopisać początek odpowiedzi asystenta
+
+        Returns:
+            Tekst prompta (bez tokenu BOS - dodaje go tokenizer)
+        """
+        if self._compiled is not None:
+            try:
+                return self._render_jinja(messages, add_generation_prompt)
+            except Exception as e:
+                print(f"Szablon czatu modelu zgłosił błąd ({e}), używam formatu {self.format_name}")
+                self._compiled = None
+
+        return self._render_builtin(messages, add_generation_prompt)
+
+    def _render_jinja(self, messages: Sequence[Message], add_generation_prompt: bool) -> str:
+        # Szablon Jinja renderujemy w całości (to szybkie), a BOS pomijamy, bo dodaje go tokenizer
+        text = self._compiled.render(
+            messages=list(messages),
+            add_generation_prompt=add_generation_prompt,
+            bos_token=self.bos_token,
+            eos_token=self.eos_token,
+        )
+        if self.bos_token and text.startswith(self.bos_token):
+            text = text[len(self.bos_token):]
+        return text
+
+    def _render_builtin(self, messages: Sequence[Message], add_generation_prompt: bool) -> str:
+        segment, generation_prompt = BUILTIN_FORMATS[self.format_name]
+        key = tuple((message["role"], message["content"]) for message in messages)
+
+        # Użyj zapamiętanego tekstu, jeśli poprzednia rozmowa jest początkiem obecnej
+        cached = len(self._cached_messages)
+        if cached and key[:cached] == self._cached_messages:
+            parts = [self._cached_text]
+            start = cached
+        else:
+            parts = []
+            start = 0
+        for index in range(start, len(messages)):
+            parts.append(segment(messages, index, self.bos_token, self.eos_token))
+
+        text = "".join(parts)
+        self._cached_messages, self._cached_text = key, text
+        return text + generation_prompt if add_generation_prompt else text
+
+
+def build_messages(
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[Sequence[Message]] = None
+) -> List[Message]:
+    """Składa listę wiadomości: prompt systemowy, wcześniejsze tury i nowe pytanie."""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    turns = [message for message in history or [] if message.get("role") in ("user", "assistant")]
+    for index, message in enumerate(turns):
+        # Pomijamy pytania bez odpowiedzi (np. przerwane generowanie), aby role się przeplatały
+        if message["role"] == "user":
+            if index + 1 >= len(turns) or turns[index + 1]["role"] != "assistant":
+                continue
+        elif not messages or messages[-1]["role"] != "user":
+            continue
+        messages.append({"role": message["role"], "content": message["content"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
@@ -1,17 +1,337 @@
+import codecs
+import heapq
+import json
+import math
 import os
+import re
 import sys
 import time
+import uuid
+from array import array
 from typing import Dict, List, Optional, Union, Generator, Any
 
-# sprawdzamy czy mamy zainstalowaną bibliotekę llama-cpp-python
-try:
-    from llama_cpp import Llama
-except ImportError:
-    print("Instalowanie wymaganych bibliotek...")
-    import subprocess
+import llm_tokenizer
+import llm_trace
+from llm_backend import InferenceBackend, compile_grammar_cached, get_backend_class
+from llm_kv_store import SessionStateStore
 
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "llama-cpp-python"])
-    from llama_cpp import Llama
+# Sesja, na którą model przełącza się przy liczeniu embeddingów (llama.cpp czyści wtedy KV cache)
+EMBEDDING_SESSION = "__embedding__"
+
+# Domyślna sesja zadań wsadowych - wywłaszczona odpowiedź wsadowa zachowuje w niej
+# swój KV cache, gdy model obsługuje zapytanie interaktywne w innej sesji
+BATCH_SESSION = "__batch__"
+
+# Przy terminie (deadline) z zakończeniem na granicy zdania: liczba tokenów przed terminem,
+# od której generowanie kończy się na pierwszym końcu zdania
+_SENTENCE_WINDOW_TOKENS = 32
+# Liczba tokenów bieżącej odpowiedzi, od której czas tokenu jest liczony z jej własnego tempa
+_LIVE_SPEED_MIN_TOKENS = 4
+# Koniec zdania: znak końca (ewentualnie z cudzysłowem lub nawiasem) albo nowa linia
+_SENTENCE_END = re.compile(r'(?:[.!?…]["\'”»)\]]*|\n)\s*$')
+
+
+class GenerationMetrics:
+    """Pomiary czasu i liczby tokenów dla pojedynczego generowania."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.prefill_ms = 0.0
+        self.time_to_first_token_ms = 0.0
+        self.decode_ms = 0.0
+        self.sampling_ms = 0.0
+        self.total_ms = 0.0
+        self.finish_reason: Optional[str] = None
+
+    @property
+    def decode_tokens_per_sec(self) -> float:
+        """Szybkość generowania liczona od końca prefill do końca generowania."""
+        decode_phase_ms = self.total_ms - self.prefill_ms
+        if self.completion_tokens == 0 or decode_phase_ms <= 0:
+            return 0.0
+        return self.completion_tokens * 1000.0 / decode_phase_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Zwraca pomiary jako słownik (np. do zapisu w dzienniku JSONL)."""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prefill_ms": round(self.prefill_ms, 3),
+            "time_to_first_token_ms": round(self.time_to_first_token_ms, 3),
+            "decode_ms": round(self.decode_ms, 3),
+            "sampling_ms": round(self.sampling_ms, 3),
+            "total_ms": round(self.total_ms, 3),
+            "decode_tokens_per_sec": round(self.decode_tokens_per_sec, 3),
+            "finish_reason": self.finish_reason,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GenerationMetrics":
+        """Odtwarza pomiary ze słownika utworzonego przez to_dict()."""
+        metrics = cls()
+        for key, value in data.items():
+            if key != "decode_tokens_per_sec":
+                setattr(metrics, key, value)
+        return metrics
+
+    def summary(self) -> str:
+        """Krótki opis pomiarów do paska stanu."""
+        return (f"{self.decode_tokens_per_sec:.1f} tok/s, TTFT {self.time_to_first_token_ms:.0f} ms, "
+                f"prompt {self.prompt_tokens} tok. ({self.cached_tokens} z cache), "
+                f"odpowiedź {self.completion_tokens} tok., razem {self.total_ms / 1000:.2f} s")
+
+
+class TokenLogprobs:
+    """
+    Log-prawdopodobieństwa kolejnych wygenerowanych tokenów i (opcjonalnie)
+    top-k najbardziej prawdopodobnych alternatyw w każdej pozycji.
+
+    Wartości pochodzą z rozkładu modelu (log-softmax logitów, przed
+    temperaturą i obcięciem top-k/top-p) i są liczone w trakcie próbkowania
+    z logitów ostatniej pozycji, więc nie wymagają logits_all. Przechowywane
+    są w zwartych tablicach array - 4 bajty na identyfikator i 4 na wartość;
+    to_numpy() udostępnia je jako tablicę strukturalną NumPy bez pętli
+    w Pythonie.
+    """
+
+    __slots__ = ("top_k", "tokens", "logprobs", "top_tokens", "top_logprobs")
+
+    def __init__(self, top_k: int = 0):
+        """
+        Args:
+            top_k: liczba alternatyw zapisywanych dla każdej pozycji (0 - bez alternatyw)
+        """
+        self.top_k = max(0, top_k)
+        self.tokens = array('i')
+        self.logprobs = array('f')
+        # Alternatywy kolejnych pozycji zapisane jedna za drugą (top_k na pozycję)
+        self.top_tokens = array('i')
+        self.top_logprobs = array('f')
+
+    def record(self, logits, token: int) -> None:
+        """Dopisuje wygenerowany token na podstawie logitów pozycji, z której go wybrano."""
+        logprob, top_tokens, top_logprobs = _log_softmax_top(logits, token, self.top_k)
+        self.tokens.append(token)
+        self.logprobs.append(logprob)
+        if self.top_k:
+            self.top_tokens.extend(top_tokens)
+            self.top_logprobs.extend(top_logprobs)
+
+    @property
+    def total(self) -> float:
+        """Suma log-prawdopodobieństw (log-prawdopodobieństwo całej odpowiedzi)."""
+        return math.fsum(self.logprobs)
+
+    @property
+    def mean(self) -> float:
+        """Średnie log-prawdopodobieństwo tokenu (0.0 dla pustej odpowiedzi)."""
+        return self.total / len(self.logprobs) if self.logprobs else 0.0
+
+    @property
+    def perplexity(self) -> float:
+        """Perpleksja odpowiedzi: exp(-średnie log-prawdopodobieństwo)."""
+        return math.exp(-self.mean)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def alternatives(self, position: int) -> List[tuple]:
+        """Lista par (token, log-prawdopodobieństwo) top-k dla pozycji, od najbardziej prawdopodobnej."""
+        start = position * self.top_k
+        end = start + self.top_k
+        return list(zip(self.top_tokens[start:end], self.top_logprobs[start:end]))
+
+    def to_numpy(self):
+        """
+        Zwraca wartości jako tablicę strukturalną NumPy z polami "token",
+        "logprob" oraz (dla top_k > 0) "top_tokens" i "top_logprobs"
+        o kształcie (top_k,). Dane kopiowane są bezpośrednio z buforów.
+        """
+        import numpy
+        fields = [("token", numpy.int32), ("logprob", numpy.float32)]
+        if self.top_k:
+            fields += [("top_tokens", numpy.int32, (self.top_k,)), ("top_logprobs", numpy.float32, (self.top_k,))]
+        result = numpy.empty(len(self.tokens), dtype=fields)
+        result["token"] = numpy.frombuffer(self.tokens, dtype=numpy.int32)
+        result["logprob"] = numpy.frombuffer(self.logprobs, dtype=numpy.float32)
+        if self.top_k:
+            shape = (len(self.tokens), self.top_k)
+            result["top_tokens"] = numpy.frombuffer(self.top_tokens, dtype=numpy.int32).reshape(shape)
+            result["top_logprobs"] = numpy.frombuffer(self.top_logprobs, dtype=numpy.float32).reshape(shape)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Zwraca wartości jako słownik (np. do odpowiedzi w formacie JSON)."""
+        data = {
+            "tokens": self.tokens.tolist(),
+            "token_logprobs": [round(value, 6) for value in self.logprobs],
+            "total_logprob": round(self.total, 6),
+        }
+        if self.top_k:
+            data["top_logprobs"] = [
+                [[token, round(value, 6)] for token, value in self.alternatives(position)]
+                for position in range(len(self.tokens))
+            ]
+        return data
+
+
+def _log_softmax_top(logits, token: int, top_k: int = 0):
+    """
+    Log-softmax logitów w pozycji tokenu oraz top-k najbardziej prawdopodobnych tokenów.
+
+    Returns:
+        (log-prawdopodobieństwo tokenu, identyfikatory top-k, ich log-prawdopodobieństwa)
+    """
+    if hasattr(logits, "dtype"):
+        # Tablica NumPy z llama.cpp - liczymy wektorowo, bez kopiowania całego rozkładu
+        import numpy
+        maximum = float(logits.max())
+        normalizer = maximum + math.log(float(numpy.exp(logits - maximum).sum()))
+        logprob = float(logits[token]) - normalizer
+        if not top_k:
+            return logprob, (), ()
+        top = numpy.argpartition(logits, -top_k)[-top_k:]
+        top = top[numpy.argsort(logits[top])[::-1]]
+        return logprob, top.tolist(), (logits[top] - normalizer).tolist()
+
+    maximum = max(logits)
+    normalizer = maximum + math.log(math.fsum(math.exp(value - maximum) for value in logits))
+    logprob = logits[token] - normalizer
+    if not top_k:
+        return logprob, (), ()
+    top = heapq.nlargest(top_k, range(len(logits)), key=logits.__getitem__)
+    return logprob, top, [logits[index] - normalizer for index in top]
+
+
+class GenerationResult(str):
+    """Wygenerowany tekst z dołączonymi pomiarami - zachowuje się jak zwykły str."""
+
+    metrics: GenerationMetrics
+    # Log-prawdopodobieństwa tokenów (tylko gdy o nie poproszono lub przy n > 1)
+    logprobs: Optional[TokenLogprobs] = None
+
+
+class GenerationStream:
+    """
+    Generator fragmentów odpowiedzi z dołączonymi pomiarami.
+
+    Pomiary w atrybucie `metrics` (i log-prawdopodobieństwa w `logprobs`)
+    uzupełniane są w trakcie generowania i są kompletne po wyczerpaniu strumienia.
+    Atrybut `preemptible` oznacza, że między fragmentami model może obsłużyć
+    inne zapytanie - strumień sam odtworzy swój KV cache przy wznowieniu.
+    """
+
+    def __init__(
+            self,
+            generator: Generator[str, None, None],
+            metrics: GenerationMetrics,
+            logprobs: Optional[TokenLogprobs] = None,
+            preemptible: bool = False
+    ):
+        self._generator = generator
+        self.metrics = metrics
+        # Log-prawdopodobieństwa tokenów (jeśli o nie poproszono), kompletne po wyczerpaniu strumienia
+        self.logprobs = logprobs
+        self.preemptible = preemptible
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._generator)
+
+    def close(self) -> None:
+        self._generator.close()
+
+
+def _partial_stop_length(text: str, stop: List[str]) -> int:
+    """Zwraca długość końcówki tekstu, która może być początkiem sekwencji stop."""
+    longest = 0
+    for sequence in stop:
+        for length in range(min(len(sequence) - 1, len(text)), longest, -1):
+            if text.endswith(sequence[:length]):
+                longest = length
+                break
+    return longest
+
+
+def _incomplete_utf8_length(data) -> int:
+    """Zwraca liczbę bajtów na końcu danych, które tworzą niepełny znak UTF-8."""
+    size = len(data)
+    for back in range(1, min(4, size) + 1):
+        byte = data[size - back]
+        if byte & 0xC0 != 0x80:
+            # Bajt początkowy - długość znaku wynika z jego najstarszych bitów
+            if byte >= 0xF0:
+                needed = 4
+            elif byte >= 0xE0:
+                needed = 3
+            elif byte >= 0xC0:
+                needed = 2
+            else:
+                needed = 1
+            return back if needed > back else 0
+    # Same bajty kontynuacji - niepoprawne dane, dekodujemy je z zamianą
+    return 0
+
+
+class StreamingDetokenizer:
+    """
+    Zamienia kolejne tokeny na tekst, zwracając tylko pełne znaki UTF-8.
+
+    Znaki wielobajtowe (np. polskie litery) bywają rozdzielone między tokeny -
+    niepełna końcówka czeka w małym buforze bytearray na kolejny token. Bajty
+    tokenów są zapamiętywane w słowniku modelu, a dekodowanie korzysta
+    z memoryview, więc dla typowego tokenu nie powstają dodatkowe kopie.
+    """
+
+    __slots__ = ("backend", "pieces", "_buffer")
+
+    def __init__(self, backend: InferenceBackend, pieces: Optional[Dict[int, bytes]] = None):
+        """
+        Args:
+            backend: backend modelu zamieniający tokeny na bajty
+            pieces: współdzielony słownik token -> bajty (pamięć podręczna)
+        """
+        self.backend = backend
+        self.pieces = pieces if pieces is not None else {}
+        self._buffer = bytearray()
+
+    def feed(self, token: int) -> str:
+        """Dodaje token i zwraca nowe pełne znaki (może być pusty napis)."""
+        piece = self.pieces.get(token)
+        if piece is None:
+            piece = self.pieces[token] = bytes(self.backend.detokenize([token]))
+
+        if self._buffer:
+            self._buffer += piece
+            data = self._buffer
+        else:
+            data = piece
+
+        incomplete = _incomplete_utf8_length(data)
+        if not incomplete:
+            text = codecs.utf_8_decode(data, "replace", True)[0]
+            if data is self._buffer:
+                self._buffer.clear()
+            return text
+
+        complete = len(data) - incomplete
+        text = codecs.utf_8_decode(memoryview(data)[:complete], "replace", True)[0] if complete else ""
+        if data is self._buffer:
+            del self._buffer[:complete]
+        else:
+            self._buffer += memoryview(piece)[complete:]
+        return text
+
+    def flush(self) -> str:
+        """Zwraca pozostałe bajty (niepełny znak zostaje zastąpiony znakiem zastępczym)."""
+        text = codecs.utf_8_decode(self._buffer, "replace", True)[0]
+        self._buffer.clear()
+        return text
 
 
 class SimpleLLM:
@@ -31,7 +351,11 @@ class SimpleLLM:
             rope_scaling_type: Optional[str] = None,
             rope_freq_base: float = 10000.0,
             rope_freq_scale: float = 1.0,
-            verbose: bool = False
+            verbose: bool = False,
+            metrics_log: Optional[str] = None,
+            backend: Optional[str] = None,
+            backend_options: Optional[Dict[str, Any]] = None,
+            session_cache: Optional[Dict[str, Any]] = None
     ):
         """
         Inicjalizuje prosty interfejs do modelu LLM.
@@ -52,6 +376,11 @@ class SimpleLLM:
             rope_freq_base: bazowa częstotliwość dla RoPE
             rope_freq_scale: skala częstotliwości dla RoPE
             verbose: czy wyświetlać szczegółowe informacje
+            metrics_log: opcjonalny plik JSONL, do którego dopisywane są pomiary generowania
+            backend: nazwa silnika inferencji z llm_backend.BACKENDS (domyślnie "llama_cpp")
+            backend_options: dodatkowe parametry przekazywane do backendu
+            session_cache: ustawienia magazynu KV cache bezczynnych sesji ("memory_mb",
+                "spill_dir", "disk_mb", "compress"; patrz llm_kv_store.SessionStateStore)
         """
         # Jeśli nie podano liczby wątków, użyj wszystkich dostępnych
         if n_threads is None:
@@ -61,45 +390,51 @@ class SimpleLLM:
         self.verbose = verbose
         start_time = time.time()
 
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model nie znaleziony: {model_path}")
-
         if self.verbose:
             print(f"Ładowanie modelu: {model_path}")
             print(f"Parametry: kontekst={context_size}, GPU warstwy={n_gpu_layers}, "
                   f"wątki={n_threads}, batch={batch_size}")
 
-        # Przygotowanie parametrów RoPE
-        rope_scaling = None
-        if rope_scaling_type:
-            rope_scaling = {
-                "type": rope_scaling_type,
-                "factor": rope_freq_scale
-            }
-
-        # Inicjalizacja modelu z lokalnego pliku
-        self.llm = Llama(
+        # Inicjalizacja silnika inferencji (domyślnie llama.cpp z lokalnego pliku)
+        backend_class = get_backend_class(backend)
+        self.backend: InferenceBackend = backend_class(
             model_path=model_path,
-            n_ctx=context_size,
+            context_size=context_size,
             n_gpu_layers=n_gpu_layers,
             n_threads=n_threads,
-            n_batch=batch_size,
+            batch_size=batch_size,
             f16_kv=f16_kv,
             logits_all=logits_all,
             vocab_only=vocab_only,
             use_mmap=use_mmap,
             use_mlock=use_mlock,
             embedding=embedding,
-            rope_scaling=rope_scaling,
+            rope_scaling_type=rope_scaling_type,
             rope_freq_base=rope_freq_base,
+            rope_freq_scale=rope_freq_scale,
+            **(backend_options or {})
         )
 
         self.model_path = model_path
         self.model_name = os.path.basename(model_path)
+        self.metrics_log = metrics_log
+        self.last_metrics: Optional[GenerationMetrics] = None
+        self._vocab_hash: Optional[str] = None
+        # Bajty tekstu kolejnych tokenów (wspólne dla wszystkich generowań)
+        self._token_pieces: Dict[int, bytes] = {}
+        # Sesje rozmów: KV cache aktywnej sesji jest w kontekście modelu,
+        # pozostałych - w magazynie stanów (RAM z budżetem, nadmiar na dysku)
+        self._active_session: Optional[str] = None
+        self._session_states = self._create_session_store(session_cache or {})
+        # Znacznik generowania, do którego należy zawartość KV cache (None - do żadnego);
+        # wznowiony strumień po zmianie znacznika odtwarza swój kontekst
+        self._kv_owner: Optional[object] = None
+        # Średni czas wygenerowania tokenu (próbkowanie i dekodowanie) z poprzednich odpowiedzi
+        self._token_seconds: Optional[float] = None
 
+        self.load_time = time.time() - start_time
         if self.verbose:
-            load_time = time.time() - start_time
-            print(f"Model załadowany w {load_time:.2f} sekund")
+            print(f"Model załadowany w {self.load_time:.2f} sekund")
 
     def generate(
             self,
@@ -113,8 +448,15 @@ class SimpleLLM:
             frequency_penalty: float = 0.0,
             stream: bool = False,
             stop: List[str] = None,
-            echo: bool = False
-    ) -> Union[str, Generator[str, None, None], dict]:
+            echo: bool = False,
+            grammar: Optional[str] = None,
+            json_schema: Optional[Union[str, Dict[str, Any]]] = None,
+            n: int = 1,
+            logprobs: Optional[int] = None,
+            session: Optional[str] = None,
+            deadline: Optional[float] = None,
+            deadline_sentence: bool = False
+    ) -> Union[str, List[str], Generator[str, None, None], dict]:
         """
         Generuje odpowiedź na podstawie podanego prompta.
 
@@ -130,14 +472,37 @@ class SimpleLLM:
             stream: czy strumieniować odpowiedź
             stop: lista sekwencji, które zatrzymują generowanie
             echo: czy załączyć prompt w wyjściu
+            grammar: gramatyka GBNF, do której musi pasować odpowiedź
+            json_schema: schemat JSON (słownik lub tekst), do którego musi pasować odpowiedź
+            n: liczba niezależnie próbkowanych odpowiedzi na ten sam prompt
+            logprobs: liczba alternatyw top-k zapisywanych dla każdego tokenu wraz
+                z jego log-prawdopodobieństwem (0 - tylko log-prawdopodobieństwa,
+                None - bez zapisu; przy n > 1 zapisywane są zawsze)
+            session: sesja rozmowy, której KV cache ma zostać użyty (patrz switch_session)
+            deadline: termin odpowiedzi (czas time.time()); generowanie kończy się,
+                gdy kolejny token nie zdążyłby powstać przed terminem (finish_reason "deadline")
+            deadline_sentence: czy tuż przed terminem zakończyć odpowiedź na końcu zdania
 
         Returns:
-            wygenerowany tekst, generator tekstu lub pełny słownik odpowiedzi
+            wygenerowany tekst (GenerationResult), strumień tekstu (GenerationStream)
+            lub pełny słownik odpowiedzi; pomiary dostępne są w atrybucie `metrics`.
+            Dla n > 1 zwracana jest lista GenerationResult (w kolejności próbkowania)
+            z log-prawdopodobieństwami w atrybucie `logprobs`, a słownik (echo)
+            zawiera n pozycji w "choices". Log-prawdopodobieństwa (TokenLogprobs)
+            dostępne są w atrybucie `logprobs` wyniku lub strumienia.
         """
+        if n < 1:
+            raise ValueError("Liczba odpowiedzi n musi być dodatnia")
+        if stream and n > 1:
+            raise ValueError("Strumieniowanie obsługuje tylko jedną odpowiedź (n=1)")
+
         if self.verbose:
             print(f"Generowanie z parametrami: max_tokens={max_tokens}, temp={temperature}, "
                   f"top_p={top_p}, top_k={top_k}, repeat_penalty={repeat_penalty}")
 
+        # Gramatyka jest kompilowana raz i zapamiętywana według skrótu treści
+        compiled_grammar = compile_grammar_cached(self.backend, grammar, json_schema)
+
         if stream:
             return self._stream_generate(
                 prompt=prompt,
@@ -149,11 +514,24 @@ class SimpleLLM:
                 presence_penalty=presence_penalty,
                 frequency_penalty=frequency_penalty,
                 stop=stop,
-                echo=echo
+                echo=echo,
+                grammar=compiled_grammar,
+                logprobs=TokenLogprobs(logprobs) if logprobs is not None else None,
+                session=session,
+                deadline=deadline,
+                deadline_sentence=deadline_sentence
             )
-        else:
-            output = self.llm(
+
+        # Prompt jest przetwarzany tylko przy pierwszej odpowiedzi: kolejne zaczynają
+        # od KV cache prompta (_reuse_prefix odrzuca jedynie poprzednią odpowiedź
+        # i ponownie przetwarza ostatni token prompta, aby odtworzyć jego logity)
+        results = []
+        for _ in range(n):
+            metrics = GenerationMetrics()
+            token_logprobs = TokenLogprobs(logprobs or 0) if logprobs is not None or n > 1 else None
+            text = "".join(self._generate_chunks(
                 prompt,
+                metrics,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
@@ -162,10 +540,21 @@ class SimpleLLM:
                 presence_penalty=presence_penalty,
                 frequency_penalty=frequency_penalty,
                 stop=stop,
-                echo=echo,
-            )
-            # Zwróć pełny słownik odpowiedzi lub tylko wygenerowany tekst
-            return output if echo else output["choices"][0]["text"]
+                grammar=compiled_grammar,
+                logprobs=token_logprobs,
+                session=session,
+                deadline=deadline,
+                deadline_sentence=deadline_sentence
+            ))
+            result = GenerationResult(text)
+            result.metrics = metrics
+            result.logprobs = token_logprobs
+            results.append(result)
+
+        # Zwróć pełny słownik odpowiedzi lub tylko wygenerowany tekst
+        if echo:
+            return self._completion_dict(prompt, results)
+        return results if n > 1 else results[0]
 
     def _stream_generate(
             self,
@@ -178,11 +567,22 @@ class SimpleLLM:
             presence_penalty: float,
             frequency_penalty: float,
             stop: List[str] = None,
-            echo: bool = False
-    ) -> Generator[str, None, None]:
+            echo: bool = False,
+            grammar: Any = None,
+            logprobs: Optional[TokenLogprobs] = None,
+            session: Optional[str] = None,
+            deadline: Optional[float] = None,
+            deadline_sentence: bool = False
+    ) -> GenerationStream:
         """Generuje odpowiedź w trybie strumieniowym."""
-        for output in self.llm(
+        metrics = GenerationMetrics()
+
+        def chunks():
+            if echo:
+                yield prompt
+            yield from self._generate_chunks(
                 prompt,
+                metrics,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
@@ -191,36 +591,437 @@ class SimpleLLM:
                 presence_penalty=presence_penalty,
                 frequency_penalty=frequency_penalty,
                 stop=stop,
-                stream=True,
-                echo=echo,
-        ):
-            chunk = output["choices"][0]["text"]
-            yield chunk
+                grammar=grammar,
+                logprobs=logprobs,
+                session=session,
+                deadline=deadline,
+                deadline_sentence=deadline_sentence
+            )
+
+        # Próbkowanie z gramatyką ma stan poza KV cache, którego nie da się odłożyć
+        return GenerationStream(chunks(), metrics, logprobs, preemptible=grammar is None)
+
+    def _reuse_prefix(self, tokens: List[int], need_logits: bool = True) -> int:
+        """
+        Zachowuje w KV cache wspólny początek poprzedniego i nowego prompta.
+
+        Args:
+            tokens: tokeny nowego prompta
+            need_logits: czy po przetworzeniu potrzebne będą logity ostatniego tokenu
+
+        Returns:
+            Liczba tokenów prompta, które nie wymagają ponownego przetworzenia
+        """
+        previous = self.backend.kv_tokens()
+        cached = 0
+        for old, new in zip(previous, tokens):
+            if old != new:
+                break
+            cached += 1
+        # Ostatni token prompta musi zostać przetworzony, aby otrzymać logity
+        if need_logits:
+            cached = min(cached, len(tokens) - 1)
+        self.backend.truncate(cached)
+        return cached
+
+    def prefill_prompt(self, prompt: str, session: Optional[str] = None) -> int:
+        """
+        Przetwarza z wyprzedzeniem początek prompta do KV cache sesji.
+
+        Kolejne generowanie, którego prompt zaczyna się od tego tekstu,
+        przetworzy już tylko pozostałe tokeny.
+
+        Args:
+            prompt: stały początek przyszłego prompta
+            session: sesja rozmowy (jak w generate())
+
+        Returns:
+            Liczba nowo przetworzonych tokenów
+        """
+        self.switch_session(session)
+        tokens = self._tokenize_cached(prompt, special=True)
+        if not tokens or len(tokens) >= self.backend.n_ctx():
+            return 0
+        with llm_trace.span("speculative_prefill", tokens=len(tokens)):
+            cached = self._reuse_prefix(tokens, need_logits=False)
+            if cached < len(tokens):
+                self.backend.prefill(tokens[cached:])
+        return len(tokens) - cached
+
+    def _generate_chunks(
+            self,
+            prompt: str,
+            metrics: GenerationMetrics,
+            max_tokens: int,
+            temperature: float,
+            top_p: float,
+            top_k: int,
+            repeat_penalty: float,
+            presence_penalty: float,
+            frequency_penalty: float,
+            stop: List[str] = None,
+            grammar: Any = None,
+            logprobs: Optional[TokenLogprobs] = None,
+            session: Optional[str] = None,
+            deadline: Optional[float] = None,
+            deadline_sentence: bool = False
+    ) -> Generator[str, None, None]:
+        """
+        Pętla generowania: prefill prompta, a następnie próbkowanie i dekodowanie
+        token po tokenie, z pomiarem czasu każdej fazy.
+
+        Jeśli podano `logprobs`, dopisywane są do niego log-prawdopodobieństwa
+        wygenerowanych tokenów. Przy terminie `deadline` przed każdym tokenem
+        szacowany jest czas jego wygenerowania (z tempa bieżącej odpowiedzi,
+        a na jej początku - poprzednich) i generowanie kończy się, zanim
+        termin zostanie przekroczony.
+        """
+        # Przełączenie sesji następuje dopiero na początku generowania (strumień jest leniwy)
+        self.switch_session(session)
+        start = time.perf_counter()
+        start_ns = time.perf_counter_ns()
+        # Tokeny specjalne w prompcie (np. "<s>", "[INST]") traktujemy jak w llama-cpp-python
+        with llm_trace.span("tokenize", chars=len(prompt)):
+            tokens = self._tokenize_cached(prompt, special=True)
+        n_ctx = self.backend.n_ctx()
+        if not tokens:
+            raise ValueError("Pusty prompt - brak tokenów do przetworzenia")
+        if len(tokens) >= n_ctx:
+            raise ValueError(f"Prompt ma {len(tokens)} tokenów, a kontekst modelu tylko {n_ctx}")
+        if max_tokens is None or max_tokens <= 0:
+            max_tokens = n_ctx - len(tokens)
+        max_tokens = min(max_tokens, n_ctx - len(tokens))
+
+        metrics.prompt_tokens = len(tokens)
+        if deadline is not None and time.time() >= deadline:
+            # Odpowiedź i tak przyszłaby po terminie - nie przetwarzaj prompta
+            metrics.finish_reason = "deadline"
+            metrics.total_ms = (time.perf_counter() - start) * 1000
+            self._record_metrics(metrics)
+            return
+        metrics.cached_tokens = self._reuse_prefix(tokens)
+
+        phase_start = time.perf_counter()
+        with llm_trace.span("prefill", tokens=len(tokens) - metrics.cached_tokens, cached=metrics.cached_tokens):
+            self.backend.prefill(tokens[metrics.cached_tokens:])
+        metrics.prefill_ms = (time.perf_counter() - phase_start) * 1000
+        if logprobs is not None and self.backend.logits() is None:
+            raise NotImplementedError(f"Backend {type(self.backend).__name__} nie udostępnia logitów")
+
+        stop = [sequence for sequence in (stop or []) if sequence]
+        detokenizer = StreamingDetokenizer(self.backend, self._token_pieces)
+        self.backend.start_sampling(grammar)
+        # Tokeny w KV cache tej odpowiedzi (prompt i zdekodowane tokeny) - do wznowienia po wywłaszczeniu
+        context = list(tokens)
+        owner = object()
+        self._kv_owner = owner
+        # Tekst jeszcze niewysłany: co najwyżej końcówka, która może być początkiem sekwencji stop
+        pending = ""
+        # Końcówka wygenerowanego tekstu - do wykrycia końca zdania przed terminem
+        tail = ""
+        closing = False
+        stopped = False
+        finish_reason = "length"
+
+        try:
+            for i in range(max_tokens):
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if metrics.completion_tokens >= _LIVE_SPEED_MIN_TOKENS:
+                        token_seconds = (metrics.sampling_ms + metrics.decode_ms) / 1000 / metrics.completion_tokens
+                    else:
+                        token_seconds = self._token_seconds or 0.0
+                    if remaining <= token_seconds:
+                        finish_reason = "deadline"
+                        break
+                    closing = deadline_sentence and remaining < token_seconds * _SENTENCE_WINDOW_TOKENS
+                phase_start = time.perf_counter()
+                with llm_trace.span("sample"):
+                    token = self.backend.sample(
+                        top_k=top_k,
+                        top_p=top_p,
+                        temp=temperature,
+                        repeat_penalty=repeat_penalty,
+                        presence_penalty=presence_penalty,
+                        frequency_penalty=frequency_penalty,
+                        grammar=grammar,
+                    )
+                now = time.perf_counter()
+                metrics.sampling_ms += (now - phase_start) * 1000
+                if i == 0:
+                    metrics.time_to_first_token_ms = (now - start) * 1000
+
+                if self.backend.is_end_token(token):
+                    finish_reason = "stop"
+                    break
+
+                metrics.completion_tokens += 1
+                if logprobs is not None:
+                    phase_start = time.perf_counter()
+                    logprobs.record(self.backend.logits(), token)
+                    metrics.sampling_ms += (time.perf_counter() - phase_start) * 1000
+                with llm_trace.span("detokenize"):
+                    piece = detokenizer.feed(token)
+
+                if piece:
+                    pending += piece
+                    tail = (tail + piece)[-8:]
+                    if stop:
+                        # Sekwencja stop może zaczynać się tylko w niewysłanej części tekstu
+                        stop_at = -1
+                        for sequence in stop:
+                            position = pending.find(sequence)
+                            if position != -1 and (stop_at == -1 or position < stop_at):
+                                stop_at = position
+                        if stop_at != -1:
+                            pending = pending[:stop_at]
+                            stopped = True
+                            finish_reason = "stop"
+                            break
+                        # Wstrzymaj końcówkę, która może okazać się początkiem sekwencji stop
+                        held = _partial_stop_length(pending, stop)
+                    else:
+                        held = 0
+                    if len(pending) > held:
+                        if held:
+                            yield pending[:-held]
+                            pending = pending[-held:]
+                        else:
+                            yield pending
+                            pending = ""
+
+                if closing and _SENTENCE_END.search(tail):
+                    # Termin jest blisko, a zdanie właśnie się skończyło
+                    finish_reason = "deadline"
+                    break
+
+                if i + 1 < max_tokens:
+                    if self._kv_owner is not owner:
+                        # Między fragmentami model obsłużył inne zapytanie
+                        self._resume_generation(context, session, grammar)
+                        self._kv_owner = owner
+                    phase_start = time.perf_counter()
+                    with llm_trace.span("decode"):
+                        self.backend.decode(token)
+                    metrics.decode_ms += (time.perf_counter() - phase_start) * 1000
+                    context.append(token)
+
+            if not stopped:
+                # Dokończ ewentualną niepełną sekwencję UTF-8
+                pending += detokenizer.flush()
+            if pending:
+                yield pending
+        finally:
+            metrics.finish_reason = finish_reason
+            metrics.total_ms = (time.perf_counter() - start) * 1000
+            # Cały przebieg generowania (łącznie z czasem konsumenta strumienia)
+            llm_trace.tracer.add_complete("generate", start_ns, time.perf_counter_ns(), {
+                "prompt_tokens": metrics.prompt_tokens,
+                "completion_tokens": metrics.completion_tokens,
+                "finish_reason": finish_reason,
+            })
+            self._record_metrics(metrics)
+
+    def _resume_generation(self, context: List[int], session: Optional[str], grammar: Any) -> None:
+        """
+        Odtwarza KV cache wywłaszczonej odpowiedzi przed dekodowaniem kolejnego tokenu.
+
+        Przełączenie sesji przywraca stan odłożony do magazynu, gdy w międzyczasie
+        model pracował w innej sesji - wtedy nic nie jest przetwarzane ponownie.
+        Jeśli kontekst został zmieniony w tej samej sesji, przetwarzana jest
+        tylko część, która różni się od bieżącej zawartości KV cache.
+        """
+        with llm_trace.span("resume_generation", tokens=len(context)):
+            self.switch_session(session)
+            cached = self._reuse_prefix(context, need_logits=False)
+            if cached < len(context):
+                self.backend.prefill(context[cached:])
+            self.backend.start_sampling(grammar)
+
+    def _record_metrics(self, metrics: GenerationMetrics) -> None:
+        """Zapamiętuje pomiary i dopisuje je do dziennika, jeśli został skonfigurowany."""
+        self.last_metrics = metrics
+        if metrics.completion_tokens:
+            # Średnia krocząca czasu tokenu - początkowe oszacowanie dla terminów kolejnych odpowiedzi
+            token_seconds = (metrics.sampling_ms + metrics.decode_ms) / 1000 / metrics.completion_tokens
+            if self._token_seconds is None:
+                self._token_seconds = token_seconds
+            else:
+                self._token_seconds = 0.8 * self._token_seconds + 0.2 * token_seconds
+        if self.verbose:
+            print(f"Generowanie zakończone: {metrics.summary()}")
+        if not self.metrics_log:
+            return
+        try:
+            record = {"time": time.time(), "model": self.model_name}
+            record.update(metrics.to_dict())
+            with open(self.metrics_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Błąd podczas zapisu pomiarów: {e}")
+
+    def _completion_dict(self, prompt: str, results: List[GenerationResult]) -> dict:
+        """Buduje słownik odpowiedzi (z promptem w tekście) w formacie zgodnym z llama-cpp-python."""
+        metrics = results[0].metrics
+        return {
+            "id": f"cmpl-{uuid.uuid4()}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.model_path,
+            "choices": [{
+                "text": prompt + result,
+                "index": index,
+                "logprobs": result.logprobs.to_dict() if result.logprobs is not None else None,
+                "finish_reason": result.metrics.finish_reason,
+            } for index, result in enumerate(results)],
+            "usage": {
+                "prompt_tokens": metrics.prompt_tokens,
+                "completion_tokens": sum(result.metrics.completion_tokens for result in results),
+                "total_tokens": metrics.prompt_tokens + sum(result.metrics.completion_tokens for result in results),
+            },
+            "metrics": metrics.to_dict(),
+        }
+
+    @staticmethod
+    def _create_session_store(settings: Dict[str, Any]) -> SessionStateStore:
+        megabyte = 1024 * 1024
+        disk_mb = settings.get("disk_mb")
+        store_args = {
+            "spill_dir": settings.get("spill_dir"),
+            "disk_budget": int(disk_mb * megabyte) if disk_mb is not None else None,
+            "compress": settings.get("compress", True),
+        }
+        if settings.get("memory_mb") is not None:
+            store_args["memory_budget"] = int(settings["memory_mb"] * megabyte)
+        return SessionStateStore(**store_args)
+
+    def switch_session(self, session: Optional[str]) -> None:
+        """
+        Przełącza kontekst modelu na KV cache podanej sesji rozmowy.
+
+        Stan bieżącej sesji jest odkładany do magazynu stanów (kopia KV cache,
+        w razie potrzeby skompresowana lub zapisana na dysk), a odłożony stan
+        wybranej sesji - przywracany bez ponownego przetwarzania. Nowa
+        sesja zaczyna od KV cache poprzedniej, więc wspólny początek prompta
+        (np. prompt systemowy) nadal nie wymaga przetworzenia.
+
+        Args:
+            session: identyfikator sesji (None - sesja domyślna)
+        """
+        # Każda operacja na kontekście zaczyna się od przełączenia sesji
+        self._kv_owner = None
+        if session == self._active_session:
+            return
+        with llm_trace.span("switch_session", session=str(session)):
+            # KV cache po embeddingach nie jest nikomu potrzebny - nie zajmuje miejsca w magazynie
+            if self._active_session != EMBEDDING_SESSION:
+                self._session_states.put(self._active_session, self.backend.save_state())
+            state = self._session_states.take(session)
+            if state is not None:
+                self.backend.load_state(state)
+            self._active_session = session
+
+    def export_session_states(self, sessions: List[Optional[str]]) -> Dict[Optional[str], bytes]:
+        """
+        Zwraca zakodowane stany KV cache podanych sesji (do zapisania w migawce).
+
+        Returns:
+            Słownik sesja -> stan w postaci SessionStateStore.encode(); sesje bez stanu są pomijane
+        """
+        states = {}
+        for session in sessions:
+            if session == self._active_session:
+                states[session] = self._session_states.encode(self.backend.save_state())
+            else:
+                blob = self._session_states.get_blob(session)
+                if blob is not None:
+                    states[session] = blob
+        return states
+
+    def import_session_states(self, states: Dict[Optional[str], bytes]) -> None:
+        """Przywraca stany zwrócone przez export_session_states() (model musi mieć te same parametry)."""
+        self._kv_owner = None
+        for session, blob in states.items():
+            if session == self._active_session:
+                self.backend.load_state(self._session_states.decode(blob))
+            else:
+                self._session_states.put_blob(session, blob)
+
+    def drop_session(self, session: Optional[str]) -> None:
+        """Usuwa zapisany KV cache sesji (np. po zamknięciu karty rozmowy)."""
+        self._session_states.discard(session)
+
+    def close(self) -> None:
+        """Zwalnia zasoby modelu (kontekst i wagi llama.cpp) i odłożone stany sesji."""
+        self._session_states.clear()
+        self.backend.close()
 
     def get_info(self) -> Dict[str, Any]:
         """Zwraca podstawowe informacje o modelu."""
         return {
             "model_name": self.model_name,
             "model_path": self.model_path,
-            "context_size": self.llm.n_ctx(),
-            "embedding_size": self.llm.n_embd(),
-            "vocabulary_size": self.llm.n_vocab(),
-            "n_gpu_layers": getattr(self.llm, "n_gpu_layers", "nieznane"),
-            "n_threads": getattr(self.llm, "n_threads", "nieznane"),
+            "context_size": self.backend.n_ctx(),
+            "embedding_size": self.backend.n_embd(),
+            "vocabulary_size": self.backend.n_vocab(),
+            "session_cache": self._session_states.stats(),
+            **self.backend.info(),
+        }
+
+    def get_chat_template_info(self) -> Dict[str, Any]:
+        """Zwraca szablon czatu z metadanych modelu, architekturę i tekst tokenów BOS/EOS."""
+        metadata = self.backend.metadata()
+        return {
+            "template": metadata.get("tokenizer.chat_template"),
+            "architecture": metadata.get("general.architecture"),
+            **self.backend.special_tokens(),
         }
 
     def get_tokenizer(self):
         """Zwraca tokenizer modelu."""
-        return self.llm
+        return self.backend
+
+    @property
+    def vocab_hash(self) -> str:
+        """Odcisk słownika modelu używany jako część klucza cache tokenizacji."""
+        if self._vocab_hash is None:
+            self._vocab_hash = llm_tokenizer.vocab_fingerprint(self.backend)
+        return self._vocab_hash
+
+    def _tokenize_cached(self, text: str, special: bool = False) -> array:
+        return llm_tokenizer.cache.tokenize(self.backend, self.vocab_hash, text, special=special)
+
+    def tokenize(self, text: str) -> array:
+        """Tokenizuje tekst, zwracając tablicę tokenów array('i') (wynik jest zapamiętywany)."""
+        return self._tokenize_cached(text)
+
+    def count_tokens(self, text: str) -> int:
+        """Zwraca liczbę tokenów tekstu (długie teksty tokenizowane są tylko raz)."""
+        return len(self._tokenize_cached(text))
 
-    def tokenize(self, text: str) -> List[int]:
-        """Tokenizuje tekst, zwracając listę tokenów."""
-        return self.llm.tokenize(text.encode())
+    def incremental_tokenizer(self, special: bool = False) -> llm_tokenizer.IncrementalTokenizer:
+        """Zwraca tokenizer przyrostowy dla tekstu dopisywanego kawałkami."""
+        return llm_tokenizer.IncrementalTokenizer(self.backend, special=special)
 
     def detokenize(self, tokens: List[int]) -> str:
         """Detokenizuje listę tokenów, zwracając tekst."""
-        return self.llm.detokenize(tokens).decode("utf-8", errors="replace")
+        return self.backend.detokenize(tokens).decode("utf-8", errors="replace")
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Zwraca embedding tekstu (model musi być załadowany z embedding=True).
+
+        llama.cpp liczy embedding we własnym kontekście, czyszcząc KV cache,
+        dlatego na ten czas model przełącza się na osobną sesję - KV cache
+        bieżącej rozmowy jest odkładany i wraca przy jej następnej turze.
+        Embeddingi liczone per token są uśredniane do jednego wektora.
+        """
+        self.switch_session(EMBEDDING_SESSION)
+        vector = self.backend.embed(text)
+        if vector and isinstance(vector[0], (list, tuple)):
+            vector = [math.fsum(column) / len(vector) for column in zip(*vector)]
+        return list(vector)
 
     def get_token_embedding(self, token_id: int) -> List[float]:
         """Zwraca embedding dla danego tokenu."""
-        return self.llm.get_embedding(token_id)
\ No newline at end of file
+        return self.backend.embed(self.detokenize([token_id]))
\ No newline at end of file
@@ -0,0 +1,249 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+# Domyślna lokalizacja gniazda demona
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".simplellm_daemon.sock")
+
+# Priorytety zadań przyjmowane od klientów (jak w llm_executor)
+_PRIORITIES = {"interactive": 0, "batch": 10}
+
+# Protokół: klient wysyła jedną linię JSON z zapytaniem, a demon odpowiada liniami JSON:
+#   {"chunk": "..."} - kolejne fragmenty odpowiedzi
+#   {"done": true, "metrics": {...}} - koniec odpowiedzi
+#   {"error": "..."} - błąd
+# Zapytania: {"mode": "chat" | "complete", "prompt": ..., "system_prompt": ..., "history": [...],
+#             "priority": "interactive" | "batch", "timeout": sekundy | "deadline": czas unixowy,
+#             "params": {...}}, {"mode": "info"}, {"mode": "stats"},
+#            {"mode": "shutdown"}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Obsługuje jedno połączenie klienta (jedno zapytanie)."""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self._send({"error": f"Niepoprawne zapytanie: {e}"})
+            return
+        try:
+            self.server.model_daemon.handle(request, self._send)
+        except (BrokenPipeError, ConnectionResetError):
+            # Klient rozłączył się w trakcie odpowiedzi
+            pass
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ModelDaemon:
+    """
+    Demon utrzymujący załadowany model i obsługujący zapytania przez gniazdo Unix.
+
+    Każde połączenie obsługiwane jest w osobnym wątku, a generowanie trafia
+    do kolejki wątku inferencji interfejsu - zapytania wielu klientów są więc
+    wykonywane po kolei, bez ponownego ładowania modelu.
+    """
+
+    def __init__(self, interface, socket_path: str = DEFAULT_SOCKET_PATH,
+                 generation_overrides: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            interface: SimpleLLMInterface z załadowanym modelem
+            socket_path: ścieżka gniazda Unix
+            generation_overrides: parametry generowania nadpisujące konfigurację (np. gramatyka)
+        """
+        self.interface = interface
+        self.socket_path = socket_path
+        self.generation_overrides = generation_overrides or {}
+        self._server: Optional[_UnixServer] = None
+
+    def handle(self, request: Dict[str, Any], send) -> None:
+        """Wykonuje zapytanie i przesyła odpowiedź funkcją send(wiadomość)."""
+        mode = request.get("mode", "chat")
+        if mode == "info":
+            def info():
+                model = self.interface.model
+                return model.get_info() if model is not None else None
+
+            send({"done": True, "info": self.interface.executor.submit(info).result()})
+            return
+        if mode == "stats":
+            # Opóźnienia i wywłaszczenia według klas priorytetu
+            send({"done": True, "stats": self.interface.executor.stats()})
+            return
+        if mode == "shutdown":
+            send({"done": True})
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return
+        if mode not in ("chat", "complete"):
+            send({"error": f"Nieznany tryb: {mode}"})
+            return
+
+        params = dict(self.generation_overrides)
+        params.update(request.get("params") or {})
+        params["stream"] = True
+        priority = _PRIORITIES.get(request.get("priority", "interactive"), _PRIORITIES["interactive"])
+        if request.get("timeout") is not None:
+            params["deadline"] = time.time() + float(request["timeout"])
+        elif request.get("deadline") is not None:
+            params["deadline"] = float(request["deadline"])
+        prompt = request.get("prompt", "")
+
+        if mode == "chat":
+            stream = self.interface.submit_chat(prompt, request.get("system_prompt"), priority=priority,
+                                                history=request.get("history"), **params)
+        else:
+            stream = self.interface.submit_complete(prompt, priority=priority, **params)
+
+        try:
+            for chunk in stream:
+                send({"chunk": chunk})
+        except (BrokenPipeError, ConnectionResetError):
+            # Klient się rozłączył - przerwij generowanie, aby nie blokowało kolejki
+            stream.cancel()
+            raise
+        except Exception as e:
+            send({"error": str(e)})
+            return
+
+        metrics = stream.metrics.to_dict() if stream.metrics is not None else None
+        send({"done": True, "metrics": metrics})
+
+    def serve_forever(self) -> None:
+        """Nasłuchuje na gnieździe do czasu wywołania shutdown() (lub zapytania "shutdown")."""
+        if DaemonClient(self.socket_path).available():
+            raise RuntimeError(f"Demon już nasłuchuje na {self.socket_path}")
+        if os.path.exists(self.socket_path):
+            # Pozostałość po demonie, który nie zakończył się poprawnie
+            os.unlink(self.socket_path)
+
+        self._server = _UnixServer(self.socket_path, _RequestHandler)
+        self._server.model_daemon = self
+        os.chmod(self.socket_path, 0o600)
+        print(f"Demon nasłuchuje na {self.socket_path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self) -> None:
+        """Zatrzymuje nasłuchiwanie (wywoływane z innego wątku)."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class DaemonClient:
+    """
+    Lekki klient demona - importuje wyłącznie moduły biblioteki standardowej,
+    więc zapytanie z powłoki nie ładuje ani modelu, ani llama-cpp-python.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+
+    def available(self) -> bool:
+        """Sprawdza, czy demon nasłuchuje na gnieździe."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.connect(self.socket_path)
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    def request(self, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Wysyła zapytanie i zwraca kolejne wiadomości odpowiedzi."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+            with connection.makefile("rb") as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    yield message
+                    if "done" in message or "error" in message:
+                        return
+
+    def generate(self, prompt: str, mode: str = "chat", **request) -> Iterator[str]:
+        """
+        Zleca odpowiedź demonowi i zwraca jej fragmenty.
+
+        Args:
+            prompt: treść zapytania
+            mode: "chat" lub "complete"
+            **request: dodatkowe pola zapytania (system_prompt, history, priority, params)
+
+        Returns:
+            Iterator fragmentów odpowiedzi
+        """
+        for message in self.request(dict(request, mode=mode, prompt=prompt)):
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if "chunk" in message:
+                yield message["chunk"]
+
+    def shutdown(self) -> None:
+        """Prosi demona o zakończenie pracy."""
+        for _ in self.request({"mode": "shutdown"}):
+            pass
+
+
+def run_client(
+        prompt: Optional[str] = None,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        mode: str = "chat",
+        system_prompt: Optional[str] = None,
+        priority: str = "interactive",
+        timeout: Optional[float] = None
+) -> int:
+    """
+    Wysyła prompt do demona i wypisuje odpowiedź na bieżąco na standardowe wyjście.
+
+    Args:
+        prompt: treść zapytania (None - odczyt ze standardowego wejścia)
+        socket_path: ścieżka gniazda demona
+        mode: "chat" lub "complete"
+        system_prompt: prompt systemowy (None - z konfiguracji demona)
+        priority: "interactive" lub "batch"
+        timeout: czas na odpowiedź w sekundach (odpowiedź jest przycinana na końcu zdania)
+
+    Returns:
+        Kod wyjścia (0 - sukces)
+    """
+    if prompt is None:
+        prompt = sys.stdin.read()
+    client = DaemonClient(socket_path)
+    request = {"priority": priority}
+    if system_prompt is not None:
+        request["system_prompt"] = system_prompt
+    if timeout is not None:
+        request["timeout"] = timeout
+        request["params"] = {"deadline_sentence": True}
+    try:
+        for chunk in client.generate(prompt, mode=mode, **request):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"Demon nie działa (brak gniazda {socket_path}). Uruchom go poleceniem: python main.py --daemon",
+              file=sys.stderr)
+        return 1
+    except RuntimeError as e:
+        print(f"\nBłąd demona: {e}", file=sys.stderr)
+        return 1
+    sys.stdout.write("\n")
+    return 0
@@ -0,0 +1,522 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import llm_metrics
+import llm_trace
+
+# Znacznik końca strumienia przekazywany przez kolejkę
+_END = object()
+
+# Priorytety zadań - mniejsza wartość oznacza wcześniejsze wykonanie
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+# Zadanie zamykające wątek trafia na sam koniec kolejki
+_PRIORITY_SHUTDOWN = float("inf")
+
+# Liczba ostatnich pomiarów opóźnienia, z których liczone są percentyle w stats()
+_LATENCY_WINDOW = 1000
+
+
+class DeadlineExceededError(TimeoutError):
+    """Zadanie odrzucone, bo nie może zacząć się przed swoim terminem."""
+
+
+def _priority_name(priority: float) -> str:
+    """Zwraca nazwę klasy priorytetu używaną w etykietach metryk."""
+    if priority == PRIORITY_INTERACTIVE:
+        return "interactive"
+    if priority == PRIORITY_BATCH:
+        return "batch"
+    return str(priority)
+
+
+class TokenStream:
+    """
+    Strumień fragmentów tekstu produkowanych przez wątek inferencji.
+
+    Można go iterować synchronicznie (``for chunk in stream``) albo
+    asynchronicznie (``async for chunk in stream``), jeśli przy tworzeniu
+    podano pętlę zdarzeń asyncio.
+    """
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self.error: Optional[BaseException] = None
+        # Pomiary generowania (GenerationMetrics), jeśli model je udostępnia
+        self.metrics = None
+
+        if loop is not None:
+            import asyncio
+            self._queue = asyncio.Queue()
+        else:
+            self._queue = queue.Queue()
+
+    def put(self, chunk: str) -> None:
+        """Przekazuje fragment tekstu konsumentowi (wywoływane w wątku inferencji)."""
+        self._deliver(chunk)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """Kończy strumień, opcjonalnie z błędem, który zostanie zgłoszony konsumentowi."""
+        if self._done.is_set():
+            return
+        self.error = error
+        self._done.set()
+        self._deliver(_END)
+
+    def cancel(self) -> None:
+        """Prosi wątek inferencji o przerwanie generowania przy najbliższym tokenie."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def _deliver(self, item: Any) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        else:
+            self._queue.put(item)
+
+    def drain(self) -> Tuple[List[str], bool]:
+        """
+        Pobiera bez czekania wszystkie dostępne fragmenty (np. w pętli zdarzeń Tk).
+
+        Returns:
+            Krotka (lista fragmentów, czy strumień się zakończył)
+        """
+        if self._loop is not None:
+            raise TypeError("Strumień powiązany z pętlą asyncio wymaga 'async for'")
+        chunks = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return chunks, False
+            if item is _END:
+                self._queue.put(_END)
+                return chunks, True
+            chunks.append(item)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self._loop is not None:
+            raise TypeError("Strumień powiązany z pętlą asyncio wymaga 'async for'")
+        item = self._queue.get()
+        if item is _END:
+            # Pozwól na wielokrotne wywołanie next() po zakończeniu
+            self._queue.put(_END)
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return item
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if self._loop is None:
+            raise TypeError("Strumień synchroniczny wymaga zwykłej pętli 'for'")
+        item = await self._queue.get()
+        if item is _END:
+            self._queue.put_nowait(_END)
+            if self.error is not None:
+                raise self.error
+            raise StopAsyncIteration
+        return item
+
+
+def _close_generator(result: Iterator[str]) -> None:
+    close = getattr(result, "close", None)
+    if close is not None:
+        close()
+
+
+class InferenceExecutor:
+    """
+    Dedykowany wątek, który jako jedyny wykonuje operacje na kontekście llama.
+
+    Wszystkie zadania (ładowanie modelu, generowanie, strumieniowanie) trafiają
+    do kolejki priorytetowej i są wykonywane po kolei, dzięki czemu kontekst
+    modelu nigdy nie jest używany równolegle z dwóch wątków. Zadania
+    interaktywne (GUI, CLI) wyprzedzają w kolejce zadania wsadowe, a zadania
+    o tym samym priorytecie wykonywane są w kolejności zgłoszenia.
+
+    Strumień, który oznaczył się jako `preemptible` (generowanie w procesie,
+    bez gramatyki), jest wywłaszczany na granicy tokenu: gdy w kolejce
+    czeka zadanie o wyższym priorytecie, generator zostaje odłożony, a jego
+    kontynuacja wraca do kolejki na swoje pierwotne miejsce. KV cache
+    odłożonej odpowiedzi trafia do magazynu stanów przy przełączeniu sesji
+    przez następne zadanie, więc wznowienie nie przetwarza niczego ponownie.
+
+    Dla każdej klasy priorytetu mierzone jest opóźnienie (do pierwszego
+    fragmentu strumienia lub do wyniku zadania) i porównywane z celem.
+
+    Strumień zgłoszony z terminem (deadline) jest odrzucany od razu, jeśli
+    zadania przed nim w kolejce - według średniego czasu wykonania zadań
+    ich klasy - nie skończą się przed terminem, a także gdy termin minie,
+    zanim zadanie zostanie uruchomione.
+    """
+
+    def __init__(
+            self,
+            name: str = "llm-inference",
+            preemption: bool = True,
+            latency_targets: Optional[Dict[str, Optional[float]]] = None
+    ):
+        """
+        Args:
+            name: nazwa wątku inferencji
+            preemption: czy wywłaszczać strumienie o niższym priorytecie
+            latency_targets: docelowe opóźnienie w sekundach według klasy
+                ("interactive", "batch"; None - bez celu)
+        """
+        self.name = name
+        self.preemption = preemption
+        self.latency_targets = dict(latency_targets or {})
+        self._jobs = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending = 0
+        self._busy = False
+        self._parked = 0
+        self._latencies: Dict[str, collections.deque] = {}
+        self._target_misses: Dict[str, int] = collections.Counter()
+        self._preemptions: Dict[str, int] = collections.Counter()
+        self._rejections: Dict[str, int] = collections.Counter()
+        # Średni czas wykonania zadania według klasy (bez czasu odłożenia)
+        self._service_times: Dict[str, float] = {}
+        # Wykonywane zadanie: priorytet, przewidywany koniec, czy można je wywłaszczyć
+        self._current: Optional[Tuple[float, float, bool]] = None
+        # Wywłaszczone strumienie czekające na wznowienie: numer zadania -> (strumień, generator)
+        self._parked_streams: Dict[int, Tuple[TokenStream, Iterator[str]]] = {}
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Executor inferencji został zamknięty")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _put(self, priority: float, job: Optional[Callable], order: Optional[int] = None,
+             resumed: bool = False) -> None:
+        with self._lock:
+            self._pending += 1
+            if resumed:
+                self._parked += 1
+        if order is None:
+            order = next(self._counter)
+        self._jobs.put((priority, order, time.perf_counter(), resumed, job))
+
+    def _run(self) -> None:
+        while True:
+            priority, _, enqueued_at, resumed, job = self._jobs.get()
+            with self._lock:
+                self._pending -= 1
+                if resumed:
+                    self._parked -= 1
+                self._busy = job is not None
+            if job is None:
+                break
+            started_at = time.perf_counter()
+            wait = started_at - enqueued_at
+            name = _priority_name(priority)
+            with self._lock:
+                self._current = (priority, started_at + self._service_times.get(name, 0.0), False)
+            if resumed:
+                llm_metrics.PARKED_TIME.labels(priority=name).observe(wait)
+            else:
+                llm_metrics.QUEUE_WAIT.labels(priority=name).observe(wait)
+            try:
+                with llm_trace.span("executor.job", priority=name, queue_wait_ms=wait * 1000, resumed=resumed):
+                    job()
+            finally:
+                with self._lock:
+                    self._busy = False
+                    self._current = None
+
+    def _preempted(self, priority: float) -> bool:
+        """Sprawdza, czy w kolejce czeka zadanie o wyższym priorytecie niż `priority`."""
+        with self._jobs.mutex:
+            return bool(self._jobs.queue) and self._jobs.queue[0][0] < priority
+
+    def _record_service_time(self, priority: float, seconds: float) -> None:
+        """Aktualizuje średni czas wykonania zadań klasy `priority`."""
+        name = _priority_name(priority)
+        with self._lock:
+            previous = self._service_times.get(name)
+            self._service_times[name] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def expected_wait(self, priority: float) -> float:
+        """
+        Szacuje, ile sekund zadanie o priorytecie `priority` zgłoszone teraz
+        czekałoby na uruchomienie.
+
+        Liczone są zadania z kolejki, które zostaną wykonane wcześniej, oraz
+        pozostały czas wykonywanego zadania (chyba że zostanie wywłaszczone).
+        """
+        with self._jobs.mutex:
+            ahead = [item[0] for item in self._jobs.queue if item[0] <= priority and item[4] is not None]
+        now = time.perf_counter()
+        with self._lock:
+            wait = sum(self._service_times.get(_priority_name(item), 0.0) for item in ahead)
+            if self._current is not None:
+                current_priority, expected_end, preemptible = self._current
+                if current_priority <= priority or not (self.preemption and preemptible):
+                    wait += max(0.0, expected_end - now)
+        return wait
+
+    def _record_latency(self, priority: float, submitted_at: float) -> None:
+        """Zapisuje opóźnienie zadania klasy `priority` i sprawdza jego cel."""
+        latency = time.perf_counter() - submitted_at
+        name = _priority_name(priority)
+        llm_metrics.SCHEDULER_LATENCY.labels(priority=name).observe(latency)
+        target = self.latency_targets.get(name)
+        with self._lock:
+            samples = self._latencies.get(name)
+            if samples is None:
+                samples = self._latencies[name] = collections.deque(maxlen=_LATENCY_WINDOW)
+            samples.append(latency)
+            missed = target is not None and latency > target
+            if missed:
+                self._target_misses[name] += 1
+        if missed:
+            llm_metrics.LATENCY_TARGET_MISSES.labels(priority=name).inc()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Statystyki klas priorytetu z ostatnich pomiarów.
+
+        Returns:
+            Słownik klasa -> {"count", "p50", "p99", "target", "target_misses",
+            "preemptions", "deadline_rejections", "service_time"} (czasy w sekundach)
+        """
+        with self._lock:
+            names = set(self._latencies) | set(self._preemptions) | set(self._rejections) | set(self.latency_targets)
+            result = {}
+            for name in sorted(names):
+                samples = sorted(self._latencies.get(name, ()))
+                result[name] = {
+                    "count": len(samples),
+                    "p50": samples[int(0.5 * (len(samples) - 1))] if samples else None,
+                    "p99": samples[int(0.99 * (len(samples) - 1))] if samples else None,
+                    "target": self.latency_targets.get(name),
+                    "target_misses": self._target_misses[name],
+                    "preemptions": self._preemptions[name],
+                    "deadline_rejections": self._rejections[name],
+                    "service_time": self._service_times.get(name),
+                }
+            return result
+
+    def pending(self) -> int:
+        """Zwraca liczbę zadań oczekujących w kolejce (bez aktualnie wykonywanego)."""
+        with self._lock:
+            return self._pending
+
+    def parked(self) -> int:
+        """Zwraca liczbę wywłaszczonych strumieni czekających na wznowienie."""
+        with self._lock:
+            return self._parked
+
+    def busy(self) -> bool:
+        """Sprawdza, czy wątek inferencji wykonuje właśnie jakieś zadanie."""
+        with self._lock:
+            return self._busy
+
+    def running(self) -> bool:
+        """Sprawdza, czy wątek inferencji został uruchomiony i nadal działa."""
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def in_worker_thread(self) -> bool:
+        """Sprawdza, czy bieżący kod wykonuje się w wątku inferencji."""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, fn: Callable, *args, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Future:
+        """
+        Zleca wykonanie funkcji w wątku inferencji.
+
+        Args:
+            fn: funkcja do wykonania
+            priority: priorytet zadania (PRIORITY_INTERACTIVE lub PRIORITY_BATCH)
+
+        Returns:
+            Future z wynikiem funkcji
+        """
+        future = Future()
+        submitted_at = time.perf_counter()
+
+        def job():
+            if not future.set_running_or_notify_cancel():
+                return
+            started_at = time.perf_counter()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            self._record_service_time(priority, time.perf_counter() - started_at)
+            self._record_latency(priority, submitted_at)
+
+        self._ensure_thread()
+        self._put(priority, job)
+        return future
+
+    def submit_stream(
+            self,
+            fn: Callable,
+            *args,
+            loop=None,
+            priority: int = PRIORITY_INTERACTIVE,
+            deadline: Optional[float] = None,
+            **kwargs
+    ) -> TokenStream:
+        """
+        Zleca wykonanie funkcji zwracającej generator fragmentów tekstu.
+
+        Generator jest iterowany w wątku inferencji, a fragmenty trafiają do
+        zwróconego strumienia. Jeśli funkcja zwróci zwykły tekst, strumień
+        zawiera jeden fragment. Generator z atrybutem `preemptible` może
+        zostać odłożony na granicy fragmentu na rzecz pilniejszego zadania.
+
+        Args:
+            fn: funkcja zwracająca generator lub tekst
+            loop: opcjonalna pętla asyncio, do której mają trafiać fragmenty
+            priority: priorytet zadania (PRIORITY_INTERACTIVE lub PRIORITY_BATCH)
+            deadline: termin odpowiedzi (czas time.time()), przekazywany także funkcji
+                jako argument `deadline`; zadanie, które nie zdąży się przed nim
+                rozpocząć, kończy strumień błędem DeadlineExceededError
+
+        Returns:
+            TokenStream z fragmentami odpowiedzi
+        """
+        stream = TokenStream(loop=loop)
+        submitted_at = time.perf_counter()
+        order = next(self._counter)
+        first_chunk = [True]
+        # Czas pracy nad zadaniem we wszystkich odcinkach (między wywłaszczeniami)
+        service_time = [0.0]
+        if deadline is not None:
+            kwargs["deadline"] = deadline
+            wait = self.expected_wait(priority)
+            if time.time() + wait >= deadline:
+                self._reject(stream, priority, f"Odpowiedź nie zdąży przed terminem (oczekiwanie w kolejce ok. {wait:.2f} s)")
+                return stream
+
+        def put(chunk: str) -> None:
+            stream.put(chunk)
+            if first_chunk[0]:
+                first_chunk[0] = False
+                self._record_latency(priority, submitted_at)
+
+        def iterate(result) -> None:
+            """Przekazuje fragmenty generatora do strumienia lub odkłada go, gdy czeka pilniejsze zadanie."""
+            with self._lock:
+                self._parked_streams.pop(order, None)
+            if stream.done:
+                # Odłożony strumień został przerwany (abort_parked)
+                return
+            preemptible = self.preemption and getattr(result, "preemptible", False)
+            started_at = time.perf_counter()
+            if preemptible:
+                with self._lock:
+                    if self._current is not None:
+                        self._current = self._current[:2] + (True,)
+            try:
+                for chunk in result:
+                    if stream.cancelled:
+                        break
+                    put(chunk)
+                    if preemptible and not stream.cancelled and self._preempted(priority):
+                        name = _priority_name(priority)
+                        llm_metrics.PREEMPTIONS.labels(priority=name).inc()
+                        with self._lock:
+                            self._preemptions[name] += 1
+                        service_time[0] += time.perf_counter() - started_at
+                        with self._lock:
+                            self._parked_streams[order] = (stream, result)
+                        self._put(priority, lambda: iterate(result), order=order, resumed=True)
+                        return
+            except BaseException as e:
+                _close_generator(result)
+                stream.close(e)
+                return
+            _close_generator(result)
+            self._record_service_time(priority, service_time[0] + time.perf_counter() - started_at)
+            stream.close()
+
+        def job():
+            if stream.cancelled:
+                stream.close()
+                return
+            if deadline is not None and time.time() >= deadline:
+                self._reject(stream, priority, "Termin odpowiedzi minął przed jej rozpoczęciem")
+                return
+            try:
+                result = fn(*args, **kwargs)
+                stream.metrics = getattr(result, "metrics", None)
+            except BaseException as e:
+                stream.close(e)
+                return
+            if isinstance(result, str):
+                put(result)
+            elif result is not None:
+                iterate(result)
+                return
+            stream.close()
+
+        self._ensure_thread()
+        self._put(priority, job, order=order)
+        return stream
+
+    def abort_parked(self, error: BaseException) -> int:
+        """
+        Przerywa wszystkie wywłaszczone strumienie, kończąc je błędem `error`.
+
+        Wywoływane przed podmianą lub zamknięciem modelu - odłożone generatory
+        korzystają ze starego modelu i nie mogą zostać wznowione na zwolnionym
+        kontekście. Ich kontynuacje pozostają w kolejce, ale niczego nie wykonują.
+
+        Returns:
+            Liczba przerwanych strumieni
+        """
+        with self._lock:
+            parked = list(self._parked_streams.values())
+            self._parked_streams.clear()
+        for stream, result in parked:
+            _close_generator(result)
+            stream.close(error)
+        return len(parked)
+
+    def _reject(self, stream: TokenStream, priority: float, reason: str) -> None:
+        """Kończy strumień błędem DeadlineExceededError, nie wykonując zadania."""
+        name = _priority_name(priority)
+        llm_metrics.DEADLINE_REJECTIONS.labels(priority=name).inc()
+        with self._lock:
+            self._rejections[name] += 1
+        stream.close(DeadlineExceededError(reason))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Zatrzymuje wątek inferencji po wykonaniu zadań z kolejki."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        self._put(_PRIORITY_SHUTDOWN, None)
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -1,17 +1,22 @@
+import itertools
 import os
 import threading
 import tkinter as tk
+from collections import deque
 # import tk
-from tkinter import ttk, scrolledtext, filedialog, messagebox, Frame
+from tkinter import ttk, scrolledtext, filedialog, messagebox, simpledialog, Frame
 from typing import Dict, Any, Optional, List
 
 import json
 
+import llm_trace
 from llm_interface import SimpleLLMInterface
+from llm_mapreduce import MapReduceJob, default_chunk_tokens, interface_runner, interface_token_counter
+from llm_search import INDEX_FILENAME, SearchIndex
+from llm_session_store import ChatLog, SessionStore, import_history
+from llm_snapshot import SNAPSHOT_SUFFIX, content_hash
 from config import config
 
-from ttkthemes import ThemedTk
-
 
 
 class SettingsPanel(ttk.Frame):
@@ -89,6 +94,8 @@ class SettingsPanel(ttk.Frame):
              ["Brak", "linear", "yarn"]),
             ("rope_freq_base", "Bazowa częstotliwość RoPE", "float", 100.0, 100000.0),
             ("rope_freq_scale", "Skala częstotliwości RoPE", "float", 0.1, 10.0),
+            ("isolated_process", "Uruchom model w osobnym procesie", "bool"),
+            ("backend", "Silnik inferencji", "choice", ["llama_cpp", "fake"]),
         ]
 
         # Utwórz kontrolki dla każdego parametru
@@ -352,6 +359,40 @@ class SettingsPanel(ttk.Frame):
             self.parent.load_model(model_path, model_params)
 
 
+# Czas bezczynności (ms) po zmianie prompta lub kontekstu, po którym startuje prefill z wyprzedzeniem
+SPECULATIVE_PREFILL_DELAY_MS = 600
+
+# Liczba wiadomości wczytywanych naraz z zapisanej rozmowy (ostatnia strona i kolejne przy przewijaniu)
+HISTORY_PAGE_SIZE = 100
+
+
+class ChatSession:
+    """
+    Karta rozmowy: własna historia, kolejka generowań i własny KV cache
+    w załadowanym modelu (identyfikator przekazywany jako parametr `session`).
+    """
+
+    def __init__(self, session_id: str, title: str, frame, history_text):
+        self.session_id = session_id
+        self.title = title
+        self.frame = frame
+        self.history_text = history_text
+        self.chat_history = []
+        # Plik rozmowy dopisywany po każdej wiadomości (tworzony przy pierwszej wiadomości)
+        self.log: Optional[ChatLog] = None
+        # Pozycja w pliku, przed którą są jeszcze niewyświetlone starsze wiadomości (0 - brak)
+        self.older_offset = 0
+        self.loading_older = False
+        # Kolejka zleconych generowań obsługiwanych po kolei przez wątek inferencji
+        self.generation_queue = deque()
+        self.active_generation = None
+        self.streaming_started = False
+
+    @property
+    def busy(self) -> bool:
+        return self.active_generation is not None
+
+
 class LLMApp(tk.Frame):
     def __init__(self, root):
         super().__init__(root)
@@ -373,8 +414,22 @@ class LLMApp(tk.Frame):
         self.interface = SimpleLLMInterface()
         self.model_loaded = False
         self.mode = tk.StringVar(value="chat")
-        self.chat_history = []
         self.attached_files = []
+        # Karty rozmów - każda z własną historią i KV cache w modelu
+        self.sessions: List[ChatSession] = []
+        self._session_numbers = itertools.count(1)
+        # Rozmowy zapisywane przyrostowo w plikach JSONL
+        self.session_store = SessionStore(config.get("sessions_dir"))
+        # Indeks wyszukiwania rozmów (otwierany przy pierwszym użyciu) i ostatnie wyniki
+        self._search_index: Optional[SearchIndex] = None
+        # Trwające przetwarzanie dużego pliku (map-reduce)
+        self._map_reduce_job: Optional[MapReduceJob] = None
+        self.search_hits = []
+        # Prefill z wyprzedzeniem: zaplanowane wywołanie i ostatnie zlecone zadanie
+        self._prefill_after_id = None
+        self._prefill_future = None
+        # Pomiary ostatniego generowania wyświetlane na pasku stanu modelu
+        self.last_metrics_text = ""
 
         # Podział na główne panele: lewy (ustawienia), środkowy (czat), prawy (szczegóły)
         self.main_paned = ttk.PanedWindow(self, orient=tk.HORIZONTAL)
@@ -455,21 +510,18 @@ class LLMApp(tk.Frame):
         chat_history_frame = ttk.Frame(self.chat_frame)
         chat_history_frame.pack(fill="both", expand=True, padx=5, pady=5)
 
-        # Etykieta "Historia czatu"
-        history_label = ttk.Label(chat_history_frame, text="Historia czatu", font=("TkDefaultFont", 10, "bold"))
-        history_label.pack(anchor="w", pady=(0, 5))
+        # Etykieta "Historia czatu" i przyciski kart rozmów
+        history_header = ttk.Frame(chat_history_frame)
+        history_header.pack(fill="x", pady=(0, 5))
+        history_label = ttk.Label(history_header, text="Historia czatu", font=("TkDefaultFont", 10, "bold"))
+        history_label.pack(side="left")
+        ttk.Button(history_header, text="Zamknij rozmowę", command=self.close_session).pack(side="right", padx=5)
+        ttk.Button(history_header, text="Nowa rozmowa", command=self.new_session).pack(side="right", padx=5)
 
-        # Historia czatu
-        self.history_text = scrolledtext.ScrolledText(chat_history_frame, wrap=tk.WORD, height=15,
-                                                      font=("TkDefaultFont", 10))
-        self.history_text.pack(fill="both", expand=True, padx=5, pady=5)
-        self.history_text.config(state="disabled")  # Tylko do odczytu
-
-        # Konfiguracja tagów dla różnych stylów tekstu
-        self.history_text.tag_configure("user", foreground="#0066cc", font=("TkDefaultFont", 10, "bold"))
-        self.history_text.tag_configure("assistant", foreground="#009933", font=("TkDefaultFont", 10))
-        self.history_text.tag_configure("system", foreground="#cc0000", font=("TkDefaultFont", 10, "italic"))
-        self.history_text.tag_configure("file", foreground="#993399", font=("TkDefaultFont", 10, "italic"))
+        # Karty rozmów
+        self.sessions_notebook = ttk.Notebook(chat_history_frame)
+        self.sessions_notebook.pack(fill="both", expand=True, padx=5, pady=5)
+        self.new_session()
 
         # Dolny panel - wprowadzanie tekstu
         input_frame = ttk.LabelFrame(self.chat_frame, text="Wprowadź prompt")
@@ -478,6 +530,7 @@ class LLMApp(tk.Frame):
         # Pole wprowadzania tekstu
         self.input_text = scrolledtext.ScrolledText(input_frame, wrap=tk.WORD, height=5, font=("TkDefaultFont", 10))
         self.input_text.pack(fill="x", expand=True, padx=5, pady=5)
+        self.input_text.bind("<KeyRelease>", self.schedule_speculative_prefill)
 
         # Pasek przycisków
         buttons_frame = ttk.Frame(input_frame)
@@ -485,12 +538,83 @@ class LLMApp(tk.Frame):
 
         # Przyciski
         ttk.Button(buttons_frame, text="Generuj", command=self.generate_text).pack(side="left", padx=5)
+        ttk.Button(buttons_frame, text="Zatrzymaj", command=self.stop_generation).pack(side="left", padx=5)
         ttk.Button(buttons_frame, text="Dołącz plik", command=self.attach_file).pack(side="left", padx=5)
         ttk.Button(buttons_frame, text="Wyczyść", command=self.clear_output).pack(side="left", padx=5)
         ttk.Button(buttons_frame, text="Zapisz historię", command=self.save_chat_history).pack(side="left", padx=5)
         ttk.Button(buttons_frame, text="Wczytaj historię", command=self.load_chat_history).pack(side="left", padx=5)
+        ttk.Button(buttons_frame, text="Zapisz sesję", command=self.save_session_snapshot).pack(side="left", padx=5)
+        ttk.Button(buttons_frame, text="Przywróć sesję",
+                   command=self.restore_session_snapshot).pack(side="left", padx=5)
         ttk.Button(buttons_frame, text="Wyjdź", command=self.root.quit).pack(side="right", padx=5)
 
+    @property
+    def session(self) -> ChatSession:
+        """Karta rozmowy wybrana w oknie."""
+        return self.sessions[self.sessions_notebook.index("current")]
+
+    @property
+    def chat_history(self) -> List[Dict[str, str]]:
+        return self.session.chat_history
+
+    @chat_history.setter
+    def chat_history(self, history: List[Dict[str, str]]) -> None:
+        self.session.chat_history = history
+
+    @property
+    def history_text(self):
+        return self.session.history_text
+
+    def new_session(self, session_id: Optional[str] = None, title: Optional[str] = None) -> ChatSession:
+        """Otwiera nową kartę rozmowy (identyfikator i tytuł podaje się przy przywracaniu sesji)."""
+        number = next(self._session_numbers)
+        frame = ttk.Frame(self.sessions_notebook)
+        history_text = scrolledtext.ScrolledText(frame, wrap=tk.WORD, height=15, font=("TkDefaultFont", 10))
+        history_text.pack(fill="both", expand=True)
+        history_text.config(state="disabled")  # Tylko do odczytu
+
+        # Konfiguracja tagów dla różnych stylów tekstu
+        history_text.tag_configure("user", foreground="#0066cc", font=("TkDefaultFont", 10, "bold"))
+        history_text.tag_configure("assistant", foreground="#009933", font=("TkDefaultFont", 10))
+        history_text.tag_configure("system", foreground="#cc0000", font=("TkDefaultFont", 10, "italic"))
+        history_text.tag_configure("file", foreground="#993399", font=("TkDefaultFont", 10, "italic"))
+
+        session = ChatSession(session_id or f"gui-{number}", title or f"Rozmowa {number}", frame, history_text)
+        # Przewinięcie na początek wyświetlonej historii doczytuje starsze wiadomości
+        history_text.configure(yscrollcommand=lambda first, last: self._on_history_scroll(session, first, last))
+        self.sessions.append(session)
+        self.sessions_notebook.add(frame, text=session.title)
+        self.sessions_notebook.select(frame)
+        return session
+
+    def close_session(self):
+        """Zamyka wybraną kartę rozmowy i zwalnia jej KV cache w modelu."""
+        session = self.session
+        if session.chat_history and not messagebox.askyesno(
+                "Potwierdź", f"Czy zamknąć kartę \"{session.title}\" wraz z historią?"):
+            return
+
+        self._discard_session(session)
+        if self.model_loaded:
+            self.interface.submit_drop_session(session.session_id)
+        if not self.sessions:
+            self.new_session()
+        self.update_generation_status()
+
+    def _discard_session(self, session: ChatSession):
+        """Przerywa generowania karty, zamyka jej plik rozmowy i usuwa kartę z okna."""
+        # Zadania z kolejki karty nie trafiły jeszcze do wątku inferencji
+        session.generation_queue.clear()
+        if session.active_generation is not None:
+            session.active_generation["stream"].cancel()
+            session.active_generation = None
+        if session.log is not None:
+            session.log.close()
+
+        self.sessions.remove(session)
+        self.sessions_notebook.forget(session.frame)
+        session.frame.destroy()
+
     def setup_details_panel(self):
         """Konfiguracja panelu szczegółów (prawy panel)"""
         details_label = ttk.Label(self.details_frame, text="Szczegóły", font=("TkDefaultFont", 12, "bold"))
@@ -510,6 +634,32 @@ class LLMApp(tk.Frame):
 
         ttk.Button(files_buttons_frame, text="Usuń plik", command=self.remove_file).pack(side="left", padx=5)
         ttk.Button(files_buttons_frame, text="Wyczyść wszystkie", command=self.clear_files).pack(side="left", padx=5)
+        ttk.Button(files_buttons_frame, text="Duży plik...", command=self.process_large_file).pack(side="left",
+                                                                                                    padx=5)
+        # Postęp przetwarzania dużego pliku (map-reduce)
+        self.map_reduce_label = ttk.Label(files_frame, text="")
+        self.map_reduce_label.pack(fill="x", padx=5)
+
+        # Panel wyszukiwania w zapisanych rozmowach
+        search_frame = ttk.LabelFrame(self.details_frame, text="Szukaj w rozmowach")
+        search_frame.pack(fill="x", padx=5, pady=5)
+
+        search_entry_frame = ttk.Frame(search_frame)
+        search_entry_frame.pack(fill="x", padx=5, pady=5)
+        self.search_entry = ttk.Entry(search_entry_frame)
+        self.search_entry.pack(side="left", fill="x", expand=True)
+        self.search_entry.bind("<Return>", self.search_conversations)
+        ttk.Button(search_entry_frame, text="Szukaj", command=self.search_conversations).pack(side="left", padx=5)
+
+        self.search_listbox = tk.Listbox(search_frame, height=8)
+        self.search_listbox.pack(fill="x", expand=True, padx=5, pady=5)
+        self.search_listbox.bind("<Double-Button-1>", lambda event: self.open_search_hit())
+
+        search_buttons_frame = ttk.Frame(search_frame)
+        search_buttons_frame.pack(fill="x", padx=5, pady=5)
+        ttk.Button(search_buttons_frame, text="Otwórz rozmowę", command=self.open_search_hit).pack(side="left", padx=5)
+        ttk.Button(search_buttons_frame, text="Dodaj do kontekstu",
+                   command=self.add_search_hit_to_context).pack(side="left", padx=5)
 
         # Panel kontekstu
         context_frame = ttk.LabelFrame(self.details_frame, text="Kontekst")
@@ -519,6 +669,7 @@ class LLMApp(tk.Frame):
         self.context_text = scrolledtext.ScrolledText(context_frame, wrap=tk.WORD, height=10,
                                                       font=("TkDefaultFont", 10))
         self.context_text.pack(fill="both", expand=True, padx=5, pady=5)
+        self.context_text.bind("<KeyRelease>", self.schedule_speculative_prefill)
 
         # Przyciski kontekstu
         context_buttons_frame = ttk.Frame(context_frame)
@@ -761,34 +912,38 @@ class LLMApp(tk.Frame):
         if model_params is None:
             model_params = config.get_model_params()
 
-        def load_in_thread():
-            success = self.interface.load_model(
-                model_path=model_path,
-                **model_params
-            )
-            self.root.after(0, self.update_model_info, success)
+        # Model ładowany jest w wątku inferencji - podmiana nastąpi dopiero
+        # po zakończeniu wcześniej zleconych generowań
+        future = self.interface.submit_load_model(model_path, **model_params)
+        future.add_done_callback(
+            lambda f: self.root.after(0, self.update_model_info, f.exception() is None and f.result())
+        )
 
-        thread = threading.Thread(target=load_in_thread)
-        thread.daemon = True
-        thread.start()
+    def _show_model_label(self) -> str:
+        """Wyświetla nazwę i kontekst załadowanego modelu; zwraca nazwę modelu."""
+        model_info = self.interface.model_info
+        model_name = model_info.get("model_name", "Nieznany model")
+        context_size = model_info.get("context_size", "Nieznany")
+
+        self.model_info_label.config(
+            text=f"Model: {model_name} (Kontekst: {context_size})"
+        )
+        self.last_metrics_text = ""
+        self.model_loaded = True
+        return model_name
 
     def update_model_info(self, success):
         """Aktualizuje etykietę z informacjami o modelu."""
         if success:
-            model_info = self.interface.model.get_info()
-            model_name = model_info.get("model_name", "Nieznany model")
-            context_size = model_info.get("context_size", "Nieznany")
-
-            self.model_info_label.config(
-                text=f"Model: {model_name} (Kontekst: {context_size})"
-            )
-            self.model_loaded = True
+            model_name = self._show_model_label()
 
             # Dodaj informacje do historii czatu
             self.add_to_history(f"System: Załadowano model {model_name}", "system")
 
             # Odśwież listę ostatnio używanych modeli
             self.settings_panel.refresh_recent_models()
+            self.update_generation_status()
+            self._schedule_search_embeddings()
 
             messagebox.showinfo("Sukces", "Model został pomyślnie załadowany")
         else:
@@ -807,24 +962,52 @@ class LLMApp(tk.Frame):
             messagebox.showwarning("Ostrzeżenie", "Wprowadź prompt!")
             return
 
-        # Dodaj prompt do historii
-        self.add_to_history(f"Ty: {prompt}", "user")
-        self.chat_history.append({"role": "user", "content": prompt})
-
         # Wyczyść pole wprowadzania
         self.input_text.delete("1.0", tk.END)
+        if self._prefill_after_id is not None:
+            self.root.after_cancel(self._prefill_after_id)
+            self._prefill_after_id = None
+
+        # Połącz prompt i kontekst z załączonych plików oraz pola kontekstu
+        file_context = self._build_file_context()
+        file_names = ", ".join([file_info['name'] for file_info in self.attached_files])
+        full_prompt = prompt
+        if file_context:
+            full_prompt = file_context + "\n\n" + prompt
+
+        # Pobierz parametry generowania z konfiguracji
+        generation_params = {}
+        for param_name, var in self.settings_panel.generation_params.items():
+            generation_params[param_name] = var.get()
+
+        # Prompt trafi do historii i do kolejki inferencji dopiero, gdy skończy się
+        # poprzednie generowanie karty - wtedy historia zawiera już poprzednią
+        # turę i odpowiedź, a pytania i odpowiedzi z kolejki nie przeplatają się
+        session = self.session
+        session.generation_queue.append({
+            "prompt": prompt,
+            "full_prompt": full_prompt,
+            "mode": self.mode.get(),
+            "params": generation_params,
+            "file_names": file_names,
+            "stream": None,
+            "streaming": generation_params.get("stream", True),
+            "response": ""
+        })
+
+        if session.active_generation is None:
+            self._start_next_generation(session)
+        else:
+            self.update_generation_status()
 
-        # Przygotuj kontekst z załączonych plików, jeśli istnieją
+    def _build_file_context(self) -> str:
+        """Składa kontekst z załączonych plików i pola kontekstu (dołączany przed promptem)."""
         file_context = ""
         if self.attached_files:
             file_context = "Zawartość załączonych plików:\n\n"
             for file_info in self.attached_files:
                 file_context += f"--- {file_info['name']} ---\n{file_info['content']}\n\n"
 
-            # Dodaj informację o dołączonych plikach do historii
-            file_names = ", ".join([file_info['name'] for file_info in self.attached_files])
-            self.add_to_history(f"Dołączone pliki: {file_names}", "file")
-
         # Pobierz dodatkowy kontekst z pola kontekstu
         additional_context = self.context_text.get("1.0", tk.END).strip()
         if additional_context:
@@ -832,102 +1015,187 @@ class LLMApp(tk.Frame):
                 file_context += "\nDodatkowy kontekst:\n" + additional_context
             else:
                 file_context = "Dodatkowy kontekst:\n" + additional_context
+        return file_context
+
+    def schedule_speculative_prefill(self, event=None, delay_ms: int = SPECULATIVE_PREFILL_DELAY_MS):
+        """
+        Planuje przetworzenie znanego początku prompta po chwili bezczynności
+        (zmiana plików, kontekstu lub wpisywanego tekstu przesuwa termin).
+        """
+        if self._prefill_after_id is not None:
+            self.root.after_cancel(self._prefill_after_id)
+        self._prefill_after_id = self.root.after(delay_ms, self._speculative_prefill)
+
+    def _speculative_prefill(self):
+        """Zleca w tle prefill kontekstu i wpisanej części prompta dla wybranej karty."""
+        self._prefill_after_id = None
+        session = self.session
+        # Podczas generowania w karcie prefill tylko opóźniłby kolejne zadania
+        if not self.model_loaded or session.busy or not config.get("speculative_prefill"):
+            return
 
-        # Połącz prompt i kontekst
-        full_prompt = prompt
-        if file_context:
-            full_prompt = file_context + "\n\n" + prompt
+        file_context = self._build_file_context()
+        typed = self.input_text.get("1.0", tk.END).strip()
+        prefix = file_context + "\n\n" + typed if file_context else typed
+        if not prefix:
+            return
 
-        # Ustaw stan "Generowanie..."
-        self.model_info_label.config(text=f"{self.model_info_label.cget('text')} (Generowanie...)")
-        self.root.update()
+        # Poprzedni prefill, który jeszcze czeka w kolejce, jest już nieaktualny
+        if self._prefill_future is not None:
+            self._prefill_future.cancel()
+        self._prefill_future = self.interface.submit_speculative_prefill(
+            prefix,
+            mode=self.mode.get(),
+            history=list(session.chat_history),
+            session=session.session_id
+        )
 
-        # Pobierz parametry generowania z konfiguracji
-        generation_params = {}
-        for param_name, var in self.settings_panel.generation_params.items():
-            generation_params[param_name] = var.get()
+    def _start_next_generation(self, session: ChatSession):
+        """Rozpoczyna obsługę kolejnego generowania z kolejki karty."""
+        if not session.generation_queue:
+            session.active_generation = None
+            self.update_generation_status()
+            return
 
-        def generate_in_thread():
-            mode = self.mode.get()
-            full_response = ""
+        generation = session.generation_queue.popleft()
+        session.active_generation = generation
 
-            try:
-                if mode == "chat":
-                    if generation_params.get("stream", True):
-                        for chunk in self.interface.chat(full_prompt, **generation_params):
-                            full_response += chunk
-                            self.add_to_history_streaming(chunk, "assistant")
-                    else:
-                        full_response = self.interface.chat(full_prompt, **generation_params)
-                        self.add_to_history(f"Model: {full_response}", "assistant")
-                else:  # tryb complete
-                    if generation_params.get("stream", True):
-                        for chunk in self.interface.complete(full_prompt, **generation_params):
-                            full_response += chunk
-                            self.add_to_history_streaming(chunk, "assistant")
-                    else:
-                        response = self.interface.complete(full_prompt, **generation_params)
-                        if isinstance(response, dict):
-                            full_response = response["choices"][0]["text"]
-                        else:
-                            full_response = response
-                        self.add_to_history(f"Model: {full_response}", "assistant")
-
-                # Dodaj odpowiedź do historii chatu
-                self.chat_history.append({"role": "assistant", "content": full_response})
-
-                # Przywróć normalny stan etykiety modelu
-                self.root.after(0, lambda: self.model_info_label.config(
-                    text=self.model_info_label.cget('text').replace(" (Generowanie...)", "")
-                ))
-            except Exception as e:
-                self.root.after(0, lambda: messagebox.showerror("Błąd generowania", str(e)))
-                self.root.after(0, lambda: self.model_info_label.config(
-                    text=self.model_info_label.cget('text').replace(" (Generowanie...)", "")
-                ))
-
-        thread = threading.Thread(target=generate_in_thread)
-        thread.daemon = True
-        thread.start()
-
-    def add_to_history(self, text, tag=""):
-        """Dodaje tekst do historii czatu."""
-        self.history_text.config(state="normal")
-        self.history_text.insert(tk.END, text + "\n\n", tag)
-        self.history_text.see(tk.END)
-        self.history_text.config(state="disabled")
-
-    def add_to_history_streaming(self, chunk, tag=""):
+        # Zleć generowanie z historią aktualną w chwili startu - jeśli model jest
+        # zajęty innymi kartami, zadanie czeka w kolejce inferencji. Każda karta ma
+        # własny KV cache, więc powrót do rozmowy nie wymaga ponownego przetwarzania historii.
+        if generation["mode"] == "chat":
+            generation["stream"] = self.interface.submit_chat(
+                generation["full_prompt"], history=list(session.chat_history),
+                session=session.session_id, **generation["params"])
+        else:
+            generation["stream"] = self.interface.submit_complete(
+                generation["full_prompt"], session=session.session_id, **generation["params"])
+
+        # Dodaj prompt do historii
+        self.add_to_history(f"Ty: {generation['prompt']}", "user", session)
+        session.chat_history.append({"role": "user", "content": generation['prompt']})
+        self._log_message(session, "user", generation['prompt'])
+
+        # Dodaj informację o dołączonych plikach do historii
+        if generation["file_names"]:
+            self.add_to_history(f"Dołączone pliki: {generation['file_names']}", "file", session)
+
+        self.update_generation_status()
+        self._poll_generation(session)
+
+    def _poll_generation(self, session: ChatSession):
+        """Przenosi fragmenty odpowiedzi ze strumienia do historii karty (także karty w tle)."""
+        generation = session.active_generation
+        if generation is None or session not in self.sessions:
+            return
+
+        stream = generation["stream"]
+        chunks, finished = stream.drain()
+        with llm_trace.span("gui.deliver", chunks=len(chunks)):
+            for chunk in chunks:
+                generation["response"] += chunk
+                if generation["streaming"]:
+                    self.add_to_history_streaming(chunk, "assistant", session)
+
+        if not finished:
+            self.root.after(30, self._poll_generation, session)
+            return
+
+        if generation["streaming"]:
+            self._finish_streaming(session)
+        elif stream.error is None:
+            self.add_to_history(f"Model: {generation['response']}", "assistant", session)
+
+        if stream.metrics is not None:
+            self.last_metrics_text = stream.metrics.summary()
+
+        if stream.error is not None:
+            messagebox.showerror("Błąd generowania", str(stream.error))
+        else:
+            # Dodaj odpowiedź do historii chatu
+            session.chat_history.append({"role": "assistant", "content": generation["response"]})
+            self._log_message(session, "assistant", generation["response"])
+
+        self._start_next_generation(session)
+
+    def _log_message(self, session: ChatSession, role: str, content: str):
+        """Dopisuje wiadomość do pliku rozmowy karty (zapis nie zależy od długości historii)."""
+        try:
+            if session.log is None:
+                session.log = self.session_store.create(session.title)
+            session.log.append(role, content)
+        except OSError as e:
+            print(f"Nie udało się zapisać wiadomości rozmowy: {e}")
+            return
+
+        # Indeks wyszukiwania obejmuje tylko nowo dopisaną linię
+        index = self.search_index
+        if index is not None:
+            index.index_log(session.log)
+            self._schedule_search_embeddings()
+
+    def stop_generation(self):
+        """Przerywa bieżące generowanie wybranej karty i usuwa jej zadania oczekujące w kolejce."""
+        session = self.session
+        # Zadania z kolejki karty nie trafiły jeszcze do wątku inferencji
+        session.generation_queue.clear()
+        if session.active_generation is not None:
+            session.active_generation["stream"].cancel()
+        self.update_generation_status()
+
+    def update_generation_status(self):
+        """Aktualizuje etykietę modelu o pomiary, stan generowania i długość kolejki."""
+        text = self.model_info_label.cget('text').split(" (Generowanie")[0].split(" | ")[0]
+        if self.last_metrics_text:
+            text += f" | {self.last_metrics_text}"
+        if any(session.busy for session in self.sessions):
+            waiting = sum(len(session.generation_queue) for session in self.sessions)
+            if waiting:
+                text += f" (Generowanie... w kolejce: {waiting})"
+            else:
+                text += " (Generowanie...)"
+        self.model_info_label.config(text=text)
+
+        # Karty, w których trwa generowanie, oznaczamy gwiazdką
+        for session in self.sessions:
+            title = f"{session.title} *" if session.busy else session.title
+            self.sessions_notebook.tab(session.frame, text=title)
+
+    def add_to_history(self, text, tag="", session: Optional[ChatSession] = None):
+        """Dodaje tekst do historii czatu (domyślnie wybranej karty)."""
+        history_text = (session or self.session).history_text
+        history_text.config(state="normal")
+        history_text.insert(tk.END, text + "\n\n", tag)
+        history_text.see(tk.END)
+        history_text.config(state="disabled")
+
+    def add_to_history_streaming(self, chunk, tag="", session: Optional[ChatSession] = None):
         """Dodaje kawałki odpowiedzi do historii czatu w trybie strumieniowym."""
-        self.history_text.config(state="normal")
+        session = session or self.session
+        history_text = session.history_text
+        history_text.config(state="normal")
 
         # Sprawdź, czy to pierwszy kawałek odpowiedzi w nowej sekwencji
-        if not hasattr(self, '_streaming_started') or not self._streaming_started:
+        if not session.streaming_started:
             # Dodaj prefiks "Model: " tylko raz na początku sekwencji
-            self.history_text.insert(tk.END, "Model: ", tag)
-            self._streaming_started = True
-            self._last_chunk = ""
+            history_text.insert(tk.END, "Model: ", tag)
+            session.streaming_started = True
 
         # Dodaj kawałek tekstu
-        self.history_text.insert(tk.END, chunk, tag)
-        self.history_text.see(tk.END)
-        self._last_chunk = chunk
-
-        # Sprawdź, czy to może być koniec odpowiedzi
-        if chunk.endswith(("\n", ".", "!", "?")):
-            # Jeśli mamy znak końca zdania lub nową linię, dodaj niewielkie opóźnienie
-            # przed uznaniem sekwencji za zakończoną
-            self.root.after(100, self._check_streaming_end)
-
-        self.history_text.config(state="disabled")
-
-    def _check_streaming_end(self):
-        """Sprawdza, czy strumieniowanie powinno zostać uznane za zakończone."""
-        # Jeśli przez pewien czas nie było nowych chunków, uznaj sekwencję za zakończoną
-        self.history_text.config(state="normal")
-        self.history_text.insert(tk.END, "\n\n")
-        self._streaming_started = False
-        self.history_text.config(state="disabled")
+        history_text.insert(tk.END, chunk, tag)
+        history_text.see(tk.END)
+
+        history_text.config(state="disabled")
+
+    def _finish_streaming(self, session: Optional[ChatSession] = None):
+        """Zamyka sekwencję strumieniowania po otrzymaniu końca strumienia."""
+        session = session or self.session
+        if not session.streaming_started:
+            return
+        session.history_text.config(state="normal")
+        session.history_text.insert(tk.END, "\n\n")
+        session.streaming_started = False
+        session.history_text.config(state="disabled")
 
     def attach_file(self):
         """Dołącza plik do aktualnej konwersacji."""
@@ -991,27 +1259,122 @@ class LLMApp(tk.Frame):
                 with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
                     file_content = file.read()
 
-            # Dodaj plik do listy dołączonych plików
-            self.attached_files.append({
-                'name': file_name,
-                'path': file_path,
-                'content': file_content
-            })
-
-            # Zaktualizuj listę plików
-            self.update_files_list()
+            # Plik większy niż kontekst modelu nie zmieści się w promptcie - można go przetworzyć
+            # fragmentami. Tokeny liczy wątek inferencji, więc interfejs nie zamarza w trakcie
+            if self.model_loaded:
+                future = self.interface.submit_count_tokens(file_content)
+                future.add_done_callback(lambda f: self.root.after(
+                    0, self._file_tokens_counted, file_name, file_path, file_content, f))
+                return
 
-            # Informacja o dołączeniu pliku
-            messagebox.showinfo("Sukces", f"Plik {file_name} został dołączony do konwersacji.")
+            self._attach_file_content(file_name, file_path, file_content)
 
         except Exception as e:
             messagebox.showerror("Błąd", f"Nie udało się wczytać pliku: {str(e)}")
 
+    def _file_tokens_counted(self, file_name: str, file_path: str, file_content: str, future):
+        """Dołącza plik po policzeniu tokenów albo proponuje przetworzenie go fragmentami."""
+        if future.exception() is None:
+            context_size = self.interface.model_info.get("context_size", 0)
+            file_tokens = future.result()
+            if file_tokens > context_size and messagebox.askyesno(
+                    "Duży plik",
+                    f"Plik ma {file_tokens} tokenów, więcej niż kontekst modelu ({context_size}).\n"
+                    f"Przetworzyć go fragmentami (map-reduce) i dołączyć wynik?"):
+                self.process_large_file(file_path)
+                return
+        self._attach_file_content(file_name, file_path, file_content)
+
+    def _attach_file_content(self, file_name: str, file_path: str, file_content: str):
+        """Dodaje wczytaną zawartość pliku do listy dołączonych plików."""
+        self.attached_files.append({
+            'name': file_name,
+            'path': file_path,
+            'content': file_content
+        })
+
+        # Zaktualizuj listę plików
+        self.update_files_list()
+
+        # Informacja o dołączeniu pliku
+        messagebox.showinfo("Sukces", f"Plik {file_name} został dołączony do konwersacji.")
+
+    def process_large_file(self, file_path: Optional[str] = None):
+        """
+        Przetwarza plik większy niż kontekst modelu metodą map-reduce (w tle)
+        i dołącza wynik do rozmowy jako plik.
+
+        Fragmenty trafiają do modelu z niskim priorytetem, więc w trakcie można
+        prowadzić rozmowę. Postęp jest zapisywany w katalogu rozmów - ponowne
+        przetworzenie tego samego pliku z tym samym poleceniem wznawia pracę.
+        """
+        if not self.model_loaded:
+            messagebox.showwarning("Ostrzeżenie", "Najpierw załaduj model!")
+            return
+        if self._map_reduce_job is not None:
+            messagebox.showinfo("Informacja", "Przetwarzanie dużego pliku już trwa.")
+            return
+        if file_path is None:
+            file_path = filedialog.askopenfilename(title="Wybierz duży plik do przetworzenia")
+            if not file_path:
+                return
+        task = simpledialog.askstring("Duży plik", "Polecenie dla całego dokumentu:",
+                                      initialvalue="Streść najważniejsze informacje.", parent=self.root)
+        if not task:
+            return
+
+        generation_params = {name: var.get() for name, var in self.settings_panel.generation_params.items()}
+        context_size = self.interface.model_info.get("context_size", 4096)
+        checkpoint_dir = os.path.join(self.session_store.directory, "mapreduce")
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoint_name = content_hash(f"{os.path.abspath(file_path)}\n{task}")[:16] + ".jsonl"
+        job = MapReduceJob(
+            file_path, task, interface_token_counter(self.interface),
+            chunk_tokens=default_chunk_tokens(context_size, generation_params.get("max_tokens", 512)),
+            checkpoint_path=os.path.join(checkpoint_dir, checkpoint_name)
+        )
+        self._map_reduce_job = job
+        runner = interface_runner(self.interface, mode="chat", **generation_params)
+        outcome = {}
+
+        def work():
+            try:
+                outcome["result"] = job.run(runner)
+            except Exception as e:
+                outcome["error"] = e
+
+        worker = threading.Thread(target=work, daemon=True)
+        worker.start()
+        self._poll_map_reduce(job, worker, outcome)
+
+    def _poll_map_reduce(self, job: MapReduceJob, worker: threading.Thread, outcome: Dict[str, Any]):
+        """Pokazuje postęp zadania map-reduce i dołącza wynik po jego zakończeniu."""
+        if worker.is_alive():
+            self.map_reduce_label.config(
+                text=f"{job.name}: {job.stage}, {job.done} części, dokument {job.reader.progress:.0%}")
+            self.root.after(500, self._poll_map_reduce, job, worker, outcome)
+            return
+
+        self._map_reduce_job = None
+        self.map_reduce_label.config(text="")
+        if "error" in outcome:
+            messagebox.showerror("Błąd", f"Nie udało się przetworzyć pliku {job.name}: {outcome['error']}")
+            return
+        self.attached_files.append({
+            'name': f"{job.name} ({job.task})",
+            'path': job.source_path,
+            'content': outcome["result"]
+        })
+        self.update_files_list()
+        self.add_to_history(f"System: Przetworzono duży plik {job.name} ({job.done} części)", "system")
+
     def update_files_list(self):
         """Aktualizuje listę dołączonych plików."""
         self.files_listbox.delete(0, tk.END)
         for file_info in self.attached_files:
             self.files_listbox.insert(tk.END, file_info['name'])
+        # Zawartość plików trafia do prompta - przetwórz ją, zanim użytkownik skończy pisać
+        self.schedule_speculative_prefill(delay_ms=0)
 
     def remove_file(self):
         """Usuwa wybrany plik z listy dołączonych plików."""
@@ -1034,12 +1397,14 @@ class LLMApp(tk.Frame):
         context = self.context_text.get("1.0", tk.END).strip()
         if context:
             self.add_to_history(f"System: Dodano kontekst konwersacji", "system")
+            self.schedule_speculative_prefill(delay_ms=0)
         else:
             messagebox.showinfo("Informacja", "Brak kontekstu do dodania.")
 
     def clear_context(self):
         """Czyści pole kontekstu."""
         self.context_text.delete("1.0", tk.END)
+        self.schedule_speculative_prefill()
 
     def clear_output(self):
         """Czyści pola tekstowe."""
@@ -1053,74 +1418,344 @@ class LLMApp(tk.Frame):
                 self.history_text.delete("1.0", tk.END)
                 self.history_text.config(state="disabled")
                 self.chat_history = []
+                # Wyczyszczona karta zaczyna nowy plik rozmowy, poprzedni pozostaje zapisany
+                session = self.session
+                if session.log is not None:
+                    session.log.close()
+                    session.log = None
+                session.older_offset = 0
+
+    @staticmethod
+    def _format_message(entry: Dict[str, Any]):
+        """Zwraca (tekst, tag) wiadomości do wyświetlenia w historii lub None dla nieznanej roli."""
+        role = entry.get('role', '')
+        content = entry.get('content', '')
+        if role == 'user':
+            return f"Ty: {content}", "user"
+        if role == 'assistant':
+            return f"Model: {content}", "assistant"
+        if role == 'system':
+            return f"System: {content}", "system"
+        return None
+
+    def _on_history_scroll(self, session: ChatSession, first, last):
+        """Obsługuje przewijanie historii karty - na górze doczytuje starszą stronę wiadomości."""
+        session.history_text.vbar.set(first, last)
+        if float(first) <= 0.0 and session.older_offset > 0 and not session.loading_older:
+            session.loading_older = True
+            self.root.after_idle(self._load_older_messages, session)
+
+    def _load_older_messages(self, session: ChatSession):
+        """Wstawia na początek historii poprzednią stronę wiadomości z pliku rozmowy."""
+        session.loading_older = False
+        if session not in self.sessions or session.log is None or session.older_offset <= 0:
+            return
+        try:
+            messages, session.older_offset = session.log.read_page(session.older_offset, HISTORY_PAGE_SIZE)
+        except OSError as e:
+            print(f"Nie udało się wczytać starszych wiadomości: {e}")
+            session.older_offset = 0
+            return
+
+        history_text = session.history_text
+        lines_before = int(history_text.index("end-1c").split(".")[0])
+        history_text.config(state="normal")
+        # Wstawiamy od najnowszej, każdą na samym początku - kolejność zostaje zachowana
+        for entry in reversed(messages):
+            formatted = self._format_message(entry)
+            if formatted is not None:
+                history_text.insert("1.0", formatted[0] + "\n\n", formatted[1])
+        history_text.config(state="disabled")
+        # Widok zostaje przy wiadomości, która wcześniej była na górze
+        added_lines = int(history_text.index("end-1c").split(".")[0]) - lines_before
+        history_text.yview(f"{added_lines + 1}.0")
 
     def save_chat_history(self):
-        """Zapisuje historię czatu do pliku."""
+        """Eksportuje całą rozmowę wybranej karty do pliku (rozmowy zapisują się też automatycznie)."""
+        session = self.session
         if not self.chat_history:
             messagebox.showinfo("Informacja", "Brak historii czatu do zapisania.")
             return
 
         file_path = filedialog.asksaveasfilename(
             title="Zapisz historię czatu",
-            defaultextension=".json",
-            filetypes=[("Pliki JSON", "*.json"), ("Wszystkie pliki", "*.*")]
+            defaultextension=".jsonl",
+            filetypes=[("Rozmowy JSONL", "*.jsonl"), ("Pliki JSON", "*.json"), ("Wszystkie pliki", "*.*")]
         )
 
         if file_path:
             try:
+                # Plik rozmowy zawiera także strony, które nie zostały wyświetlone
+                history = session.log.read_all() if session.log is not None else self.chat_history
+                history = [{"role": entry["role"], "content": entry.get("content", "")} for entry in history]
                 with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(self.chat_history, file, ensure_ascii=False, indent=2)
+                    if file_path.lower().endswith(".json"):
+                        json.dump(history, file, ensure_ascii=False, indent=2)
+                    else:
+                        for entry in history:
+                            file.write(json.dumps(entry, ensure_ascii=False) + "\n")
                 messagebox.showinfo("Sukces", "Historia czatu została zapisana.")
             except Exception as e:
                 messagebox.showerror("Błąd", f"Nie udało się zapisać historii: {str(e)}")
 
     def load_chat_history(self):
-        """Wczytuje historię czatu z pliku."""
+        """
+        Otwiera zapisaną rozmowę w nowej karcie.
+
+        Wyświetlana jest tylko ostatnia strona wiadomości, starsze są doczytywane
+        przy przewijaniu w górę. Kolejne tury są dopisywane do tego samego pliku.
+        Historia w dawnym formacie JSON jest przepisywana do nowego pliku rozmowy.
+        """
         file_path = filedialog.askopenfilename(
             title="Wczytaj historię czatu",
-            filetypes=[("Pliki JSON", "*.json"), ("Wszystkie pliki", "*.*")]
+            initialdir=self.session_store.directory if os.path.isdir(self.session_store.directory) else None,
+            filetypes=[("Rozmowy", "*.jsonl *.json"), ("Wszystkie pliki", "*.*")]
         )
 
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    loaded_history = json.load(file)
+                if file_path.lower().endswith(".json"):
+                    log = self.session_store.create(os.path.splitext(os.path.basename(file_path))[0])
+                    import_history(file_path, log)
+                else:
+                    log = ChatLog(file_path)
+                self.open_chat_log(log)
+            except Exception as e:
+                messagebox.showerror("Błąd", f"Nie udało się wczytać historii: {str(e)}")
 
-                # Sprawdź poprawność formatu
-                if not isinstance(loaded_history, list):
-                    raise ValueError("Nieprawidłowy format historii.")
+    def open_chat_log(self, log: ChatLog) -> ChatSession:
+        """Wyświetla ostatnią stronę zapisanej rozmowy w karcie (pustej bieżącej lub nowej)."""
+        messages, older_offset = log.read_page(count=HISTORY_PAGE_SIZE)
+
+        # Pusta, bezczynna karta zostaje wykorzystana, w przeciwnym razie otwieramy nową
+        session = self.session
+        if session.chat_history or session.busy or session.log is not None:
+            session = self.new_session()
+        session.title = log.read_header().get("title", log.session_id)
+        session.log = log
+        session.older_offset = older_offset
+        session.chat_history = [{"role": entry["role"], "content": entry.get("content", "")}
+                                for entry in messages]
+
+        self._render_history(session, messages)
+        self.update_generation_status()
+        self.schedule_speculative_prefill()
+        return session
+
+    def _render_history(self, session: ChatSession, messages: List[Dict[str, Any]]):
+        """Zastępuje treść historii karty podanymi wiadomościami."""
+        history_text = session.history_text
+        history_text.config(state="normal")
+        history_text.delete("1.0", tk.END)
+        for entry in messages:
+            formatted = self._format_message(entry)
+            if formatted is not None:
+                history_text.insert(tk.END, formatted[0] + "\n\n", formatted[1])
+        history_text.see(tk.END)
+        history_text.config(state="disabled")
+
+    def save_session_snapshot(self):
+        """Zapisuje migawkę całej sesji: model, parametry, karty rozmów z KV cache i załączniki."""
+        if not self.model_loaded:
+            messagebox.showwarning("Ostrzeżenie", "Najpierw załaduj model!")
+            return
+        if any(session.busy for session in self.sessions):
+            messagebox.showwarning("Ostrzeżenie", "Poczekaj na zakończenie generowania.")
+            return
 
-                # Wyczyść aktualną historię
-                self.history_text.config(state="normal")
-                self.history_text.delete("1.0", tk.END)
-                self.history_text.config(state="disabled")
+        file_path = filedialog.asksaveasfilename(
+            title="Zapisz sesję",
+            defaultextension=SNAPSHOT_SUFFIX,
+            filetypes=[("Migawki sesji", "*" + SNAPSHOT_SUFFIX), ("Wszystkie pliki", "*.*")]
+        )
+        if not file_path:
+            return
 
-                # Wczytaj nową historię
-                self.chat_history = loaded_history
+        sessions = [{
+            "session_id": session.session_id,
+            "title": session.title,
+            "history": session.chat_history,
+            "log_path": session.log.path if session.log is not None else None,
+            "older_offset": session.older_offset,
+        } for session in self.sessions]
+        extra = {
+            "mode": self.mode.get(),
+            "active_session": self.sessions_notebook.index("current"),
+            "context": self.context_text.get("1.0", "end-1c"),
+            "input": self.input_text.get("1.0", "end-1c"),
+        }
+        future = self.interface.submit_save_snapshot(file_path, sessions, attachments=self.attached_files,
+                                                     extra=extra)
+        future.add_done_callback(lambda f: self.root.after(0, self._snapshot_saved, f))
+
+    def _snapshot_saved(self, future):
+        if future.exception() is not None:
+            messagebox.showerror("Błąd", f"Nie udało się zapisać sesji: {future.exception()}")
+        else:
+            messagebox.showinfo("Sukces", f"Sesja została zapisana ({future.result() / 1024 / 1024:.1f} MB).")
 
-                # Wyświetl wczytaną historię
-                for entry in self.chat_history:
-                    role = entry.get('role', '')
-                    content = entry.get('content', '')
+    def restore_session_snapshot(self):
+        """Przywraca migawkę sesji - zastępuje otwarte karty, załączniki i parametry zapisanymi."""
+        if any(session.busy for session in self.sessions):
+            messagebox.showwarning("Ostrzeżenie", "Poczekaj na zakończenie generowania.")
+            return
+        file_path = filedialog.askopenfilename(
+            title="Przywróć sesję",
+            filetypes=[("Migawki sesji", "*" + SNAPSHOT_SUFFIX), ("Wszystkie pliki", "*.*")]
+        )
+        if not file_path:
+            return
 
-                    if role == 'user':
-                        self.add_to_history(f"Ty: {content}", "user")
-                    elif role == 'assistant':
-                        self.add_to_history(f"Model: {content}", "assistant")
-                    elif role == 'system':
-                        self.add_to_history(f"System: {content}", "system")
+        self.model_info_label.config(text="Przywracanie sesji...")
+        future = self.interface.submit_restore_snapshot(
+            file_path, drop_sessions=[session.session_id for session in self.sessions])
+        future.add_done_callback(lambda f: self.root.after(0, self._snapshot_restored, f))
 
-                messagebox.showinfo("Sukces", "Historia czatu została wczytana.")
+    def _snapshot_restored(self, future):
+        if future.exception() is not None:
+            if self.interface.model_info:
+                self._show_model_label()
+            else:
+                self.model_info_label.config(text="Brak załadowanego modelu")
+            messagebox.showerror("Błąd", f"Nie udało się przywrócić sesji: {future.exception()}")
+            return
+        snapshot = future.result()
+
+        # Otwarte karty zostają zastąpione kartami z migawki (KV cache jest już w modelu)
+        for session in list(self.sessions):
+            self._discard_session(session)
+        numbers = [int(entry["session_id"].split("-")[-1]) for entry in snapshot["sessions"]
+                   if str(entry.get("session_id", "")).startswith("gui-")
+                   and entry["session_id"].split("-")[-1].isdigit()]
+        self._session_numbers = itertools.count(max(numbers, default=0) + 1)
+        for entry in snapshot["sessions"]:
+            session = self.new_session(entry["session_id"], entry.get("title"))
+            session.chat_history = list(entry.get("history") or [])
+            log_path = entry.get("log_path")
+            if log_path and os.path.exists(log_path):
+                session.log = ChatLog(log_path)
+                session.older_offset = entry.get("older_offset", 0)
+            self._render_history(session, session.chat_history)
+        if not self.sessions:
+            self.new_session()
+
+        extra = snapshot.get("extra") or {}
+        active = extra.get("active_session", 0)
+        if 0 <= active < len(self.sessions):
+            self.sessions_notebook.select(self.sessions[active].frame)
+        self.mode.set(extra.get("mode", self.mode.get()))
+        self.context_text.delete("1.0", tk.END)
+        self.context_text.insert("1.0", extra.get("context", ""))
+        self.input_text.delete("1.0", tk.END)
+        self.input_text.insert("1.0", extra.get("input", ""))
+        self.attached_files = snapshot["attachments"]
+        self.update_files_list()
+        self.settings_panel.load_config_values()
+
+        self._show_model_label()
+        self.update_generation_status()
+        restored = len(snapshot.get("restored_sessions", []))
+        messagebox.showinfo("Sukces", f"Sesja została przywrócona (KV cache {restored} rozmów).")
+
+    @property
+    def search_index(self) -> Optional[SearchIndex]:
+        """Indeks wyszukiwania rozmów (None, jeśli nie udało się go otworzyć)."""
+        if self._search_index is None:
+            search_settings = config.get("search") or {}
+            path = search_settings.get("index_path") or os.path.join(self.session_store.directory, INDEX_FILENAME)
+            try:
+                self._search_index = SearchIndex(path)
             except Exception as e:
-                messagebox.showerror("Błąd", f"Nie udało się wczytać historii: {str(e)}")
+                print(f"Nie udało się otworzyć indeksu wyszukiwania: {e}")
+        return self._search_index
+
+    def _schedule_search_embeddings(self):
+        """Zleca w tle embeddingi niezaindeksowanych wiadomości (jeśli włączono wyszukiwanie semantyczne)."""
+        if self.model_loaded and (config.get("search") or {}).get("semantic") and self.search_index is not None:
+            self.interface.submit_index_embeddings(self.search_index)
+
+    def search_conversations(self, event=None):
+        """Wyszukuje wpisany tekst we wszystkich zapisanych rozmowach."""
+        query = self.search_entry.get().strip()
+        index = self.search_index
+        if not query or index is None:
+            return
+        limit = (config.get("search") or {}).get("limit") or 20
 
+        # Rozmowy zmienione poza tym oknem (np. w CLI) są doindeksowywane przed wyszukiwaniem
+        index.sync(self.session_store)
+        self._show_search_hits(index.search(query, limit=limit))
+
+        # Wyniki semantyczne dochodzą, gdy model wyznaczy embedding zapytania
+        if self.model_loaded and (config.get("search") or {}).get("semantic"):
+            future = self.interface.submit_embed(query)
+            self.root.after(30, self._poll_search_embedding, future, query, limit)
+
+    def _poll_search_embedding(self, future, query: str, limit: int):
+        if not future.done():
+            self.root.after(30, self._poll_search_embedding, future, query, limit)
+            return
+        if future.exception() is not None or self.search_entry.get().strip() != query:
+            return
+        self._show_search_hits(self.search_index.search(query, limit=limit, query_vector=future.result()))
+
+    def _show_search_hits(self, hits):
+        self.search_hits = hits
+        self.search_listbox.delete(0, tk.END)
+        for hit in hits:
+            role = "Ty" if hit.role == "user" else "Model" if hit.role == "assistant" else hit.role
+            self.search_listbox.insert(tk.END, f"[{hit.title}] {role}: {hit.snippet}")
+        if not hits:
+            self.search_listbox.insert(tk.END, "Brak wyników")
+
+    def _selected_search_hit(self):
+        selection = self.search_listbox.curselection()
+        if not selection or selection[0] >= len(self.search_hits):
+            messagebox.showinfo("Informacja", "Wybierz wynik wyszukiwania.")
+            return None
+        return self.search_hits[selection[0]]
+
+    def open_search_hit(self):
+        """Otwiera rozmowę wybranego wyniku (lub przełącza na kartę, w której jest otwarta)."""
+        hit = self._selected_search_hit()
+        if hit is None:
+            return
+        for session in self.sessions:
+            if session.log is not None and os.path.abspath(session.log.path) == os.path.abspath(hit.path):
+                self.sessions_notebook.select(session.frame)
+                return
+        try:
+            self.open_chat_log(ChatLog(hit.path))
+        except OSError as e:
+            messagebox.showerror("Błąd", f"Nie udało się otworzyć rozmowy: {str(e)}")
+
+    def add_search_hit_to_context(self):
+        """Dopisuje wybrany wynik (z sąsiednimi wiadomościami) do pola kontekstu bieżącej rozmowy."""
+        hit = self._selected_search_hit()
+        if hit is None:
+            return
+        lines = [f"Fragment rozmowy \"{hit.title}\":"]
+        for entry in self.search_index.context(hit):
+            formatted = self._format_message(entry)
+            if formatted is not None:
+                lines.append(formatted[0])
+        if self.context_text.get("1.0", tk.END).strip():
+            self.context_text.insert(tk.END, "\n\n")
+        self.context_text.insert(tk.END, "\n".join(lines))
+        self.schedule_speculative_prefill()
 
 
 def run_gui():
     """Uruchamia interfejs graficzny."""
     try:
-        root = ThemedTk(theme="equilux")  # Inne dostępne motywy: "equilux", "breeze", "black", "clearlooks"
+        try:
+            from ttkthemes import ThemedTk
+            root = ThemedTk(theme="equilux")  # Inne dostępne motywy: "equilux", "breeze", "black", "clearlooks"
+        except ImportError:
+            root = tk.Tk()
         app = LLMApp(root)
+        # Bibliotekę natywną wczytujemy w tle dopiero po wyświetleniu okna
+        root.after_idle(app.interface.preload_backend)
         root.mainloop()
     except Exception as e:
         import traceback
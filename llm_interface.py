@@ -1,17 +1,75 @@
+import asyncio
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
 from typing import Optional, List, Dict, Any, Generator, Union
 
-from llm_core import SimpleLLM
+import llm_metrics
+import llm_trace
+from llm_backend import load_llama_class, model_path_available
+from llm_core import BATCH_SESSION, SimpleLLM, GenerationMetrics, GenerationResult, GenerationStream
+from llm_worker import IsolatedLLM
+from llm_executor import InferenceExecutor, TokenStream, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from llm_chat_template import ChatTemplate, build_messages
+from llm_snapshot import Snapshot, content_hash, file_signature, save_snapshot
 from config import config  # Importujemy instancję Config, nie moduł
 
+# Znacznik miejsca, w którym kończy się znana część wiadomości przy prefillu z wyprzedzeniem
+_PREFIX_MARKER = "\ue000"
+
+# Liczba sesji, dla których pamiętane są tokenizery przyrostowe historii rozmowy
+PROMPT_TOKENIZERS = 8
+
+# Prompt spoza rozmowy (np. prefill z wyprzedzeniem) - liczony bez tokenizera przyrostowego
+_NO_SESSION = object()
+
 
 class SimpleLLMInterface:
     def __init__(self):
         """Interfejs użytkownika dla SimpleLLM."""
-        self.model = None
+        self._model = None
         self.history = []
         self.current_model_params = {}
+        # Informacje o modelu zapamiętane przy ładowaniu - można je odczytać
+        # z dowolnego wątku bez odwoływania się do modelu
+        self.model_info = {}
+        self._executor = None
+        self._chat_template = None
+        self._prompt_tokenizers = OrderedDict()
+
+    @property
+    def model(self):
+        """
+        Załadowany model (SimpleLLM lub IsolatedLLM).
+
+        Gdy działa wątek inferencji, tylko on może korzystać z modelu - inne
+        wątki muszą zlecać operacje przez executor (submit_*), inaczej
+        zapytania do modelu wykonywałyby się równolegle z generowaniem.
+
+        Raises:
+            RuntimeError: przy odwołaniu spoza wątku inferencji
+        """
+        executor = self._executor
+        if executor is not None and executor.running() and not executor.in_worker_thread():
+            raise RuntimeError("Model jest dostępny tylko w wątku inferencji - zleć operację przez executor")
+        return self._model
+
+    @model.setter
+    def model(self, model) -> None:
+        self._model = model
+
+    @property
+    def executor(self) -> InferenceExecutor:
+        """Wątek inferencji, który jako jedyny korzysta z kontekstu modelu."""
+        if self._executor is None:
+            scheduler = config.config.get("scheduler") or {}
+            self._executor = InferenceExecutor(
+                preemption=scheduler.get("preemption", True),
+                latency_targets=scheduler.get("latency_targets")
+            )
+        return self._executor
 
     def load_model(
             self,
@@ -29,31 +87,35 @@ class SimpleLLMInterface:
             True jeśli model został pomyślnie załadowany, False w przeciwnym razie
         """
         try:
-            if not os.path.exists(model_path):
+            backend = kwargs.get("backend", config.config.get("model", {}).get("backend"))
+            if not model_path_available(model_path, backend):
                 print(f"Nie znaleziono pliku modelu: {model_path}")
                 return False
 
-            # Zapisz ścieżkę do ostatnio używanych modeli
-            recent_models = config.config.get("recent_models", [])
-            if model_path in recent_models:
-                recent_models.remove(model_path)
-            recent_models.insert(0, model_path)
-            # Ogranicz listę do 10 ostatnich modeli
-            config.config["recent_models"] = recent_models[:10]
+            # Zapisz ścieżkę do ostatnio używanych modeli (backend testowy nie ma pliku)
+            if os.path.exists(model_path):
+                recent_models = config.config.get("recent_models", [])
+                if model_path in recent_models:
+                    recent_models.remove(model_path)
+                recent_models.insert(0, model_path)
+                # Ogranicz listę do 10 ostatnich modeli
+                config.config["recent_models"] = recent_models[:10]
 
-            # Aktualizuj ostatni używany katalog
-            config.config["last_models_dir"] = os.path.dirname(model_path)
+                # Aktualizuj ostatni używany katalog
+                config.config["last_models_dir"] = os.path.dirname(model_path)
 
             # Załaduj model z parametrami
             # Pobierz domyślne parametry z konfiguracji i nadpisz je przekazanymi argumentami
             model_params = config.config.get("model", {}).copy()
             model_params.update(kwargs)
 
-            # Zapisz aktualne parametry modelu
-            self.current_model_params = model_params
+            # Model może działać w osobnym procesie, aby awaria llama.cpp
+            # nie zamykała całej aplikacji
+            model_class = IsolatedLLM if model_params.get("isolated_process", False) else SimpleLLM
 
-            # Utwórz instancję modelu
-            self.model = SimpleLLM(
+            # Utwórz nową instancję modelu - dotychczasowy model pozostaje
+            # aktywny, dopóki nowy nie zostanie poprawnie załadowany
+            new_model = model_class(
                 model_path=model_path,
                 context_size=model_params.get("context_size", 4096),
                 n_gpu_layers=model_params.get("n_gpu_layers", -1),
@@ -68,16 +130,37 @@ class SimpleLLMInterface:
                 rope_scaling_type=model_params.get("rope_scaling_type"),
                 rope_freq_base=model_params.get("rope_freq_base", 10000.0),
                 rope_freq_scale=model_params.get("rope_freq_scale", 1.0),
-                verbose=True
+                verbose=True,
+                metrics_log=config.config.get("metrics_log"),
+                backend=model_params.get("backend"),
+                backend_options=model_params.get("backend_options"),
+                session_cache=config.config.get("session_cache")
             )
 
+            # Podmień model i zwolnij poprzedni. Gdy load_model działa w wątku
+            # inferencji, żadne generowanie nie korzysta w tym czasie ze starego modelu.
+            # Wywłaszczone odpowiedzi starego modelu nie mogą zostać wznowione po jego zamknięciu
+            if self._executor is not None:
+                self._executor.abort_parked(RuntimeError(
+                    "Generowanie przerwane - w trakcie jego wstrzymania załadowano inny model"))
+            old_model, self.model = self.model, new_model
+            self.current_model_params = model_params
+            self._chat_template = None
+            self._prompt_tokenizers.clear()
+            if old_model is not None:
+                old_model.close()
+
+            llm_metrics.MODEL_LOAD_TIME.observe(getattr(new_model, "load_time", 0.0))
+            llm_metrics.MODEL_LOADED.set(1)
+
             # Zapisz konfigurację
             config.save_config()
 
-            model_info = self.model.get_info()
+            self.model_info = model_info = self.model.get_info()
             print(f"Informacje o modelu:")
             for key, value in model_info.items():
                 print(f"  {key}: {value}")
+            print(f"  chat_template: {self.chat_template.name}")
             return True
 
         except Exception as e:
@@ -90,6 +173,7 @@ class SimpleLLMInterface:
             self,
             prompt: str,
             system_prompt: str = None,
+            history: Optional[List[Dict[str, str]]] = None,
             **kwargs
     ) -> Union[str, Generator[str, None, None]]:
         """
@@ -98,6 +182,7 @@ class SimpleLLMInterface:
         Args:
             prompt: Tekst wprowadzony przez użytkownika
             system_prompt: Prompt systemowy definiujący zachowanie modelu
+            history: Wcześniejsze tury rozmowy ({"role": "user"/"assistant", "content": ...})
             **kwargs: Dodatkowe parametry generowania
 
         Returns:
@@ -111,23 +196,80 @@ class SimpleLLMInterface:
         if system_prompt is None:
             system_prompt = config.config.get("system_prompt", "Jesteś pomocnym asystentem AI.")
 
-        # Formatowanie prompta zgodnie z formatem instrukcji dla modeli
-        formatted_prompt = f"""<s>[INST] {system_prompt}
-
-{prompt} [/INST]"""
-
         # Pobierz parametry generowania z konfiguracji i nadpisz je przekazanymi argumentami
         generation_params = config.config.get("generation", {}).copy()
         generation_params.update(kwargs)
 
+        # Formatowanie rozmowy zgodnie z szablonem czatu modelu
+        with llm_trace.span("format_prompt"):
+            formatted_prompt = self._format_chat(
+                build_messages(prompt, system_prompt, history),
+                generation_params.get("max_tokens"),
+                session=generation_params.get("session")
+            )
+
         # Usuń parametry, które nie są używane przez model.generate()
         stream = generation_params.pop("stream", False)
 
-        return self.model.generate(
+        return self._track("chat", lambda: self.model.generate(
             formatted_prompt,
             stream=stream,
             **generation_params
-        )
+        ))
+
+    @property
+    def chat_template(self) -> ChatTemplate:
+        """Szablon czatu bieżącego modelu (tworzony raz po załadowaniu modelu)."""
+        if self._chat_template is None:
+            self._chat_template = ChatTemplate.from_model_info(self.model.get_chat_template_info())
+        return self._chat_template
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Zwraca liczbę tokenów tekstu dla bieżącego modelu.
+
+        Wyniki tokenizacji są zapamiętywane, więc wielokrotne liczenie tokenów
+        tego samego dokumentu lub historii nie tokenizuje go ponownie.
+        """
+        if self.model is None:
+            return 0
+        return self.model.count_tokens(text)
+
+    def _format_chat(self, messages: List[Dict[str, str]], max_tokens: Optional[int], session: Any = _NO_SESSION) -> str:
+        """
+        Renderuje rozmowę szablonem czatu, usuwając najstarsze tury historii,
+        jeśli prompt nie zmieściłby się w kontekście razem z odpowiedzią.
+        """
+        text = self.chat_template.render(messages)
+        first = 1 if messages[0]["role"] == "system" else 0
+        if len(messages) - first <= 1:
+            return text
+
+        n_ctx = self.model.get_info().get("context_size", 4096)
+        budget = n_ctx - min(max_tokens or n_ctx // 4, n_ctx // 2)
+        while len(messages) - first > 1 and self._prompt_tokens(text, session) > budget:
+            del messages[first]
+            text = self.chat_template.render(messages)
+        return text
+
+    def _prompt_tokens(self, text: str, session: Any) -> int:
+        """
+        Liczy tokeny prompta rozmowy.
+
+        Prompt kolejnej tury sesji zaczyna się od prompta poprzedniej, więc
+        tokenizer przyrostowy sesji tokenizuje tylko dopisaną część. Inny
+        początek tekstu (np. po usunięciu najstarszych tur) tokenizowany jest od nowa.
+        """
+        if session is _NO_SESSION or not hasattr(self.model, "incremental_tokenizer"):
+            return self.model.count_tokens(text)
+        tokenizer = self._prompt_tokenizers.pop(session, None)
+        if tokenizer is None or not text.startswith(tokenizer.text):
+            tokenizer = self.model.incremental_tokenizer()
+        tokenizer.append(text[len(tokenizer.text):])
+        self._prompt_tokenizers[session] = tokenizer
+        while len(self._prompt_tokenizers) > PROMPT_TOKENIZERS:
+            self._prompt_tokenizers.popitem(last=False)
+        return len(tokenizer)
 
     def complete(
             self,
@@ -152,10 +294,54 @@ class SimpleLLMInterface:
         generation_params = config.config.get("generation", {}).copy()
         generation_params.update(kwargs)
 
-        return self.model.generate(
+        return self._track("complete", lambda: self.model.generate(
             prompt,
             **generation_params
-        )
+        ))
+
+    def _track(self, kind: str, generate):
+        """
+        Wywołuje generowanie i dodaje jego pomiary do rejestru metryk.
+
+        Args:
+            kind: rodzaj zapytania ("chat" lub "complete")
+            generate: funkcja wywołująca model
+
+        Returns:
+            Wynik generowania (dla strumienia - strumień mierzony po zakończeniu)
+        """
+        llm_metrics.REQUESTS.labels(kind=kind).inc()
+        start_ns = time.perf_counter_ns()
+        try:
+            with llm_trace.span(f"interface.{kind}"):
+                result = generate()
+        except Exception:
+            llm_metrics.REQUEST_ERRORS.labels(kind=kind).inc()
+            raise
+
+        if isinstance(result, GenerationStream):
+            def tracked():
+                try:
+                    yield from result
+                except Exception:
+                    llm_metrics.REQUEST_ERRORS.labels(kind=kind).inc()
+                    raise
+                finally:
+                    result.close()
+                    llm_trace.tracer.add_complete(f"interface.{kind}.stream", start_ns, time.perf_counter_ns())
+                    llm_metrics.record_generation(kind, result.metrics)
+
+            return GenerationStream(tracked(), result.metrics, result.logprobs, preemptible=result.preemptible)
+
+        if isinstance(result, dict):
+            llm_metrics.record_generation(kind, GenerationMetrics.from_dict(result.get("metrics", {})))
+        elif isinstance(result, list):
+            # Kilka odpowiedzi na ten sam prompt (n > 1)
+            for item in result:
+                llm_metrics.record_generation(kind, getattr(item, "metrics", None))
+        else:
+            llm_metrics.record_generation(kind, getattr(result, "metrics", None))
+        return result
 
     def find_local_models(self, models_dir: str = None) -> List[Path]:
         """
@@ -236,4 +422,458 @@ class SimpleLLMInterface:
         Args:
             system_prompt: Nowy system prompt
         """
-        config.config["system_prompt"] = system_prompt
\ No newline at end of file
+        config.config["system_prompt"] = system_prompt
+
+    def submit_load_model(
+            self,
+            model_path: str,
+            priority: int = PRIORITY_INTERACTIVE,
+            **kwargs
+    ) -> Future:
+        """
+        Zleca załadowanie modelu w wątku inferencji.
+
+        Podmiana modelu następuje dopiero po zakończeniu generowań, które
+        zostały zlecone wcześniej, więc nie przerywa trwającej odpowiedzi.
+        Odpowiedzi wsadowe wywłaszczone przez to zadanie kończą się błędem -
+        nie da się ich wznowić na zamkniętym modelu.
+
+        Args:
+            model_path: ścieżka do lokalnego pliku modelu
+            priority: priorytet zadania w kolejce inferencji
+            **kwargs: dodatkowe parametry dla modelu
+
+        Returns:
+            Future z wynikiem load_model()
+        """
+        return self.executor.submit(self.load_model, model_path, priority=priority, **kwargs)
+
+    def save_snapshot(
+            self,
+            path: str,
+            sessions: List[Dict[str, Any]],
+            attachments: Optional[List[Dict[str, Any]]] = None,
+            extra: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Zapisuje migawkę sesji: model i jego parametry, parametry generowania,
+        rozmowy z ich KV cache oraz załączniki (każda treść raz, według skrótu SHA-256).
+
+        Musi działać w wątku inferencji (submit_save_snapshot()), bo odczytuje stan modelu.
+
+        Args:
+            path: plik migawki
+            sessions: rozmowy - słowniki z kluczami session_id, title, history (oraz dowolnymi innymi)
+            attachments: załączniki - słowniki z kluczami name, path, content
+            extra: dodatkowy stan interfejsu (np. tryb, pole kontekstu)
+
+        Returns:
+            Rozmiar pliku migawki w bajtach
+        """
+        if self.model is None:
+            raise RuntimeError("Model nie jest załadowany")
+
+        blobs = {}
+        attachment_entries = []
+        for attachment in attachments or []:
+            digest = content_hash(attachment["content"])
+            blobs.setdefault(f"file/{digest}", attachment["content"].encode("utf-8"))
+            attachment_entries.append({"name": attachment.get("name"), "path": attachment.get("path"),
+                                       "sha256": digest})
+
+        states = self.model.export_session_states([session["session_id"] for session in sessions])
+        session_entries = []
+        for number, session in enumerate(sessions):
+            entry = dict(session)
+            if session["session_id"] in states:
+                entry["kv"] = f"kv/{number}"
+                blobs[entry["kv"]] = states[session["session_id"]]
+            session_entries.append(entry)
+
+        header = {
+            "created": time.time(),
+            "model": {
+                "path": self.model.model_path,
+                "params": self.current_model_params,
+                "signature": file_signature(self.model.model_path),
+            },
+            "generation": config.get_generation_params(),
+            "system_prompt": config.get("system_prompt"),
+            "sessions": session_entries,
+            "attachments": attachment_entries,
+            "extra": extra or {},
+        }
+        with llm_trace.span("save_snapshot", sessions=len(sessions)):
+            return save_snapshot(path, header, blobs)
+
+    def submit_save_snapshot(self, path: str, sessions: List[Dict[str, Any]], **kwargs) -> Future:
+        """Zleca save_snapshot() w wątku inferencji (po zakończeniu wcześniej zleconych generowań)."""
+        return self.executor.submit(self.save_snapshot, path, sessions, priority=PRIORITY_INTERACTIVE, **kwargs)
+
+    def restore_snapshot(self, path: str, drop_sessions: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """
+        Przywraca migawkę zapisaną przez save_snapshot().
+
+        Model jest ładowany tylko wtedy, gdy załadowany jest inny (lub z innymi
+        parametrami). Stany KV cache rozmów są czytane z pliku mapowanego do
+        pamięci, więc dalsza rozmowa nie wymaga ponownego przetwarzania historii.
+        Jeśli plik modelu zmienił się od zapisania migawki, KV cache jest pomijany.
+
+        Musi działać w wątku inferencji (submit_restore_snapshot()).
+
+        Args:
+            path: plik migawki
+            drop_sessions: sesje, których stany należy wcześniej usunąć (np. zamykane karty)
+
+        Returns:
+            Nagłówek migawki z treścią załączników (attachments[i]["content"])
+            i listą sesji z przywróconym KV cache (restored_sessions)
+        """
+        with llm_trace.span("restore_snapshot"), Snapshot(path) as snapshot:
+            header = snapshot.header
+            model_info = header["model"]
+            params = dict(model_info.get("params") or {})
+            loaded = (self.model is not None and self.model.model_path == model_info["path"] and
+                      all(self.current_model_params.get(key) == value for key, value in params.items()))
+            if not loaded and not self.load_model(model_info["path"], **params):
+                raise RuntimeError(f"Nie udało się załadować modelu {model_info['path']}")
+
+            for session in drop_sessions or []:
+                self.model.drop_session(session)
+
+            states = {}
+            if file_signature(model_info["path"]) == model_info.get("signature"):
+                for entry in header.get("sessions", []):
+                    if entry.get("kv") in snapshot:
+                        states[entry["session_id"]] = snapshot.blob(entry["kv"])
+            else:
+                print("Plik modelu zmienił się od zapisania migawki - historia zostanie przetworzona od nowa.")
+            self.model.import_session_states(states)
+
+            attachments = [
+                dict(attachment, content=bytes(snapshot.blob(f"file/{attachment['sha256']}")).decode("utf-8"))
+                for attachment in header.get("attachments", [])
+            ]
+
+        config.update_section("generation", header.get("generation") or {})
+        if header.get("system_prompt") is not None:
+            config.config["system_prompt"] = header["system_prompt"]
+        return dict(header, attachments=attachments, restored_sessions=list(states))
+
+    def submit_restore_snapshot(self, path: str, **kwargs) -> Future:
+        """Zleca restore_snapshot() w wątku inferencji."""
+        return self.executor.submit(self.restore_snapshot, path, priority=PRIORITY_INTERACTIVE, **kwargs)
+
+    def speculative_prefill(
+            self,
+            prompt_prefix: str,
+            mode: str = "chat",
+            system_prompt: str = None,
+            history: Optional[List[Dict[str, str]]] = None,
+            session: Optional[str] = None
+    ) -> int:
+        """
+        Przetwarza z wyprzedzeniem znany początek przyszłego prompta (np. dołączone
+        pliki i kontekst), aby po zleceniu generowania model przetwarzał tylko
+        końcówkę prompta.
+
+        Args:
+            prompt_prefix: początek treści wiadomości (tryb chat) lub prompta (tryb complete)
+            mode: "chat" lub "complete"
+            system_prompt: prompt systemowy (None - z konfiguracji, jak w chat())
+            history: wcześniejsze tury rozmowy
+            session: sesja rozmowy, której KV cache ma zostać wypełniony
+
+        Returns:
+            Liczba nowo przetworzonych tokenów
+        """
+        if self.model is None or not prompt_prefix:
+            return 0
+        if mode != "chat":
+            return self.model.prefill_prompt(prompt_prefix, session=session)
+
+        if system_prompt is None:
+            system_prompt = config.config.get("system_prompt", "Jesteś pomocnym asystentem AI.")
+        max_tokens = config.config.get("generation", {}).get("max_tokens")
+        # Renderujemy rozmowę ze znacznikiem na końcu znanej części wiadomości
+        # i przetwarzamy tekst prompta aż do znacznika
+        with llm_trace.span("format_prompt"):
+            text = self._format_chat(build_messages(prompt_prefix + _PREFIX_MARKER, system_prompt, history),
+                                     max_tokens)
+        position = text.find(_PREFIX_MARKER)
+        if position <= 0:
+            return 0
+        return self.model.prefill_prompt(text[:position], session=session)
+
+    def submit_speculative_prefill(self, prompt_prefix: str, **kwargs) -> Future:
+        """
+        Zleca speculative_prefill() w wątku inferencji z niskim priorytetem,
+        więc nie opóźnia generowania zleconego przez użytkownika.
+
+        Returns:
+            Future z liczbą przetworzonych tokenów (można go anulować, dopóki czeka w kolejce)
+        """
+        return self.executor.submit(self.speculative_prefill, prompt_prefix, priority=PRIORITY_BATCH, **kwargs)
+
+    def submit_count_tokens(self, text: str, priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        Zleca policzenie tokenów tekstu w wątku inferencji.
+
+        Returns:
+            Future z liczbą tokenów (0, jeśli model nie jest załadowany)
+        """
+        return self.executor.submit(self.count_tokens, text, priority=priority)
+
+    def submit_drop_session(self, session: str) -> Future:
+        """
+        Zleca usunięcie zapisanego KV cache sesji (np. po zamknięciu karty rozmowy).
+
+        Args:
+            session: identyfikator sesji przekazywany jako parametr `session` generowania
+
+        Returns:
+            Future zakończony po usunięciu stanu
+        """
+        def drop():
+            self._prompt_tokenizers.pop(session, None)
+            if self.model is not None:
+                self.model.drop_session(session)
+
+        return self.executor.submit(drop, priority=PRIORITY_BATCH)
+
+    def submit_embed(self, text: str, priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        Zleca wyznaczenie embeddingu tekstu (np. zapytania wyszukiwania) w wątku inferencji.
+
+        Returns:
+            Future z wektorem embeddingu
+        """
+        def embed():
+            if self.model is None:
+                raise RuntimeError("Model nie jest załadowany")
+            return self.model.embed(text)
+
+        return self.executor.submit(embed, priority=priority)
+
+    def submit_index_embeddings(self, index, batch_size: int = 16) -> Future:
+        """
+        Zleca wyznaczenie brakujących embeddingów wiadomości w indeksie wyszukiwania.
+
+        Embeddingi są liczone partiami z niskim priorytetem - każda partia to
+        osobne zadanie, więc generowanie zlecone w międzyczasie nie czeka na
+        zaindeksowanie wszystkich rozmów.
+
+        Args:
+            index: llm_search.SearchIndex
+            batch_size: liczba wiadomości w jednym zadaniu
+
+        Returns:
+            Future z liczbą wiadomości w pierwszej partii
+        """
+        def update():
+            if self.model is None:
+                return 0
+            try:
+                count = index.update_embeddings(self.model.embed, limit=batch_size)
+            except Exception as e:
+                print(f"Nie udało się wyznaczyć embeddingów wiadomości: {e}")
+                return 0
+            if count == batch_size:
+                self.executor.submit(update, priority=PRIORITY_BATCH)
+            return count
+
+        return self.executor.submit(update, priority=PRIORITY_BATCH)
+
+    def preload_backend(self) -> Future:
+        """
+        Importuje bibliotekę natywną w tle (z niskim priorytetem), aby pierwsze
+        ładowanie modelu nie czekało na jej wczytanie.
+
+        Wczytanie z wyprzedzeniem nigdy nie instaluje biblioteki - jeśli import
+        się nie powiedzie, błąd (lub instalacja) nastąpi przy pierwszym
+        ładowaniu modelu.
+
+        Returns:
+            Future zakończony po próbie importu (True - biblioteka wczytana)
+        """
+        def preload():
+            try:
+                load_llama_class(install=False)
+            except Exception:
+                return False
+            return True
+
+        return self.executor.submit(preload, priority=PRIORITY_BATCH)
+
+    def submit_chat(
+            self,
+            prompt: str,
+            system_prompt: str = None,
+            priority: int = PRIORITY_INTERACTIVE,
+            **kwargs
+    ) -> TokenStream:
+        """
+        Zleca odpowiedź czatu w wątku inferencji.
+
+        Zwrócony strumień zawiera fragmenty odpowiedzi (lub jeden fragment
+        z całą odpowiedzią, jeśli stream=False). Tylko odpowiedź strumieniowana
+        może zostać wywłaszczona przez pilniejsze zadanie; zadania wsadowe bez
+        podanej sesji korzystają z osobnej sesji BATCH_SESSION. Zapytanie
+        z terminem (`deadline`, czas time.time()) jest przycinane przed
+        terminem, a odrzucane (DeadlineExceededError), jeśli kolejka nie
+        pozwala rozpocząć go na czas.
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            system_prompt: Prompt systemowy definiujący zachowanie modelu
+            priority: priorytet zadania w kolejce inferencji
+            **kwargs: Dodatkowe parametry generowania (w tym deadline i deadline_sentence)
+
+        Returns:
+            Strumień fragmentów odpowiedzi
+        """
+        params = self._scheduled_params(priority, kwargs)
+        return self.executor.submit_stream(self.chat, prompt, system_prompt, priority=priority,
+                                           deadline=params.pop("deadline", None), **params)
+
+    def submit_complete(
+            self,
+            prompt: str,
+            priority: int = PRIORITY_INTERACTIVE,
+            **kwargs
+    ) -> TokenStream:
+        """
+        Zleca uzupełnienie tekstu w wątku inferencji.
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            priority: priorytet zadania w kolejce inferencji
+            **kwargs: Dodatkowe parametry generowania
+
+        Returns:
+            Strumień fragmentów odpowiedzi
+        """
+        params = self._scheduled_params(priority, kwargs)
+        return self.executor.submit_stream(self._complete_text, prompt, priority=priority,
+                                           deadline=params.pop("deadline", None), **params)
+
+    @staticmethod
+    def _scheduled_params(priority: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parametry generowania zadania o danym priorytecie: zadania o niższym
+        priorytecie niż interaktywne bez własnej sesji trafiają do sesji
+        wsadowej, więc ich KV cache nie miesza się z rozmową użytkownika.
+        """
+        if priority > PRIORITY_INTERACTIVE and params.get("session") is None:
+            params = dict(params, session=BATCH_SESSION)
+        return params
+
+    def _complete_text(self, prompt: str, **kwargs):
+        """Wywołuje complete() i sprowadza pełny słownik odpowiedzi do tekstu."""
+        response = self.complete(prompt, **kwargs)
+        if isinstance(response, dict):
+            text = GenerationResult(response["choices"][0]["text"])
+            text.metrics = GenerationMetrics.from_dict(response.get("metrics", {}))
+            return text
+        return response
+
+    async def aload_model(
+            self,
+            model_path: str,
+            **kwargs
+    ) -> bool:
+        """
+        Asynchronicznie ładuje model w wątku inferencji.
+
+        Args:
+            model_path: ścieżka do lokalnego pliku modelu
+            **kwargs: dodatkowe parametry dla modelu
+
+        Returns:
+            True jeśli model został pomyślnie załadowany, False w przeciwnym razie
+        """
+        future = self.executor.submit(self.load_model, model_path, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    async def achat(
+            self,
+            prompt: str,
+            system_prompt: str = None,
+            **kwargs
+    ) -> str:
+        """
+        Asynchroniczna wersja chat(), zwracająca pełną odpowiedź.
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            system_prompt: Prompt systemowy definiujący zachowanie modelu
+            **kwargs: Dodatkowe parametry generowania
+
+        Returns:
+            Wygenerowana odpowiedź
+        """
+        kwargs["stream"] = False
+        future = self.executor.submit(self.chat, prompt, system_prompt, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    async def acomplete(
+            self,
+            prompt: str,
+            **kwargs
+    ):
+        """
+        Asynchroniczna wersja complete(), zwracająca pełną odpowiedź.
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            **kwargs: Dodatkowe parametry generowania
+
+        Returns:
+            Wygenerowana odpowiedź
+        """
+        kwargs["stream"] = False
+        future = self.executor.submit(self.complete, prompt, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def astream_chat(
+            self,
+            prompt: str,
+            system_prompt: str = None,
+            **kwargs
+    ) -> TokenStream:
+        """
+        Strumieniuje odpowiedź czatu jako asynchroniczny iterator.
+
+        Musi być wywołana wewnątrz działającej pętli asyncio:
+        ``async for chunk in interface.astream_chat(prompt): ...``
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            system_prompt: Prompt systemowy definiujący zachowanie modelu
+            **kwargs: Dodatkowe parametry generowania
+
+        Returns:
+            Asynchroniczny strumień fragmentów odpowiedzi
+        """
+        kwargs["stream"] = True
+        loop = asyncio.get_running_loop()
+        return self.executor.submit_stream(self.chat, prompt, system_prompt, loop=loop, **kwargs)
+
+    def astream_complete(
+            self,
+            prompt: str,
+            **kwargs
+    ) -> TokenStream:
+        """
+        Strumieniuje uzupełnienie tekstu jako asynchroniczny iterator.
+
+        Args:
+            prompt: Tekst wprowadzony przez użytkownika
+            **kwargs: Dodatkowe parametry generowania
+
+        Returns:
+            Asynchroniczny strumień fragmentów odpowiedzi
+        """
+        kwargs["stream"] = True
+        loop = asyncio.get_running_loop()
+        return self.executor.submit_stream(self.complete, prompt, loop=loop, **kwargs)
@@ -0,0 +1,276 @@
+import hashlib
+import itertools
+import os
+import pickle
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# Domyślny limit pamięci RAM na odłożone stany sesji (bajty)
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Poziom kompresji zlib - najszybszy, KV cache i tak kompresuje się umiarkowanie
+DEFAULT_COMPRESSION_LEVEL = 1
+
+# Pierwszy bajt zapisanego stanu: czy dane są skompresowane
+_RAW = b"\0"
+_COMPRESSED = b"\1"
+
+
+def _state_size(state: Any) -> int:
+    """Szacuje rozmiar stanu w pamięci (dla LlamaState - bufor kontekstu i tablice tokenów/logitów)."""
+    size = getattr(state, "llama_state_size", None)
+    if size is not None:
+        for name in ("input_ids", "scores"):
+            size += getattr(getattr(state, name, None), "nbytes", 0)
+        return int(size)
+    # Stany innych backendów (np. testowego) są małe - wystarczy rozmiar po serializacji
+    return len(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class SessionStateStore:
+    """
+    Magazyn stanów KV cache bezczynnych sesji rozmów.
+
+    Stany są trzymane w pamięci RAM bez zmian (obiekty zwrócone przez
+    backend.save_state()) w kolejności LRU, więc przełączenie sesji to tylko
+    kopia bufora kontekstu. Gdy łączny rozmiar przekroczy budżet pamięci,
+    najdawniej używane stany są serializowane (pickle), opcjonalnie
+    kompresowane i trafiają do katalogu na dysku (jeśli go podano) albo są
+    usuwane - taka sesja przy następnej turze przetworzy swoją historię od
+    nowa. Przywrócenie stanu z dysku to odczyt i dekompresja, a nie ponowny
+    prefill całej rozmowy.
+    """
+
+    def __init__(
+            self,
+            memory_budget: int = DEFAULT_MEMORY_BUDGET,
+            spill_dir: Optional[str] = None,
+            disk_budget: Optional[int] = None,
+            compress: bool = True,
+            compression_level: int = DEFAULT_COMPRESSION_LEVEL
+    ):
+        """
+        Args:
+            memory_budget: maksymalny łączny rozmiar stanów w pamięci (bajty)
+            spill_dir: katalog na stany wypchnięte z pamięci (None - stany są usuwane)
+            disk_budget: maksymalny łączny rozmiar stanów na dysku (None - bez limitu)
+            compress: czy kompresować stany zapisywane na dysk i w migawkach (zlib)
+            compression_level: poziom kompresji zlib (1-9)
+        """
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.disk_budget = disk_budget
+        self.compress = compress
+        self.compression_level = compression_level
+
+        # Stan w pamięci: (obiekt stanu lub postać z encode(), czy zakodowany, rozmiar)
+        self._memory: "OrderedDict[Hashable, Tuple[Any, bool, int]]" = OrderedDict()
+        self._disk: "OrderedDict[Hashable, Tuple[str, int]]" = OrderedDict()
+        # Stany wyjęte z pamięci, które są właśnie zapisywane na dysk (poza blokadą)
+        self._spilling: Dict[Hashable, Tuple[Any, bool]] = {}
+        self._spill_count = itertools.count()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.spilled = 0
+        self.evicted = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def encode(self, state: Any) -> bytes:
+        """Serializuje (i kompresuje) stan do postaci przechowywanej w magazynie."""
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            return _COMPRESSED + zlib.compress(data, self.compression_level)
+        return _RAW + data
+
+    @staticmethod
+    def decode(blob: bytes) -> Any:
+        """Odtwarza stan z postaci zwróconej przez encode() (także z memoryview)."""
+        data = memoryview(blob)[1:]
+        if blob[:1] == _COMPRESSED:
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def _spill_path(self, key: Hashable) -> str:
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{os.getpid()}-{name}-{next(self._spill_count)}.kv")
+
+    def _put_entry(self, key: Hashable, value: Any, encoded: bool, size: int) -> None:
+        with self._lock:
+            self._remove(key)
+            self._memory[key] = (value, encoded, size)
+            self._memory_bytes += size
+            victims = self._over_budget()
+        self._spill(victims)
+
+    def put(self, key: Hashable, state: Any) -> None:
+        """Odkłada stan sesji (zastępuje wcześniej odłożony stan tej sesji) bez serializacji."""
+        self._put_entry(key, state, False, _state_size(state))
+
+    def put_blob(self, key: Hashable, blob: bytes) -> None:
+        """Odkłada stan w postaci zwróconej przez encode() (np. wczytany z migawki sesji)."""
+        blob = bytes(blob)
+        self._put_entry(key, blob, True, len(blob))
+
+    def get_blob(self, key: Hashable) -> Optional[bytes]:
+        """Zwraca zakodowany stan sesji bez wyjmowania go z magazynu (None, jeśli go nie ma)."""
+        with self._lock:
+            entry = self._memory.get(key) or self._spilling.get(key)
+            disk_entry = self._disk.get(key) if entry is None else None
+        if entry is not None:
+            value, encoded = entry[:2]
+            # Stan w pamięci jest kodowany dopiero na żądanie (np. zapis migawki)
+            return value if encoded else self.encode(value)
+        if disk_entry is None:
+            return None
+        try:
+            with open(disk_entry[0], 'rb') as f:
+                return f.read()
+        except OSError as e:
+            print(f"Nie udało się odczytać stanu sesji z dysku: {e}")
+            return None
+
+    def take(self, key: Hashable) -> Optional[Any]:
+        """
+        Wyjmuje stan sesji z magazynu.
+
+        Returns:
+            Stan przekazany wcześniej do put() lub None, jeśli go nie ma (lub został usunięty)
+        """
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_bytes -= entry[2]
+            else:
+                # Stan zapisywany właśnie na dysk - zapis zostanie porzucony
+                entry = self._spilling.pop(key, None)
+            if entry is not None:
+                value, encoded = entry[:2]
+                if not encoded:
+                    return value
+                blob = value
+            else:
+                entry = self._disk.pop(key, None)
+                if entry is None:
+                    return None
+                path, size = entry
+                self._disk_bytes -= size
+                blob = None
+        if blob is None:
+            # Plik jest już wyrejestrowany - odczyt nie musi blokować magazynu
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                os.unlink(path)
+            except OSError as e:
+                print(f"Nie udało się odczytać stanu sesji z dysku: {e}")
+                return None
+        return self.decode(blob)
+
+    def discard(self, key: Hashable) -> None:
+        """Usuwa stan sesji z pamięci i z dysku."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """Usuwa wszystkie stany (także pliki na dysku)."""
+        with self._lock:
+            for key in list(self._memory) + list(self._spilling) + list(self._disk):
+                self._remove(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._memory or key in self._spilling or key in self._disk
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory) + len(self._spilling) + len(self._disk)
+
+    def stats(self) -> Dict[str, Any]:
+        """Zajętość magazynu (do get_info() i metryk; można wywołać z dowolnego wątku)."""
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._memory),
+                "sessions_on_disk": len(self._disk),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "spilled": self.spilled,
+                "evicted": self.evicted,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[2]
+        self._spilling.pop(key, None)
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            path, size = entry
+            self._disk_bytes -= size
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _over_budget(self) -> List[Tuple[Hashable, Tuple[Any, bool]]]:
+        """
+        Wyjmuje z pamięci najdawniej używane stany ponad budżet (wywoływana pod blokadą).
+
+        Returns:
+            Stany do zapisania na dysk przez _spill() (bez katalogu na dysku są od razu usuwane)
+        """
+        victims = []
+        while self._memory_bytes > self.memory_budget and self._memory:
+            key, (value, encoded, size) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            if not self.spill_dir:
+                self.evicted += 1
+                continue
+            pending = (value, encoded)
+            self._spilling[key] = pending
+            victims.append((key, pending))
+        return victims
+
+    def _spill(self, victims: List[Tuple[Hashable, Tuple[Any, bool]]]) -> None:
+        """
+        Zapisuje wyjęte stany na dysk.
+
+        Serializacja, kompresja i zapis (setki MB) odbywają się poza blokadą,
+        więc stats() i sprawdzanie sesji z innych wątków nie czekają na dysk.
+        Stan wyjęty lub zastąpiony w trakcie zapisu nie jest rejestrowany.
+        """
+        for key, pending in victims:
+            value, encoded = pending
+            path = self._spill_path(key)
+            try:
+                # Serializacja i kompresja dopiero przy zapisie na dysk
+                blob = value if encoded else self.encode(value)
+                with open(path, 'wb') as f:
+                    f.write(blob)
+            except OSError as e:
+                print(f"Nie udało się zapisać stanu sesji na dysk: {e}")
+                with self._lock:
+                    if self._spilling.get(key) is pending:
+                        del self._spilling[key]
+                        self.evicted += 1
+                continue
+
+            with self._lock:
+                current = self._spilling.get(key) is pending
+                if current:
+                    del self._spilling[key]
+                    self._disk[key] = (path, len(blob))
+                    self._disk_bytes += len(blob)
+                    self.spilled += 1
+                    while self.disk_budget is not None and self._disk_bytes > self.disk_budget and self._disk:
+                        self._remove(next(iter(self._disk)))
+                        self.evicted += 1
+            if not current:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
@@ -0,0 +1,392 @@
+import codecs
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Rozmiar bloku czytanego z pliku tekstowego (bajty)
+_READ_BLOCK = 256 * 1024
+
+# Początkowe oszacowanie liczby znaków na token (poprawiane na bieżąco dla dokumentu)
+_CHARS_PER_TOKEN = 4.0
+
+DEFAULT_MAP_PROMPT = (
+    "Zadanie: {task}\n\n"
+    "Poniżej jest fragment {number} dużego dokumentu \"{name}\". Wykonaj zadanie tylko dla tego fragmentu.\n\n"
+    "--- Fragment ---\n{chunk}\n--- Koniec fragmentu ---"
+)
+
+DEFAULT_REDUCE_PROMPT = (
+    "Zadanie: {task}\n\n"
+    "Poniżej są wyniki tego zadania dla kolejnych części dokumentu \"{name}\". Połącz je w jeden spójny "
+    "wynik dla całości, bez powtórzeń.\n\n{parts}"
+)
+
+# Funkcja wykonująca prompty: zwraca (indeks, odpowiedź, błąd lub None) w kolejności wejścia,
+# np. BatchGenerator.run albo interface_runner()
+PromptRunner = Callable[[Iterable[str]], Iterator[Tuple[int, str, Optional[str]]]]
+
+
+def default_chunk_tokens(context_size: int, max_tokens: int) -> int:
+    """Największy fragment, który razem z szablonem prompta i odpowiedzią zmieści się w kontekście."""
+    return max(256, context_size - max_tokens - 256)
+
+
+class DocumentReader:
+    """
+    Czyta tekst dokumentu blokami, bez wczytywania całego pliku do pamięci.
+
+    Pliki tekstowe czytane są blokami bajtów, PDF - stronami (PyPDF2),
+    DOCX - akapitami (python-docx). Atrybut `progress` podaje przybliżoną
+    część przeczytanego dokumentu (0-1).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.progress = 0.0
+
+    def __iter__(self) -> Iterator[str]:
+        lower = self.path.lower()
+        if lower.endswith('.pdf'):
+            return self._read_pdf()
+        if lower.endswith(('.docx', '.doc')):
+            return self._read_docx()
+        if lower.endswith(('.html', '.htm')):
+            return self._read_html()
+        return self._read_text()
+
+    def _read_text(self) -> Iterator[str]:
+        size = os.path.getsize(self.path) or 1
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        position = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                data = f.read(_READ_BLOCK)
+                position += len(data)
+                self.progress = position / size
+                text = decoder.decode(data, final=not data)
+                if text:
+                    yield text
+                if not data:
+                    return
+
+    def _read_pdf(self) -> Iterator[str]:
+        import PyPDF2
+        with open(self.path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            pages = len(reader.pages) or 1
+            for number, page in enumerate(reader.pages, 1):
+                self.progress = number / pages
+                yield (page.extract_text() or "") + "\n"
+
+    def _read_docx(self) -> Iterator[str]:
+        from docx import Document
+        paragraphs = Document(self.path).paragraphs
+        for number, paragraph in enumerate(paragraphs, 1):
+            self.progress = number / len(paragraphs)
+            yield paragraph.text + "\n"
+
+    def _read_html(self) -> Iterator[str]:
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        try:
+            from bs4 import BeautifulSoup
+            content = BeautifulSoup(content, 'html.parser').get_text()
+        except ImportError:
+            pass
+        self.progress = 1.0
+        yield content
+
+
+def _cut_position(text: str, limit: int) -> int:
+    """Najdalsza granica (koniec linii, potem spacja) nie dalej niż `limit` znaków."""
+    if limit >= len(text):
+        return len(text)
+    for separator in ("\n", " "):
+        position = text.rfind(separator, 0, limit)
+        if position >= limit // 2:
+            return position + 1
+    return max(1, limit)
+
+
+def iter_token_chunks(blocks: Iterable[str], count_tokens: Callable[[str], int], max_tokens: int) -> Iterator[str]:
+    """
+    Dzieli strumień tekstu na fragmenty o co najwyżej `max_tokens` tokenach.
+
+    Fragmenty kończą się na granicy linii (lub słowa). Długość fragmentu jest
+    szacowana ze średniej liczby znaków na token, a następnie sprawdzana
+    tokenizerem - każdy fragment jest tokenizowany zwykle jeden raz.
+
+    Args:
+        blocks: kolejne bloki tekstu (np. DocumentReader)
+        count_tokens: funkcja licząca tokeny tekstu
+        max_tokens: maksymalna liczba tokenów fragmentu
+
+    Returns:
+        Iterator fragmentów tekstu
+    """
+    chars_per_token = _CHARS_PER_TOKEN
+    pending = ""
+    blocks = iter(blocks)
+    exhausted = False
+    while True:
+        target = max(1, int(max_tokens * chars_per_token))
+        if not exhausted and len(pending) < target:
+            try:
+                pending += next(blocks)
+            except StopIteration:
+                exhausted = True
+            continue
+        if not pending.strip():
+            if exhausted:
+                return
+            # Sam biały znak (np. puste strony PDF) - pomiń go i czytaj dalej
+            pending = ""
+            continue
+
+        end = _cut_position(pending, target)
+        tokens = count_tokens(pending[:end])
+        while tokens > max_tokens and end > 1:
+            end = _cut_position(pending, max(1, int(end * max_tokens / tokens * 0.95)))
+            tokens = count_tokens(pending[:end])
+        if tokens:
+            chars_per_token = end / tokens
+        chunk, pending = pending[:end], pending[end:]
+        if chunk.strip():
+            yield chunk
+
+
+def interface_runner(interface, mode: str = "complete", **generation_params) -> PromptRunner:
+    """
+    Zwraca funkcję wykonującą prompty załadowanym modelem interfejsu.
+
+    Prompty trafiają do wątku inferencji z niskim priorytetem (kilka naraz
+    w kolejce) jako strumienie, więc pytanie użytkownika zadane w trakcie
+    wywłaszcza bieżącą odpowiedź na granicy tokenu.
+    """
+    from llm_executor import PRIORITY_BATCH
+
+    generation_params = dict(generation_params, stream=True)
+
+    def run(prompts: Iterable[str]) -> Iterator[Tuple[int, str, Optional[str]]]:
+        in_flight = []
+        prompts = enumerate(prompts)
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < 2:
+                try:
+                    index, prompt = next(prompts)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if mode == "chat":
+                    stream = interface.submit_chat(prompt, priority=PRIORITY_BATCH, history=[], **generation_params)
+                else:
+                    stream = interface.submit_complete(prompt, priority=PRIORITY_BATCH, **generation_params)
+                in_flight.append((index, stream))
+            if not in_flight:
+                return
+            index, stream = in_flight.pop(0)
+            try:
+                yield index, "".join(stream), None
+            except Exception as e:
+                yield index, "", f"{type(e).__name__}: {e}"
+
+    return run
+
+
+def interface_token_counter(interface) -> Callable[[str], int]:
+    """
+    Zwraca funkcję liczącą tokeny załadowanym modelem interfejsu.
+
+    Tokenizacja odbywa się w wątku inferencji (z niskim priorytetem, w kolejce
+    za fragmentami już przekazanymi do modelu), więc licznik można wywoływać
+    z dowolnego wątku.
+    """
+    from llm_executor import PRIORITY_BATCH
+
+    def count(text: str) -> int:
+        return interface.submit_count_tokens(text, priority=PRIORITY_BATCH).result()
+
+    return count
+
+
+class MapReduceJob:
+    """
+    Przetwarzanie dokumentu większego niż kontekst modelu metodą map-reduce.
+
+    Etap map wykonuje zadanie dla każdego fragmentu dokumentu (fragmenty są
+    czytane i dzielone na bieżąco, a prompty przekazywane do wykonawcy, który
+    może przetwarzać je równolegle). Etap reduce łączy wyniki częściowe
+    grupami mieszczącymi się w limicie tokenów, poziom po poziomie, aż
+    zostanie jeden wynik. Każdy wynik jest dopisywany do pliku postępu (JSONL),
+    więc przerwane zadanie uruchomione ponownie pomija wykonane już prompty.
+    """
+
+    def __init__(
+            self,
+            source_path: str,
+            task: str,
+            count_tokens: Callable[[str], int],
+            chunk_tokens: int = 2048,
+            checkpoint_path: Optional[str] = None,
+            map_prompt: str = DEFAULT_MAP_PROMPT,
+            reduce_prompt: str = DEFAULT_REDUCE_PROMPT
+    ):
+        """
+        Args:
+            source_path: plik dokumentu (tekst, log, PDF, DOCX, HTML)
+            task: polecenie wykonywane dla dokumentu (np. "Streść", "Wypisz wszystkie błędy")
+            count_tokens: funkcja licząca tokeny tekstu dla używanego modelu
+            chunk_tokens: maksymalna liczba tokenów fragmentu (i grupy wyników przy reduce)
+            checkpoint_path: plik postępu (None - bez wznawiania)
+            map_prompt: szablon prompta dla fragmentu ({task}, {name}, {number}, {chunk})
+            reduce_prompt: szablon prompta łączącego wyniki ({task}, {name}, {parts})
+        """
+        self.source_path = source_path
+        self.task = task
+        self.count_tokens = count_tokens
+        self.chunk_tokens = chunk_tokens
+        self.checkpoint_path = checkpoint_path
+        self.map_prompt = map_prompt
+        self.reduce_prompt = reduce_prompt
+        self.name = os.path.basename(source_path)
+        self.reader = DocumentReader(source_path)
+        # Postęp: etap ("map" lub "reduce N"), liczba wykonanych promptów, część dokumentu
+        self.stage = "map"
+        self.done = 0
+        self.failed = 0
+        self._results: Dict[int, Dict[int, str]] = {}
+        self._checkpoint = None
+
+    def _job_header(self) -> Dict[str, Any]:
+        stat = os.stat(self.source_path)
+        return {
+            "type": "job",
+            "source": os.path.abspath(self.source_path),
+            "size": stat.st_size,
+            "mtime": int(stat.st_mtime),
+            "task": self.task,
+            "chunk_tokens": self.chunk_tokens,
+            "map_prompt": self.map_prompt,
+            "reduce_prompt": self.reduce_prompt,
+        }
+
+    def _open_checkpoint(self) -> None:
+        """Wczytuje wyniki z pliku postępu, jeśli dotyczy tego samego zadania, i otwiera go do dopisywania."""
+        if self.checkpoint_path is None:
+            return
+        header = self._job_header()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                records = []
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Niedokończona ostatnia linia przerwanego zapisu
+                        continue
+            if records and records[0] == header:
+                for record in records[1:]:
+                    self._results.setdefault(record["level"], {})[record["index"]] = record["response"]
+                self._checkpoint = open(self.checkpoint_path, 'a', encoding='utf-8')
+                return
+            print("Plik postępu dotyczy innego zadania lub innej wersji pliku - zaczynam od początku.")
+        self._checkpoint = open(self.checkpoint_path, 'w', encoding='utf-8')
+        self._checkpoint.write(json.dumps(header, ensure_ascii=False) + "\n")
+        self._checkpoint.flush()
+
+    def _store(self, level: int, index: int, response: str) -> None:
+        self._results.setdefault(level, {})[index] = response
+        if self._checkpoint is not None:
+            record = {"level": level, "index": index, "response": response}
+            self._checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._checkpoint.flush()
+
+    def _run_level(self, level: int, prompts: Iterable[Tuple[int, str]], runner: PromptRunner,
+                   progress: Optional[Callable[["MapReduceJob"], None]]) -> None:
+        """Wykonuje prompty poziomu, pomijając te, których wyniki są już w pliku postępu."""
+        completed = self._results.get(level, {})
+        pending_indexes: List[int] = []
+
+        def pending_prompts():
+            for index, prompt in prompts:
+                if index in completed:
+                    self.done += 1
+                    continue
+                pending_indexes.append(index)
+                yield prompt
+
+        for position, response, error in runner(pending_prompts()):
+            index = pending_indexes[position]
+            if error is not None:
+                print(f"Błąd przetwarzania ({self.stage}, część {index + 1}): {error}")
+                self.failed += 1
+            else:
+                self._store(level, index, response)
+                self.done += 1
+            if progress is not None:
+                progress(self)
+
+        if self.failed:
+            # Kolejny poziom musi powstać z kompletu wyników - inaczej wznowienie pomieszałoby grupy
+            raise RuntimeError(f"Nie udało się przetworzyć {self.failed} części ({self.stage}). "
+                               f"Uruchom zadanie ponownie, aby je powtórzyć.")
+
+    def _groups(self, parts: List[str]) -> List[List[str]]:
+        """Dzieli wyniki na grupy mieszczące się w limicie tokenów (co najmniej dwa wyniki w grupie)."""
+        groups: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for part in parts:
+            tokens = self.count_tokens(part)
+            if len(current) >= 2 and current_tokens + tokens > self.chunk_tokens:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += tokens
+        if current:
+            if len(current) == 1 and groups:
+                groups[-1].append(current[0])
+            else:
+                groups.append(current)
+        return groups
+
+    def run(self, runner: PromptRunner, progress: Optional[Callable[["MapReduceJob"], None]] = None) -> str:
+        """
+        Wykonuje zadanie.
+
+        Args:
+            runner: wykonawca promptów (np. BatchGenerator.run lub interface_runner())
+            progress: funkcja wywoływana po każdym wykonanym prompcie (z tym obiektem)
+
+        Returns:
+            Wynik dla całego dokumentu
+        """
+        self._open_checkpoint()
+        try:
+            chunks = iter_token_chunks(self.reader, self.count_tokens, self.chunk_tokens)
+            map_prompts = ((index, self.map_prompt.format(task=self.task, name=self.name, number=index + 1,
+                                                         chunk=chunk))
+                           for index, chunk in enumerate(chunks))
+            self._run_level(0, map_prompts, runner, progress)
+
+            level = 0
+            while True:
+                results = self._results.get(level, {})
+                parts = [results[index] for index in sorted(results)]
+                if len(parts) <= 1:
+                    return parts[0] if parts else ""
+                level += 1
+                self.stage = f"reduce {level}"
+                groups = self._groups(parts)
+                reduce_prompts = (
+                    (index, self.reduce_prompt.format(
+                        task=self.task, name=self.name,
+                        parts="\n\n".join(f"--- Część {number} ---\n{part}" for number, part in enumerate(group, 1))))
+                    for index, group in enumerate(groups)
+                )
+                self._run_level(level, reduce_prompts, runner, progress)
+        finally:
+            if self._checkpoint is not None:
+                self._checkpoint.close()
+                self._checkpoint = None
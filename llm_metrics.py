@@ -0,0 +1,380 @@
+import bisect
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Domyślne przedziały histogramów czasu (w sekundach)
+DEFAULT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Przedziały dla czasu dekodowania pojedynczego tokenu
+TOKEN_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Wspólna część metryk: nazwa, opis i wartości dla kombinacji etykiet."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._children_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs) -> "_Metric":
+        """Zwraca metrykę dla podanych wartości etykiet (tworzoną przy pierwszym użyciu)."""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[Tuple[Tuple[str, ...], "_Metric"]]:
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, metric in self._samples():
+            lines.extend(metric._render_values(self.name, self.labelnames, values))
+        return lines
+
+    def _render_values(self, name: str, labelnames, values) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Licznik, który może tylko rosnąć."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _render_values(self, name, labelnames, values) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self._value)}"]
+
+
+class Gauge(_Metric):
+    """Wartość, która może rosnąć i maleć, opcjonalnie wyliczana przy odczycie."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Ustawia funkcję, która wylicza wartość przy każdym odczycie."""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+    def _render_values(self, name, labelnames, values) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Histogram(_Metric):
+    """Histogram z ustalonymi przedziałami (łączny licznik i suma obserwacji)."""
+
+    kind = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_TIME_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float, count: int = 1) -> None:
+        """Dodaje obserwację (lub `count` jednakowych obserwacji)."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += count
+            self._sum += value * count
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _render_values(self, name, labelnames, values) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Rejestr metryk procesu, eksportowany w formacie tekstowym Prometheusa."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_TIME_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Zwraca wszystkie metryki w formacie tekstowym Prometheusa (wersja 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _resident_memory_bytes() -> float:
+    """Zwraca bieżące zużycie pamięci RSS procesu."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # Na systemach bez /proc dostępne jest tylko maksymalne zużycie (macOS: w bajtach)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return 0.0
+
+
+# Globalny rejestr i metryki aplikacji
+registry = MetricsRegistry()
+
+REQUESTS = registry.counter("llm_requests_total", "Liczba zapytań do modelu", ["kind"])
+REQUEST_ERRORS = registry.counter("llm_request_errors_total", "Liczba zapytań zakończonych błędem", ["kind"])
+PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "Liczba tokenów wejściowych")
+CACHED_TOKENS = registry.counter("llm_cached_tokens_total", "Liczba tokenów prompta odczytanych z KV cache")
+COMPLETION_TOKENS = registry.counter("llm_completion_tokens_total", "Liczba wygenerowanych tokenów")
+CACHE_HIT_RATIO = registry.gauge("llm_cache_hit_ratio", "Udział tokenów prompta odczytanych z KV cache")
+TIME_TO_FIRST_TOKEN = registry.histogram("llm_time_to_first_token_seconds", "Czas do pierwszego tokenu")
+PREFILL_TIME = registry.histogram("llm_prefill_seconds", "Czas przetwarzania prompta")
+DECODE_TOKEN_TIME = registry.histogram("llm_decode_seconds_per_token", "Czas generowania jednego tokenu",
+                                       buckets=TOKEN_TIME_BUCKETS)
+REQUEST_LATENCY = registry.histogram("llm_request_seconds", "Całkowity czas zapytania", ["kind"])
+QUEUE_WAIT = registry.histogram("llm_queue_wait_seconds", "Czas oczekiwania w kolejce inferencji", ["priority"])
+PARKED_TIME = registry.histogram("llm_parked_seconds", "Czas odłożenia wywłaszczonego strumienia", ["priority"])
+PREEMPTIONS = registry.counter("llm_preemptions_total", "Liczba wywłaszczeń strumieni na granicy tokenu", ["priority"])
+SCHEDULER_LATENCY = registry.histogram("llm_scheduler_latency_seconds",
+                                       "Opóźnienie do pierwszego fragmentu (strumień) lub wyniku (zadanie)",
+                                       ["priority"])
+LATENCY_TARGET_MISSES = registry.counter("llm_latency_target_misses_total",
+                                         "Liczba zadań, których opóźnienie przekroczyło cel klasy", ["priority"])
+DEADLINE_REJECTIONS = registry.counter("llm_deadline_rejections_total",
+                                       "Liczba zapytań odrzuconych, bo nie zdążyłyby przed terminem", ["priority"])
+DEADLINE_TRUNCATIONS = registry.counter("llm_deadline_truncations_total",
+                                        "Liczba odpowiedzi zakończonych przed terminem", ["kind"])
+MODEL_LOAD_TIME = registry.histogram("llm_model_load_seconds", "Czas ładowania modelu")
+MODEL_LOADED = registry.gauge("llm_model_loaded", "Czy model jest załadowany")
+RESIDENT_MEMORY = registry.gauge("llm_process_resident_memory_bytes", "Pamięć RSS procesu")
+RESIDENT_MEMORY.set_function(_resident_memory_bytes)
+
+
+def record_generation(kind: str, metrics) -> None:
+    """
+    Dodaje pomiary pojedynczego generowania (GenerationMetrics) do rejestru.
+
+    Args:
+        kind: rodzaj zapytania ("chat" lub "complete")
+        metrics: pomiary zwrócone przez model
+    """
+    if metrics is None:
+        return
+    PROMPT_TOKENS.inc(metrics.prompt_tokens)
+    CACHED_TOKENS.inc(metrics.cached_tokens)
+    COMPLETION_TOKENS.inc(metrics.completion_tokens)
+    if PROMPT_TOKENS.value:
+        CACHE_HIT_RATIO.set(CACHED_TOKENS.value / PROMPT_TOKENS.value)
+    TIME_TO_FIRST_TOKEN.observe(metrics.time_to_first_token_ms / 1000)
+    PREFILL_TIME.observe(metrics.prefill_ms / 1000)
+    if metrics.completion_tokens:
+        per_token = (metrics.decode_ms + metrics.sampling_ms) / 1000 / metrics.completion_tokens
+        DECODE_TOKEN_TIME.observe(per_token, count=metrics.completion_tokens)
+    REQUEST_LATENCY.labels(kind=kind).observe(metrics.total_ms / 1000)
+    if metrics.finish_reason == "deadline":
+        DEADLINE_TRUNCATIONS.labels(kind=kind).inc()
+
+
+def start_http_server(port: int, host: str = "127.0.0.1"):
+    """
+    Uruchamia w tle lokalny serwer HTTP udostępniający metryki pod /metrics.
+
+    Returns:
+        Obiekt serwera (zatrzymanie: server.shutdown())
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return server
+
+
+def write_metrics_file(path: str) -> None:
+    """Zapisuje bieżące metryki do pliku (atomowo, przez plik tymczasowy)."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(temp_path, path)
+
+
+def start_file_dump(path: str, interval: float = 15.0) -> threading.Event:
+    """
+    Okresowo zapisuje metryki do pliku (np. dla node_exportera textfile collector).
+
+    Returns:
+        Zdarzenie, którego ustawienie zatrzymuje zapis
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                write_metrics_file(path)
+            except Exception as e:
+                print(f"Błąd podczas zapisu metryk: {e}")
+        write_metrics_file(path)
+
+    threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
+    return stop
+
+
+def start_exporters(settings: Dict) -> None:
+    """
+    Uruchamia eksport metryk zgodnie z sekcją "metrics" konfiguracji.
+
+    Args:
+        settings: słownik z kluczami "port", "host", "file" i "interval"
+    """
+    if not settings:
+        return
+    if settings.get("port"):
+        try:
+            start_http_server(int(settings["port"]), settings.get("host") or "127.0.0.1")
+            print(f"Metryki dostępne pod http://{settings.get('host') or '127.0.0.1'}:{settings['port']}/metrics")
+        except OSError as e:
+            print(f"Nie udało się uruchomić serwera metryk: {e}")
+    if settings.get("file"):
+        start_file_dump(settings["file"], float(settings.get("interval") or 15.0))
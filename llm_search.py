@@ -0,0 +1,438 @@
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from llm_session_store import DEFAULT_SESSIONS_DIR, ChatLog, SessionStore, import_history
+
+# Nazwa pliku indeksu w katalogu rozmów
+INDEX_FILENAME = "index.sqlite"
+
+# Maksymalna długość tekstu wiadomości przekazywanego do modelu embeddingów (znaki)
+EMBEDDING_MAX_CHARS = 2000
+
+# Stała fuzji rankingów (reciprocal rank fusion) wyników pełnotekstowych i semantycznych
+_RRF_K = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    title TEXT,
+    indexed_bytes INTEGER NOT NULL DEFAULT 0,
+    messages INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT,
+    content TEXT,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, position);
+CREATE TABLE IF NOT EXISTS embeddings (
+    message_id INTEGER PRIMARY KEY,
+    vector BLOB NOT NULL
+);
+"""
+
+# Indeks pełnotekstowy FTS5 synchronizowany z tabelą messages wyzwalaczami
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+
+class SearchHit:
+    """Wiadomość z zapisanej rozmowy pasująca do zapytania."""
+
+    def __init__(self, message_id: int, session_id: str, title: str, path: str, position: int,
+                 role: str, content: str, snippet: str, time: Optional[float], score: float = 0.0):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.title = title
+        self.path = path
+        self.position = position
+        self.role = role
+        self.content = content
+        self.snippet = snippet
+        self.time = time
+        self.score = score
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "title": self.title,
+            "path": self.path,
+            "position": self.position,
+            "role": self.role,
+            "content": self.content,
+            "snippet": self.snippet,
+            "time": self.time,
+            "score": self.score,
+        }
+
+
+class SearchIndex:
+    """
+    Indeks wyszukiwania wiadomości ze wszystkich zapisanych rozmów (SQLite).
+
+    Wyszukiwanie słów korzysta z FTS5 (ranking bm25, bez rozróżniania polskich
+    znaków diakrytycznych), a jeśli SQLite nie ma FTS5 - z LIKE. Indeks jest
+    przyrostowy: dla każdej rozmowy zapamiętywana jest pozycja w pliku JSONL,
+    do której została zaindeksowana, więc dopisanie tury indeksuje tylko nowe
+    linie. Opcjonalnie wiadomości dostają wektory embeddingów z załadowanego
+    modelu, co pozwala szukać po znaczeniu (search(..., query_vector=...)).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: plik bazy indeksu (None - index.sqlite w domyślnym katalogu rozmów)
+        """
+        self.path = path or os.path.join(DEFAULT_SESSIONS_DIR, INDEX_FILENAME)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Indeks jest używany z wątku GUI i z wątku inferencji (embeddingi)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self.fts = _fts5_available(self._connection)
+        if self.fts:
+            self._connection.executescript(_FTS_SCHEMA)
+        self._connection.commit()
+        # Macierz wektorów do wyszukiwania semantycznego, odtwarzana po dodaniu embeddingów
+        self._vectors = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    # --- Indeksowanie ---
+
+    def index_log(self, log: ChatLog) -> int:
+        """
+        Indeksuje wiadomości dopisane do rozmowy od poprzedniego wywołania.
+
+        Returns:
+            Liczba nowych wiadomości w indeksie
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT indexed_bytes, messages FROM sessions WHERE session_id = ?", (log.session_id,)
+            ).fetchone()
+            indexed_bytes, count = row if row is not None else (0, 0)
+            if indexed_bytes > log.size():
+                # Plik został zastąpiony krótszym - indeksujemy go od nowa
+                self._remove_session(log.session_id)
+                indexed_bytes, count = 0, 0
+                row = None
+
+            messages, end = log.read_since(indexed_bytes)
+            if row is not None and end == indexed_bytes:
+                return 0
+            title = log.read_header().get("title", log.session_id)
+            self._connection.executemany(
+                "INSERT INTO messages(session_id, position, role, content, time) VALUES (?, ?, ?, ?, ?)",
+                [(log.session_id, count + i, message.get("role"), message.get("content", ""), message.get("time"))
+                 for i, message in enumerate(messages)]
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions(session_id, path, title, indexed_bytes, messages) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (log.session_id, log.path, title, end, count + len(messages))
+            )
+            self._connection.commit()
+            return len(messages)
+
+    def sync(self, store: SessionStore) -> int:
+        """
+        Dopasowuje indeks do katalogu rozmów: indeksuje nowe i dopisane rozmowy,
+        usuwa rozmowy, których pliki zniknęły. Niezmienione pliki są pomijane
+        na podstawie rozmiaru, bez ich czytania.
+
+        Returns:
+            Liczba nowych wiadomości w indeksie
+        """
+        with self._lock:
+            indexed = dict(self._connection.execute("SELECT session_id, indexed_bytes FROM sessions"))
+
+        added = 0
+        present = set()
+        for session in store.list_sessions():
+            present.add(session["session_id"])
+            if indexed.get(session["session_id"]) != session["size"]:
+                added += self.index_log(ChatLog(session["path"]))
+
+        removed = set(indexed) - present
+        if removed:
+            with self._lock:
+                for session_id in removed:
+                    self._remove_session(session_id)
+                self._connection.commit()
+        return added
+
+    def _remove_session(self, session_id: str) -> None:
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE message_id IN (SELECT id FROM messages WHERE session_id = ?)",
+            (session_id,)
+        )
+        self._connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._vectors = None
+
+    # --- Embeddingi ---
+
+    def update_embeddings(self, embed: Callable[[str], Sequence[float]], limit: int = 16) -> int:
+        """
+        Wyznacza embeddingi wiadomości, które jeszcze ich nie mają.
+
+        Args:
+            embed: funkcja zwracająca wektor tekstu (np. SimpleLLM.embed)
+            limit: maksymalna liczba wiadomości w jednym wywołaniu
+
+        Returns:
+            Liczba wiadomości, które dostały embedding
+        """
+        with self._lock:
+            pending = self._connection.execute(
+                "SELECT m.id, m.content FROM messages m LEFT JOIN embeddings e ON e.message_id = m.id "
+                "WHERE e.message_id IS NULL LIMIT ?", (limit,)
+            ).fetchall()
+        if not pending:
+            return 0
+
+        rows = [(message_id, _pack_vector(embed((content or "")[:EMBEDDING_MAX_CHARS])))
+                for message_id, content in pending]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings(message_id, vector) VALUES (?, ?)", rows)
+            self._connection.commit()
+            self._vectors = None
+        return len(rows)
+
+    def _load_vectors(self):
+        """Zwraca (identyfikatory, wektory) wszystkich embeddingów (z pamięci podręcznej)."""
+        if self._vectors is None:
+            with self._lock:
+                rows = self._connection.execute("SELECT message_id, vector FROM embeddings").fetchall()
+            ids = [message_id for message_id, _ in rows]
+            try:
+                import numpy
+            except ImportError:
+                vectors = [array('f', vector) for _, vector in rows]
+            else:
+                if rows:
+                    vectors = numpy.vstack([numpy.frombuffer(vector, dtype=numpy.float32) for _, vector in rows])
+                else:
+                    vectors = numpy.zeros((0, 0), dtype=numpy.float32)
+            self._vectors = (ids, vectors)
+        return self._vectors
+
+    def _semantic_ranking(self, query_vector: Sequence[float], limit: int) -> List[int]:
+        """Identyfikatory wiadomości najbliższych wektorowi zapytania (podobieństwo kosinusowe)."""
+        ids, vectors = self._load_vectors()
+        if not ids:
+            return []
+        query = array('f', _pack_vector(query_vector))
+        if hasattr(vectors, "dtype"):
+            import numpy
+            if vectors.shape[1] != len(query):
+                return []
+            scores = vectors @ numpy.frombuffer(query, dtype=numpy.float32)
+            order = numpy.argsort(-scores)[:limit]
+            return [ids[i] for i in order]
+        scored = [(sum(a * b for a, b in zip(vector, query)), message_id)
+                  for message_id, vector in zip(ids, vectors) if len(vector) == len(query)]
+        scored.sort(reverse=True)
+        return [message_id for _, message_id in scored[:limit]]
+
+    # --- Wyszukiwanie ---
+
+    def search(self, query: str, limit: int = 20, query_vector: Optional[Sequence[float]] = None,
+               session_id: Optional[str] = None) -> List[SearchHit]:
+        """
+        Wyszukuje wiadomości pasujące do zapytania.
+
+        Args:
+            query: słowa do wyszukania (wszystkie muszą wystąpić, ostatnie może być początkiem słowa)
+            limit: maksymalna liczba wyników
+            query_vector: embedding zapytania - wyniki pełnotekstowe są łączone z semantycznymi
+            session_id: ograniczenie do jednej rozmowy
+
+        Returns:
+            Lista wyników od najlepiej pasującego
+        """
+        terms = query.split()
+        ranked = self._keyword_ranking(terms, limit, session_id) if terms else []
+        if query_vector is not None:
+            # Łączenie rankingów: wynik to suma 1 / (k + pozycja) z obu list
+            semantic = self._semantic_ranking(query_vector, limit)
+            scores: Dict[int, float] = {}
+            for ranking in (ranked, semantic):
+                for rank, message_id in enumerate(ranking):
+                    scores[message_id] = scores.get(message_id, 0.0) + 1.0 / (_RRF_K + rank + 1)
+            ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        else:
+            scores = {message_id: 1.0 / (_RRF_K + rank + 1) for rank, message_id in enumerate(ranked)}
+        return self._hits(ranked, scores, terms, session_id)
+
+    def _keyword_ranking(self, terms: List[str], limit: int, session_id: Optional[str]) -> List[int]:
+        params: List[Any] = []
+        if self.fts:
+            sql = "SELECT m.id FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?"
+            params.append(_fts_query(terms))
+        else:
+            sql = "SELECT m.id FROM messages m WHERE " + " AND ".join("m.content LIKE ?" for _ in terms)
+            params.extend(f"%{term}%" for term in terms)
+        if session_id is not None:
+            sql += " AND m.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY bm25(messages_fts), m.time DESC" if self.fts else " ORDER BY m.time DESC"
+        sql += " LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [message_id for (message_id,) in self._connection.execute(sql, params)]
+
+    def _hits(self, ranked: List[int], scores: Dict[int, float], terms: List[str],
+              session_id: Optional[str]) -> List[SearchHit]:
+        if not ranked:
+            return []
+        placeholders = ",".join("?" * len(ranked))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT m.id, m.session_id, s.title, s.path, m.position, m.role, m.content, m.time "
+                f"FROM messages m JOIN sessions s ON s.session_id = m.session_id WHERE m.id IN ({placeholders})",
+                ranked
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        hits = []
+        for message_id in ranked:
+            row = by_id.get(message_id)
+            if row is None or (session_id is not None and row[1] != session_id):
+                continue
+            content = row[6] or ""
+            hits.append(SearchHit(row[0], row[1], row[2], row[3], row[4], row[5], content,
+                                  _snippet(content, terms), row[7], scores.get(message_id, 0.0)))
+        return hits
+
+    def context(self, hit: SearchHit, before: int = 2, after: int = 1) -> List[Dict[str, Any]]:
+        """Wiadomości wokół wyniku (do wstawienia jako kontekst bieżącej rozmowy)."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? AND position BETWEEN ? AND ? "
+                "ORDER BY position",
+                (hit.session_id, hit.position - before, hit.position + after)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages = self._connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            embeddings = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"sessions": sessions, "messages": messages, "embeddings": embeddings, "fts5": self.fts}
+
+
+def _fts5_available(connection: sqlite3.Connection) -> bool:
+    try:
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)")
+        connection.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        print("SQLite nie obsługuje FTS5 - wyszukiwanie rozmów będzie wolniejsze (LIKE).")
+        return False
+
+
+def _fts_query(terms: List[str]) -> str:
+    """Zapytanie FTS5: wszystkie słowa jako frazy w cudzysłowach, ostatnie także jako początek słowa."""
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _snippet(content: str, terms: List[str], width: int = 160) -> str:
+    """Fragment wiadomości wokół pierwszego wystąpienia szukanego słowa."""
+    text = " ".join(content.split())
+    lowered = text.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - width // 3) if positions else 0
+    snippet = text[start:start + width]
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(text):
+        snippet += "…"
+    return snippet
+
+
+def _pack_vector(vector: Sequence[float]) -> bytes:
+    """Zapisuje wektor znormalizowany do długości 1 jako float32 (iloczyn skalarny = podobieństwo kosinusowe)."""
+    values = array('f', vector)
+    norm = math.sqrt(sum(value * value for value in values)) or 1.0
+    return array('f', (value / norm for value in values)).tobytes()
+
+
+def import_histories(directory: str, store: SessionStore, index: Optional[SearchIndex] = None) -> int:
+    """
+    Przepisuje wszystkie historie JSON z katalogu do magazynu rozmów (i indeksu).
+
+    Returns:
+        Liczba przepisanych rozmów
+    """
+    imported = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        log = store.create(os.path.splitext(name)[0])
+        try:
+            import_history(path, log)
+        except (OSError, ValueError) as e:
+            print(f"Pominięto {name}: {e}")
+            continue
+        finally:
+            log.close()
+        if index is not None:
+            index.index_log(log)
+        imported += 1
+    return imported
+
+
+def run_search(query: str, limit: int = 20, sessions_dir: Optional[str] = None,
+               index_path: Optional[str] = None) -> int:
+    """
+    Wyszukuje w zapisanych rozmowach i wypisuje wyniki (bez ładowania modelu).
+
+    Returns:
+        Kod wyjścia (0 - znaleziono wyniki, 1 - brak wyników)
+    """
+    sessions_dir = sessions_dir or DEFAULT_SESSIONS_DIR
+    index = SearchIndex(index_path or os.path.join(sessions_dir, INDEX_FILENAME))
+    try:
+        index.sync(SessionStore(sessions_dir))
+        start = time.perf_counter()
+        hits = index.search(query, limit=limit)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        index.close()
+
+    for number, hit in enumerate(hits, 1):
+        print(f"{number}. [{hit.title}] {hit.role}: {hit.snippet}")
+        print(f"   {hit.path} (wiadomość {hit.position + 1})")
+    print(f"Znaleziono {len(hits)} wyników w {elapsed_ms:.1f} ms", file=sys.stderr)
+    return 0 if hits else 1
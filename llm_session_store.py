@@ -0,0 +1,227 @@
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+# Domyślny katalog zapisanych rozmów
+DEFAULT_SESSIONS_DIR = os.path.join(os.path.expanduser("~"), ".simplellm_sessions")
+
+# Rozszerzenie plików rozmów
+SESSION_SUFFIX = ".jsonl"
+
+# Rozmiar bloku czytanego od końca pliku przy stronicowaniu
+_READ_BLOCK = 64 * 1024
+
+Message = Dict[str, Any]
+
+
+class ChatLog:
+    """
+    Rozmowa zapisywana przyrostowo w pliku JSONL (jedna wiadomość na linię).
+
+    Plik jest tylko dopisywany - po każdej wiadomości zapisywana jest jedna
+    linia, więc zapis nie zależy od długości rozmowy, a przerwanie programu
+    traci co najwyżej ostatnią linię. Pierwsza linia zawiera nagłówek
+    rozmowy ({"type": "session", ...}), zapisywany razem z pierwszą
+    wiadomością. Wiadomości można czytać stronami od końca pliku bez
+    wczytywania całości.
+    """
+
+    def __init__(self, path: str, title: Optional[str] = None):
+        """
+        Args:
+            path: ścieżka pliku JSONL
+            title: tytuł zapisywany w nagłówku nowej rozmowy
+        """
+        self.path = path
+        self.title = title
+        self._file = None
+
+    @property
+    def session_id(self) -> str:
+        return os.path.basename(self.path)[:-len(SESSION_SUFFIX)]
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if self._file.tell() == 0:
+                header = {"type": "session", "title": self.title or self.session_id, "created": time.time()}
+                self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        return self._file
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        f = self._open()
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+
+    def append(self, role: str, content: str) -> None:
+        """Dopisuje wiadomość na końcu pliku."""
+        self._write({"role": role, "content": content, "time": time.time()})
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def size(self) -> int:
+        """Rozmiar pliku w bajtach (pozycja końca do read_page())."""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def read_page(self, end: Optional[int] = None, count: int = 100) -> Tuple[List[Message], int]:
+        """
+        Czyta do `count` ostatnich wiadomości zapisanych przed pozycją `end`.
+
+        Args:
+            end: pozycja w pliku (bajty), przed którą kończy się strona (None - koniec pliku)
+            count: maksymalna liczba wiadomości
+
+        Returns:
+            Krotka (wiadomości od najstarszej, pozycja początku strony);
+            pozycja 0 oznacza, że wcześniejszych wiadomości nie ma
+        """
+        if end is None:
+            end = self.size()
+        messages: List[Message] = []
+        if end <= 0:
+            return messages, 0
+
+        with open(self.path, 'rb') as f:
+            position = end
+            # Nieprzetworzone bajty to buffer[:limit]; zaczynają się w pliku na pozycji `position`
+            buffer = b""
+            limit = 0
+            while len(messages) < count:
+                # Znak nowej linii kończący linię poprzedzającą ostatnią nieprzetworzoną linię
+                newline = buffer.rfind(b"\n", 0, limit - 1) if limit > 1 else -1
+                if newline == -1 and position > 0:
+                    # Początek linii jest wcześniej w pliku - doczytaj poprzedni blok
+                    start = max(0, position - _READ_BLOCK)
+                    f.seek(start)
+                    buffer = f.read(position - start) + buffer[:limit]
+                    limit = len(buffer)
+                    position = start
+                    continue
+                message = _parse_message(buffer[newline + 1:limit])
+                limit = newline + 1
+                if message is not None:
+                    messages.append(message)
+                if limit == 0:
+                    break
+
+        messages.reverse()
+        return messages, position + limit
+
+    def read_since(self, start: int = 0) -> Tuple[List[Message], int]:
+        """
+        Czyta wiadomości dopisane od pozycji `start` (np. do przyrostowego indeksowania).
+
+        Returns:
+            Krotka (wiadomości, pozycja za ostatnią pełną linią); niedokończona
+            ostatnia linia zostanie odczytana przy kolejnym wywołaniu
+        """
+        messages: List[Message] = []
+        if not os.path.exists(self.path):
+            return messages, start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].split(b"\n"):
+            message = _parse_message(line)
+            if message is not None:
+                messages.append(message)
+        return messages, start + complete
+
+    def read_all(self) -> List[Message]:
+        """Czyta wszystkie wiadomości (np. do eksportu lub indeksowania)."""
+        if not os.path.exists(self.path):
+            return []
+        messages = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                message = _parse_message(line)
+                if message is not None:
+                    messages.append(message)
+        return messages
+
+    def read_header(self) -> Dict[str, Any]:
+        """Nagłówek rozmowy (pusty słownik, jeśli go nie ma)."""
+        try:
+            with open(self.path, 'rb') as f:
+                record = json.loads(f.readline())
+        except (OSError, ValueError):
+            return {}
+        return record if isinstance(record, dict) and record.get("type") == "session" else {}
+
+
+def _parse_message(line: bytes) -> Optional[Message]:
+    """Dekoduje linię z wiadomością (nagłówek i uszkodzone linie są pomijane)."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or "role" not in record:
+        return None
+    return record
+
+
+class SessionStore:
+    """Katalog z rozmowami zapisanymi jako pliki JSONL."""
+
+    def __init__(self, directory: str = DEFAULT_SESSIONS_DIR):
+        self.directory = directory
+
+    def create(self, title: str) -> ChatLog:
+        """Tworzy nową rozmowę (plik powstaje przy pierwszym zapisie)."""
+        session_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        return ChatLog(os.path.join(self.directory, session_id + SESSION_SUFFIX), title)
+
+    def open(self, session_id: str) -> ChatLog:
+        return ChatLog(os.path.join(self.directory, session_id + SESSION_SUFFIX))
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        """Lista zapisanych rozmów (od ostatnio zmienionej) z identyfikatorem, tytułem i rozmiarem."""
+        if not os.path.isdir(self.directory):
+            return []
+        sessions = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SESSION_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            log = ChatLog(path)
+            stat = os.stat(path)
+            sessions.append({
+                "session_id": log.session_id,
+                "title": log.read_header().get("title", log.session_id),
+                "path": path,
+                "modified": stat.st_mtime,
+                "size": stat.st_size,
+            })
+        sessions.sort(key=lambda session: session["modified"], reverse=True)
+        return sessions
+
+
+def import_history(path: str, log: ChatLog) -> int:
+    """
+    Przepisuje historię z pliku JSON (dawny format "Zapisz historię") do rozmowy JSONL.
+
+    Returns:
+        Liczba przepisanych wiadomości
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    if not isinstance(history, list):
+        raise ValueError("Nieprawidłowy format historii.")
+    count = 0
+    for entry in history:
+        if isinstance(entry, dict) and entry.get("role"):
+            log.append(entry["role"], entry.get("content", ""))
+            count += 1
+    return count
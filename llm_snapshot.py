@@ -0,0 +1,129 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Mapping, Optional, Union
+
+# Nagłówek pliku migawki: znacznik, wersja formatu, długość nagłówka JSON
+SNAPSHOT_MAGIC = b"SLLMSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".llmsnap"
+_PREAMBLE = struct.Struct("<8sIQ")
+
+# Dane binarne zaczynają się od granicy strony, aby mapowanie pliku było wyrównane
+_ALIGN = 4096
+
+Blob = Union[bytes, bytearray, memoryview]
+
+
+def content_hash(data: Union[str, bytes]) -> str:
+    """Skrót SHA-256 treści (identyfikator załącznika w migawce)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_signature(path: str) -> Optional[Dict[str, Any]]:
+    """Rozmiar i czas modyfikacji pliku (None, jeśli plik nie istnieje) - do sprawdzenia, czy model się nie zmienił."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def _aligned(position: int) -> int:
+    return (position + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def save_snapshot(path: str, header: Dict[str, Any], blobs: Mapping[str, Blob]) -> int:
+    """
+    Zapisuje migawkę: nagłówek JSON i nazwane dane binarne (stany KV, załączniki).
+
+    Plik jest zapisywany obok docelowego i podmieniany dopiero po zapisaniu
+    całości, więc przerwany zapis nie niszczy poprzedniej migawki.
+
+    Args:
+        path: ścieżka pliku migawki
+        header: dane opisowe (muszą dać się zapisać jako JSON)
+        blobs: dane binarne według nazw
+
+    Returns:
+        Rozmiar zapisanego pliku w bajtach
+    """
+    # Położenie danych względem początku części binarnej (nie zależy od długości nagłówka)
+    table = {}
+    offset = 0
+    for name, blob in blobs.items():
+        table[name] = [offset, len(blob)]
+        offset = _aligned(offset + len(blob))
+    header_bytes = json.dumps(dict(header, blobs=table), ensure_ascii=False).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, blob in blobs.items():
+            f.seek(data_start + table[name][0])
+            f.write(blob)
+        size = f.tell()
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    return size
+
+
+class Snapshot:
+    """
+    Migawka otwarta do odczytu.
+
+    Plik jest mapowany do pamięci (mmap), a blob() zwraca widok jego
+    fragmentu bez kopiowania - stan KV jest czytany prosto ze strony
+    pamięci podręcznej systemu przy przywracaniu.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} nie jest plikiem migawki sesji")
+            if version > SNAPSHOT_VERSION:
+                raise ValueError(f"Nieobsługiwana wersja migawki: {version}")
+            self.header: Dict[str, Any] = json.loads(
+                self._map[_PREAMBLE.size:_PREAMBLE.size + header_length].decode("utf-8"))
+        except Exception:
+            self._file.close()
+            raise
+        self._data_start = _aligned(_PREAMBLE.size + header_length)
+        self._view = memoryview(self._map)
+        self._views = []
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.header.get("blobs", {})
+
+    def blob(self, name: str) -> memoryview:
+        """Widok danych binarnych o podanej nazwie (ważny do close())."""
+        offset, length = self.header["blobs"][name]
+        start = self._data_start + offset
+        view = self._view[start:start + length]
+        self._views.append(view)
+        return view
+
+    def close(self) -> None:
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
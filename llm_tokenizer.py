@@ -0,0 +1,200 @@
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Łączna liczba tokenów przechowywanych w pamięci podręcznej (ok. 4 bajty na token)
+DEFAULT_CACHE_TOKENS = 4_000_000
+
+# Co który token słownika trafia do odcisku słownika
+_FINGERPRINT_STRIDE = 97
+
+
+def vocab_fingerprint(backend) -> str:
+    """
+    Wyznacza odcisk słownika modelu.
+
+    Pełny słownik nie jest dostępny w metadanych, więc odcisk obejmuje
+    metadane tokenizera, rozmiar słownika i tekst co 97. tokenu. Modele
+    z tym samym tokenizerem (np. różne kwantyzacje) współdzielą wpisy cache.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    metadata = backend.metadata()
+    for key in sorted(metadata):
+        if key.startswith("tokenizer.") and key != "tokenizer.chat_template":
+            digest.update(f"{key}={metadata[key]}\n".encode("utf-8", errors="replace"))
+    n_vocab = backend.n_vocab()
+    digest.update(str(n_vocab).encode())
+    for token in range(0, n_vocab, _FINGERPRINT_STRIDE):
+        digest.update(backend.detokenize([token]))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TokenizerCache:
+    """
+    Pamięć podręczna LRU wyników tokenizacji, wspólna dla wszystkich modeli.
+
+    Kluczem jest (odcisk słownika, skrót tekstu, add_bos, special), więc ten
+    sam długi dokument lub historia rozmowy jest tokenizowany tylko raz.
+    Tokeny przechowywane są w zwartych tablicach array('i') (4 bajty na token),
+    które obsługują protokół bufora - np. numpy.frombuffer(tokens, dtype=numpy.int32).
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_CACHE_TOKENS):
+        self.max_tokens = max_tokens
+        self._entries: "OrderedDict[Tuple, array]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def tokenize(self, backend, vocab_hash: str, text: str, add_bos: bool = True, special: bool = False) -> array:
+        """
+        Zwraca tokeny tekstu z cache lub tokenizuje go backendem.
+
+        Returns:
+            Kopia tablicy tokenów (można ją modyfikować)
+        """
+        data = text.encode("utf-8")
+        key = (vocab_hash, hashlib.blake2b(data, digest_size=16).digest(), add_bos, special)
+        with self._lock:
+            tokens = self._entries.get(key)
+            if tokens is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tokens[:]
+            self.misses += 1
+
+        tokens = array('i', backend.tokenize(data, add_bos=add_bos, special=special))
+        self._store(key, tokens)
+        return tokens[:]
+
+    def _store(self, key: Tuple, tokens: array) -> None:
+        if len(tokens) > self.max_tokens:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = tokens
+            self._size += len(tokens)
+            while self._size > self.max_tokens:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+# Globalna pamięć podręczna tokenizacji
+cache = TokenizerCache()
+
+
+
+class IncrementalTokenizer:
+    """
+    Tokenizuje tekst dopisywany kawałkami (np. rosnącą historię rozmowy),
+    przetwarzając tylko nową część.
+
+    Zatwierdzane są tokeny tekstu do ostatniej bezpiecznej granicy - końca
+    linii, po którym zaczyna się nowe słowo. Tekst za granicą jest przy
+    kolejnym dopisaniu tokenizowany ponownie razem z nowym fragmentem.
+    Kontynuacja jest tokenizowana z poprzedzającym ją końcem linii, którego
+    tokeny są następnie odrzucane - tokenizery SentencePiece nie dodają wtedy
+    spacji na początku fragmentu. Jeśli mimo to podział daje inne tokeny niż
+    całość, tokenizowany jest cały tekst (incremental == False).
+    """
+
+    # Tekst poprzedzający każdą kontynuację (granica zawsze leży za końcem linii)
+    ANCHOR = "\n"
+
+    def __init__(self, backend, add_bos: bool = True, special: bool = False):
+        self.backend = backend
+        self.add_bos = add_bos
+        self.special = special
+        self._anchor_tokens = self._tokenize(self.ANCHOR, False)
+        self.incremental = self._supports_split()
+        if not self.incremental:
+            print("Tokenizer modelu nie pozwala dzielić tekstu na granicach linii - "
+                  "tekst dopisywany będzie tokenizowany w całości")
+        self._committed_tokens = array('i')
+        self._committed_text = ""
+        self._tail = ""
+        self._tail_tokens: Optional[array] = None
+
+    def _tokenize(self, text: str, add_bos: bool) -> array:
+        return array('i', self.backend.tokenize(text.encode("utf-8"), add_bos=add_bos, special=self.special))
+
+    def _tokenize_part(self, text: str, first: bool) -> array:
+        """Tokeny fragmentu tekstu - pierwszego albo kontynuacji za granicą linii."""
+        if first:
+            return self._tokenize(text, self.add_bos)
+        tokens = self._tokenize(self.ANCHOR + text, False)
+        if tokens[:len(self._anchor_tokens)] != self._anchor_tokens:
+            raise ValueError("Tokeny kontynuacji nie zaczynają się od tokenów końca linii")
+        return tokens[len(self._anchor_tokens):]
+
+    def _supports_split(self) -> bool:
+        """Sprawdza, czy tokenizacja tekstu podzielonego na granicy linii jest zgodna z całością."""
+        samples = (("Ala ma kota.\n", "Kot ma Alę.\n"), ("Zażółć gęślą jaźń\n", "Żółw: 42 zł\n"))
+        try:
+            for head, tail in samples:
+                whole = self._tokenize(head + tail, self.add_bos)
+                if whole != self._tokenize_part(head, True) + self._tokenize_part(tail, False):
+                    return False
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def _safe_boundary(text: str) -> int:
+        """Pozycja za ostatnim końcem linii, po którym zaczyna się nowe słowo (0 - brak)."""
+        position = len(text) - 1
+        while True:
+            position = text.rfind("\n", 0, position)
+            if position == -1:
+                return 0
+            if not text[position + 1].isspace():
+                return position + 1
+
+    def append(self, text: str) -> None:
+        """Dopisuje fragment tekstu."""
+        if not text:
+            return
+        self._tail += text
+        self._tail_tokens = None
+        if not self.incremental:
+            return
+
+        boundary = self._safe_boundary(self._tail)
+        if boundary:
+            head = self._tail[:boundary]
+            self._committed_tokens.extend(self._tokenize_part(head, not self._committed_text))
+            self._committed_text += head
+            self._tail = self._tail[boundary:]
+
+    @property
+    def text(self) -> str:
+        """Cały dotychczas dopisany tekst."""
+        return self._committed_text + self._tail
+
+    def _current_tail_tokens(self) -> array:
+        if self._tail_tokens is None:
+            if not self.incremental:
+                self._tail_tokens = self._tokenize(self._tail, self.add_bos)
+            elif self._tail:
+                self._tail_tokens = self._tokenize_part(self._tail, not self._committed_text)
+            else:
+                self._tail_tokens = array('i')
+        return self._tail_tokens
+
+    def tokens(self) -> array:
+        """Zwraca tokeny całego tekstu (tokenizując tylko część za ostatnią granicą)."""
+        return self._committed_tokens + self._current_tail_tokens()
+
+    def __len__(self) -> int:
+        return len(self._committed_tokens) + len(self._current_tail_tokens())
@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, Counter
+from typing import Any, Dict, Optional
+
+# Maksymalna liczba zdarzeń przechowywanych w pamięci (najstarsze są usuwane)
+DEFAULT_MAX_EVENTS = 200000
+
+
+class _NoopSpan:
+    """Pusty span używany, gdy śledzenie jest wyłączone."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Odcinek czasu zapisywany jako zdarzenie typu "X" (complete event)."""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.add_complete(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class Tracer:
+    """
+    Zbiera spany z kolejnych faz przetwarzania i eksportuje je
+    w formacie Chrome trace-event JSON (chrome://tracing, Perfetto).
+
+    Domyślnie wyłączony - wtedy span() zwraca pusty obiekt i koszt
+    instrumentacji sprowadza się do jednego sprawdzenia flagi.
+    """
+
+    def __init__(self, max_events: int = DEFAULT_MAX_EVENTS):
+        self.enabled = False
+        self._events = deque(maxlen=max_events)
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        self._events.clear()
+
+    def span(self, name: str, **args):
+        """Zwraca kontekst mierzący czas bloku kodu: ``with tracer.span("prefill"): ...``"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, args)
+
+    def add_complete(self, name: str, start_ns: int, end_ns: int, args: Optional[Dict[str, Any]] = None) -> None:
+        """Dodaje zakończony odcinek czasu (znaczniki z time.perf_counter_ns())."""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start_ns - self._origin) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def instant(self, name: str, **args) -> None:
+        """Dodaje zdarzenie chwilowe (np. pierwszy token)."""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "ph": "i",
+            "s": "t",
+            "ts": (time.perf_counter_ns() - self._origin) / 1000,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def export_chrome_trace(self, path: str) -> int:
+        """
+        Zapisuje zebrane zdarzenia do pliku JSON w formacie Chrome trace-event.
+
+        Returns:
+            Liczba zapisanych zdarzeń
+        """
+        events = list(self._events)
+        # Nazwy wątków ułatwiają czytanie śladu
+        for thread in threading.enumerate():
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": thread.ident,
+                "args": {"name": thread.name},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+
+# Globalny tracer aplikacji
+tracer = Tracer()
+
+
+def span(name: str, **args):
+    """Skrót do tracer.span()."""
+    if not tracer.enabled:
+        return _NOOP_SPAN
+    return _Span(tracer, name, args)
+
+
+class StackSampler:
+    """
+    Próbkujący profiler: co `interval` sekund zapisuje stosy wszystkich wątków.
+
+    Wynik w formacie "collapsed stacks" (jedna linia na stos z liczbą próbek)
+    można zwizualizować np. w speedscope lub flamegraph.pl.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str) -> None:
+        """Zapisuje próbki w formacie collapsed stacks."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def run_profiled(function, mode: str = "cprofile", output_prefix: Optional[str] = None):
+    """
+    Uruchamia funkcję pod profilerem i zapisuje raport po jej zakończeniu.
+
+    Args:
+        function: funkcja bez argumentów (np. cała sesja GUI lub CLI)
+        mode: "cprofile" (profil deterministyczny) lub "sampling" (próbkowanie stosów)
+        output_prefix: początek nazw plików raportu (domyślnie profile_<czas>)
+
+    Returns:
+        Wynik funkcji
+    """
+    if output_prefix is None:
+        output_prefix = time.strftime("profile_%Y%m%d_%H%M%S")
+
+    if mode == "sampling":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return function()
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(f"{output_prefix}.collapsed.txt")
+            print(f"Raport profilowania zapisany: {output_prefix}.collapsed.txt")
+
+    import cProfile
+    import pstats
+
+    # cProfile do Pythona 3.11 profiluje tylko wątek, w którym go włączono, a prefill,
+    # próbkowanie i dekodowanie działają w wątku inferencji - każdy nowy wątek
+    # dostaje własny profiler, a raport łączy wyniki wszystkich
+    profilers = [cProfile.Profile()]
+    per_thread = sys.version_info < (3, 12)
+
+    def profile_thread(*args):
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    if per_thread:
+        threading.setprofile(profile_thread)
+    profilers[0].enable()
+    try:
+        return function()
+    finally:
+        profilers[0].disable()
+        if per_thread:
+            threading.setprofile(None)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(f"{output_prefix}.prof")
+        with open(f"{output_prefix}.txt", 'w', encoding='utf-8') as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(60)
+            stats.sort_stats("tottime").print_stats(30)
+        print(f"Raport profilowania zapisany: {output_prefix}.txt, {output_prefix}.prof")
@@ -0,0 +1,468 @@
+import json
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Generator, List, Optional, Sequence, Tuple, Union
+
+from llm_backend import model_path_available
+from llm_core import GenerationMetrics, GenerationStream
+
+# Domyślny rozmiar bufora cyklicznego na tokeny (w bajtach)
+DEFAULT_RING_CAPACITY = 1 << 20
+
+# Nagłówek bufora: liczniki zapisanych i odczytanych bajtów (rosną monotonicznie)
+_HEADER = struct.Struct("<QQ")
+_POSITION = struct.Struct("<Q")
+_WRITE_OFFSET = 0
+_READ_OFFSET = _POSITION.size
+# Nagłówek rekordu: długość danych i rodzaj rekordu
+_RECORD = struct.Struct("<IB")
+
+_KIND_CHUNK = 0
+_KIND_ERROR = 1
+_KIND_END = 2
+_KIND_METRICS = 3
+
+
+class WorkerCrashedError(RuntimeError):
+    """Proces roboczy modelu zakończył się nieoczekiwanie (np. awaria lub brak pamięci)."""
+
+
+class SharedRingBuffer:
+    """
+    Bufor cykliczny w pamięci współdzielonej dla jednego producenta i jednego konsumenta.
+
+    Producent (proces roboczy) przesuwa tylko licznik zapisu, a konsument
+    (proces GUI/CLI) tylko licznik odczytu, więc nie są potrzebne blokady.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_RING_CAPACITY, name: Optional[str] = None):
+        self.capacity = capacity
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + capacity)
+            self.reset()
+        else:
+            # Proces roboczy (start "spawn") korzysta z resource_trackera rodzica,
+            # więc pamięć zostanie usunięta tylko przez właściciela
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self._buf = self.shm.buf
+
+    def reset(self) -> None:
+        """Zeruje liczniki bufora (tylko gdy żaden proces z niego nie korzysta)."""
+        _HEADER.pack_into(self.shm.buf, 0, 0, 0)
+
+    def write(self, data: bytes) -> bool:
+        """
+        Zapisuje dane do bufora w całości.
+
+        Returns:
+            False jeśli w buforze brakuje miejsca (nic nie zostało zapisane)
+        """
+        write_pos, read_pos = _HEADER.unpack_from(self._buf, 0)
+        size = len(data)
+        if size > self.capacity - (write_pos - read_pos):
+            return False
+
+        start = write_pos % self.capacity
+        first = min(size, self.capacity - start)
+        offset = _HEADER.size
+        self._buf[offset + start:offset + start + first] = data[:first]
+        if first < size:
+            self._buf[offset:offset + size - first] = data[first:]
+
+        # Licznik zapisu aktualizowany dopiero po skopiowaniu danych
+        _POSITION.pack_into(self._buf, _WRITE_OFFSET, write_pos + size)
+        return True
+
+    def read_into(self, out: bytearray) -> int:
+        """
+        Dopisuje do `out` wszystkie dostępne bajty.
+
+        Returns:
+            Liczba odczytanych bajtów
+        """
+        write_pos, read_pos = _HEADER.unpack_from(self._buf, 0)
+        size = write_pos - read_pos
+        if size == 0:
+            return 0
+
+        start = read_pos % self.capacity
+        first = min(size, self.capacity - start)
+        offset = _HEADER.size
+        out += self._buf[offset + start:offset + start + first]
+        if first < size:
+            out += self._buf[offset:offset + size - first]
+
+        _POSITION.pack_into(self._buf, _READ_OFFSET, read_pos + size)
+        return size
+
+    def close(self) -> None:
+        """Odłącza bufor, a w procesie-właścicielu również usuwa pamięć współdzieloną."""
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class _RingWriter:
+    """Zapisuje rekordy strumienia w procesie roboczym, czekając na wolne miejsce."""
+
+    def __init__(self, ring: SharedRingBuffer, conn):
+        self.ring = ring
+        self.conn = conn
+        self.cancelled = False
+
+    def check_cancel(self) -> bool:
+        """Sprawdza, czy proces nadrzędny poprosił o przerwanie strumienia."""
+        while not self.cancelled and self.conn.poll():
+            if self.conn.recv()[0] == "cancel":
+                self.cancelled = True
+        return self.cancelled
+
+    def write(self, kind: int, payload: bytes = b"") -> None:
+        # Rekord większy niż bufor dzielimy na części
+        max_payload = self.ring.capacity - _RECORD.size
+        while len(payload) > max_payload:
+            self.write(kind, payload[:max_payload])
+            payload = payload[max_payload:]
+
+        record = _RECORD.pack(len(payload), kind) + payload
+        delay = 0.0002
+        while not self.ring.write(record):
+            # Konsument nie nadąża - nie czekaj, jeśli strumień i tak został przerwany
+            if kind == _KIND_CHUNK and self.check_cancel():
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 0.005)
+
+
+def _stream_to_ring(model, writer: _RingWriter, prompt: str, kwargs: Dict[str, Any]) -> None:
+    """Generuje odpowiedź w procesie roboczym i przesyła fragmenty przez bufor cykliczny."""
+    writer.cancelled = False
+    try:
+        stream = model.generate(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                if writer.check_cancel():
+                    break
+                writer.write(_KIND_CHUNK, chunk.encode("utf-8"))
+        finally:
+            stream.close()
+        writer.write(_KIND_METRICS, json.dumps(stream.metrics.to_dict()).encode("utf-8"))
+    except Exception as e:
+        writer.write(_KIND_ERROR, f"{type(e).__name__}: {e}".encode("utf-8"))
+    writer.write(_KIND_END)
+
+
+def _worker_main(conn, ring_name: str, ring_capacity: int) -> None:
+    """Pętla procesu roboczego: odbiera polecenia przez potok i wykonuje je na modelu."""
+    ring = SharedRingBuffer(ring_capacity, name=ring_name)
+    writer = _RingWriter(ring, conn)
+    model = None
+
+    from llm_core import SimpleLLM
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        command = message[0]
+        try:
+            if command == "load":
+                model = SimpleLLM(**message[1])
+                conn.send(("ok", model.get_info()))
+            elif command == "generate":
+                prompt, kwargs = message[1], message[2]
+                if kwargs.get("stream"):
+                    _stream_to_ring(model, writer, prompt, kwargs)
+                else:
+                    conn.send(("ok", model.generate(prompt, **kwargs)))
+            elif command == "call":
+                method, args = message[1], message[2]
+                conn.send(("ok", getattr(model, method)(*args)))
+            elif command == "close":
+                break
+            # Spóźnione "cancel" (po zakończeniu strumienia) ignorujemy
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    if model is not None:
+        model.close()
+    ring.close()
+
+
+class IsolatedLLM:
+    """
+    Model SimpleLLM uruchomiony w osobnym procesie.
+
+    Udostępnia to samo API co SimpleLLM. Polecenia wysyłane są przez potok,
+    a tokeny w trybie strumieniowym wracają przez bufor cykliczny w pamięci
+    współdzielonej. Awaria procesu roboczego (np. błąd w llama.cpp lub brak
+    pamięci) nie zamyka aplikacji - bieżące zapytanie kończy się błędem
+    WorkerCrashedError, a proces jest automatycznie uruchamiany ponownie.
+    """
+
+    def __init__(
+            self,
+            model_path: str,
+            ring_capacity: int = DEFAULT_RING_CAPACITY,
+            **model_kwargs
+    ):
+        """
+        Uruchamia proces roboczy i ładuje w nim model.
+
+        Args:
+            model_path: ścieżka do lokalnego pliku modelu (GGUF format)
+            ring_capacity: rozmiar bufora cyklicznego na tokeny w bajtach
+            **model_kwargs: parametry przekazywane do SimpleLLM
+        """
+        if not model_path_available(model_path, model_kwargs.get("backend")):
+            raise FileNotFoundError(f"Model nie znaleziony: {model_path}")
+
+        self.model_path = model_path
+        self.model_name = os.path.basename(model_path)
+        self.verbose = model_kwargs.get("verbose", False)
+        self.restarts = 0
+        self.last_metrics: Optional[GenerationMetrics] = None
+
+        self._model_kwargs = dict(model_kwargs, model_path=model_path)
+        # "spawn" - proces roboczy nie dziedziczy stanu Tk ani wątków rodzica
+        self._mp = multiprocessing.get_context("spawn")
+        self._ring = SharedRingBuffer(ring_capacity)
+        self._process = None
+        self._conn = None
+        self._info: Dict[str, Any] = {}
+
+        start_time = time.time()
+        try:
+            self._start_worker()
+        except Exception:
+            self.close()
+            raise
+        self.load_time = time.time() - start_time
+
+    def _start_worker(self) -> None:
+        """Uruchamia nowy proces roboczy i ładuje w nim model."""
+        self._ring.reset()
+        parent_conn, child_conn = self._mp.Pipe()
+        process = self._mp.Process(
+            target=_worker_main,
+            args=(child_conn, self._ring.name, self._ring.capacity),
+            name=f"llm-worker-{self.model_name}",
+            daemon=True
+        )
+        try:
+            process.start()
+        finally:
+            child_conn.close()
+        self._process = process
+        self._conn = parent_conn
+
+        self._info = self._request(("load", self._model_kwargs), restart=False)
+
+    def _stop_worker(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+            self._process = None
+
+    def _handle_crash(self) -> None:
+        """Sprząta po martwym procesie roboczym i uruchamia nowy."""
+        process = self._process
+        self._stop_worker()
+        exitcode = process.exitcode if process is not None else None
+        self.restarts += 1
+        print(f"Proces roboczy modelu zakończył się (kod {exitcode}), ponowne uruchamianie "
+              f"({self.restarts})...")
+        self._start_worker()
+
+    def _worker_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def _crashed(self, restart: bool) -> WorkerCrashedError:
+        error = WorkerCrashedError(f"Proces roboczy modelu {self.model_name} uległ awarii")
+        if restart:
+            try:
+                self._handle_crash()
+            except Exception as e:
+                print(f"Nie udało się ponownie uruchomić procesu roboczego: {e}")
+        return error
+
+    def _send(self, message: Tuple, restart: bool = True) -> None:
+        if self._conn is None:
+            # Poprzedni restart się nie powiódł - spróbuj ponownie przy kolejnym zapytaniu
+            self._start_worker()
+        try:
+            self._conn.send(message)
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            raise self._crashed(restart)
+
+    def _request(self, message: Tuple, restart: bool = True) -> Any:
+        """Wysyła polecenie i czeka na odpowiedź, pilnując, czy proces roboczy żyje."""
+        self._send(message, restart)
+        try:
+            while not self._conn.poll(0.1):
+                if not self._worker_alive():
+                    raise EOFError
+            status, payload = self._conn.recv()
+        except (EOFError, ConnectionResetError, OSError):
+            raise self._crashed(restart)
+
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def generate(
+            self,
+            prompt: str,
+            stream: bool = False,
+            **kwargs
+    ) -> Union[str, Generator[str, None, None], dict]:
+        """Generuje odpowiedź w procesie roboczym (parametry jak w SimpleLLM.generate)."""
+        if stream:
+            metrics = GenerationMetrics()
+            return GenerationStream(self._stream_generate(prompt, kwargs, metrics), metrics)
+        result = self._request(("generate", prompt, dict(kwargs, stream=False)))
+        self.last_metrics = getattr(result, "metrics", None)
+        return result
+
+    def _stream_generate(
+            self,
+            prompt: str,
+            kwargs: Dict[str, Any],
+            metrics: GenerationMetrics
+    ) -> Generator[str, None, None]:
+        """Odbiera fragmenty odpowiedzi z bufora cyklicznego."""
+        self._send(("generate", prompt, dict(kwargs, stream=True)))
+
+        pending = bytearray()
+        error = None
+        finished = False
+        try:
+            for kind, payload in self._read_records(pending):
+                if kind == _KIND_CHUNK:
+                    yield payload.decode("utf-8", errors="replace")
+                elif kind == _KIND_ERROR:
+                    error = payload.decode("utf-8", errors="replace")
+                elif kind == _KIND_METRICS:
+                    metrics.__dict__.update(GenerationMetrics.from_dict(json.loads(payload)).__dict__)
+                    self.last_metrics = metrics
+                else:
+                    finished = True
+                    break
+        except WorkerCrashedError:
+            # Proces roboczy został już uruchomiony ponownie - nie ma czego dokańczać
+            finished = True
+            raise
+        finally:
+            if not finished and self._worker_alive():
+                # Konsument przerwał strumień - poproś o zatrzymanie i odczytaj
+                # pozostałe rekordy, aby bufor był pusty dla kolejnego zapytania
+                self._send(("cancel",))
+                for kind, _ in self._read_records(pending):
+                    if kind == _KIND_END:
+                        break
+
+        if error is not None:
+            raise RuntimeError(error)
+
+    def _read_records(self, pending: bytearray) -> Generator[Tuple[int, bytes], None, None]:
+        """Zwraca kolejne kompletne rekordy z bufora cyklicznego."""
+        delay = 0.0002
+        while True:
+            while len(pending) >= _RECORD.size:
+                size, kind = _RECORD.unpack_from(pending, 0)
+                end = _RECORD.size + size
+                if len(pending) < end:
+                    break
+                payload = bytes(pending[_RECORD.size:end])
+                del pending[:end]
+                delay = 0.0002
+                yield kind, payload
+
+            if self._ring.read_into(pending):
+                continue
+            if not self._worker_alive():
+                raise self._crashed(restart=True)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.005)
+
+    def close(self) -> None:
+        """Zamyka proces roboczy i zwalnia pamięć współdzieloną."""
+        if self._conn is not None and self._worker_alive():
+            try:
+                self._conn.send(("close",))
+            except (BrokenPipeError, OSError):
+                pass
+        self._stop_worker()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def get_info(self) -> Dict[str, Any]:
+        """Zwraca podstawowe informacje o modelu."""
+        info = dict(self._info)
+        info["worker_pid"] = self._process.pid if self._process is not None else None
+        info["worker_restarts"] = self.restarts
+        return info
+
+    def get_tokenizer(self):
+        """Tokenizer działa w procesie roboczym - zwraca obiekt pośredniczący."""
+        return self
+
+    def prefill_prompt(self, prompt: str, session: Optional[str] = None) -> int:
+        """Przetwarza z wyprzedzeniem początek prompta w procesie roboczym."""
+        return self._request(("call", "prefill_prompt", (prompt, session)))
+
+    def switch_session(self, session: Optional[str]) -> None:
+        """Przełącza KV cache modelu w procesie roboczym na podaną sesję."""
+        self._request(("call", "switch_session", (session,)))
+
+    def drop_session(self, session: Optional[str]) -> None:
+        """Usuwa zapisany KV cache sesji w procesie roboczym."""
+        self._request(("call", "drop_session", (session,)))
+
+    def get_chat_template_info(self) -> Dict[str, Any]:
+        """Zwraca informacje o szablonie czatu modelu z procesu roboczego."""
+        return self._request(("call", "get_chat_template_info", ()))
+
+    def tokenize(self, text: str) -> Sequence[int]:
+        """Tokenizuje tekst, zwracając tablicę tokenów array('i')."""
+        return self._request(("call", "tokenize", (text,)))
+
+    def count_tokens(self, text: str) -> int:
+        """Zwraca liczbę tokenów tekstu (tokeny nie są przesyłane między procesami)."""
+        return self._request(("call", "count_tokens", (text,)))
+
+    def detokenize(self, tokens: List[int]) -> str:
+        """Detokenizuje listę tokenów, zwracając tekst."""
+        return self._request(("call", "detokenize", (list(tokens),)))
+
+    def embed(self, text: str) -> List[float]:
+        """Zwraca embedding tekstu."""
+        return self._request(("call", "embed", (text,)))
+
+    def export_session_states(self, sessions: List[Optional[str]]) -> Dict[Optional[str], bytes]:
+        return self._request(("call", "export_session_states", (list(sessions),)))
+
+    def import_session_states(self, states: Dict[Optional[str], bytes]) -> None:
+        # Widoki mapowanej migawki nie przechodzą przez potok - wysyłamy kopie
+        self._request(("call", "import_session_states", ({session: bytes(blob) for session, blob in states.items()},)))
+
+    def get_token_embedding(self, token_id: int) -> List[float]:
+        """Zwraca embedding dla danego tokenu."""
+        return self._request(("call", "get_token_embedding", (token_id,)))
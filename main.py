@@ -1,5 +1,6 @@
 import sys
 import argparse
+import multiprocessing
 import os
 
 
@@ -10,6 +11,22 @@ def main():
     parser = argparse.ArgumentParser(description="AdvancedLLM - Zaawansowany interfejs do lokalnych modeli LLM")
     parser.add_argument("--gui", action="store_true", help="Uruchom interfejs graficzny")
     parser.add_argument("--cli", action="store_true", help="Uruchom interfejs wiersza poleceń")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Uruchom demona z załadowanym modelem nasłuchującego na gnieździe Unix")
+    parser.add_argument("--client", action="store_true",
+                        help="Wyślij prompt (--prompt lub standardowe wejście) do działającego demona")
+    parser.add_argument("--stop-daemon", action="store_true", help="Zatrzymaj działającego demona")
+    parser.add_argument("--socket", type=str, help="Ścieżka gniazda demona")
+    parser.add_argument("--prompt", type=str, help="Prompt dla trybu --client")
+    parser.add_argument("--system-prompt", type=str, help="Prompt systemowy dla trybu --client")
+    parser.add_argument("--timeout", type=float,
+                        help="Czas na odpowiedź w sekundach dla trybu --client (odpowiedź kończy się przed nim)")
+    parser.add_argument("--restore", type=str,
+                        help="Przywróć migawkę sesji (model, historia, KV cache) w trybie CLI")
+    parser.add_argument("--search", type=str, help="Wyszukaj tekst w zapisanych rozmowach (bez ładowania modelu)")
+    parser.add_argument("--limit", type=int, default=20, help="Maksymalna liczba wyników dla --search")
+    parser.add_argument("--import-histories", type=str,
+                        help="Przepisz historie JSON z katalogu do zapisanych rozmów i zaindeksuj je")
 
     # Argumenty dla interfejsu wiersza poleceń
     parser.add_argument("--model", type=str, help="Ścieżka do modelu GGUF")
@@ -17,12 +34,70 @@ def main():
     parser.add_argument("--gpu_layers", type=int, help="Liczba warstw GPU (-1 = wszystkie)")
     parser.add_argument("--threads", type=int, help="Liczba wątków CPU")
     parser.add_argument("--mode", type=str, choices=["chat", "complete"], help="Tryb pracy: chat lub complete")
+    parser.add_argument("--isolated", action="store_true", default=None,
+                        help="Uruchom model w osobnym procesie roboczym")
+    parser.add_argument("--backend", type=str, choices=["llama_cpp", "fake"],
+                        help="Silnik inferencji (fake - deterministyczny backend testowy bez modelu)")
     parser.add_argument("--config", type=str, help="Ścieżka do pliku konfiguracyjnego JSON")
+    parser.add_argument("--batch", type=str,
+                        help="Przetwarzanie wsadowe promptów z pliku (jeden model na węzeł NUMA)")
+    parser.add_argument("--output", type=str, help="Plik wynikowy dla trybu --batch lub --map-reduce")
+    parser.add_argument("--map-reduce", type=str,
+                        help="Przetwórz dokument większy niż kontekst modelu fragmentami (map-reduce)")
+    parser.add_argument("--task", type=str, default="Streść najważniejsze informacje.",
+                        help="Polecenie dla trybu --map-reduce")
+    parser.add_argument("--chunk-tokens", type=int, help="Maksymalna liczba tokenów fragmentu dla --map-reduce")
+    parser.add_argument("--grammar", type=str, help="Plik z gramatyką GBNF, do której muszą pasować odpowiedzi")
+    parser.add_argument("--json-schema", type=str,
+                        help="Plik ze schematem JSON - odpowiedzi zawsze będą poprawnym JSON-em zgodnym ze schematem")
+    parser.add_argument("--metrics-port", type=int, help="Port lokalnego serwera metryk (/metrics)")
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=["cprofile", "sampling"],
+                        help="Profiluj całą sesję i zapisz raport po jej zakończeniu")
+    parser.add_argument("--trace", type=str,
+                        help="Zapisz ślad faz przetwarzania do pliku JSON (format Chrome trace-event)")
 
     args = parser.parse_args()
 
+    # Klient demona nie ładuje konfiguracji ani modelu - tylko przesyła zapytanie
+    if args.client or args.stop_daemon:
+        import llm_daemon
+        socket_path = args.socket or llm_daemon.DEFAULT_SOCKET_PATH
+        if args.stop_daemon:
+            try:
+                llm_daemon.DaemonClient(socket_path).shutdown()
+            except OSError as e:
+                print(f"Nie udało się połączyć z demonem: {e}")
+                sys.exit(1)
+            return
+        sys.exit(llm_daemon.run_client(args.prompt, socket_path, mode=args.mode or "chat",
+                                       system_prompt=args.system_prompt, timeout=args.timeout))
+
+    # Wyszukiwanie i import rozmów nie wymagają modelu
+    if args.search is not None or args.import_histories:
+        if args.config:
+            from config import config
+            config.load_config(args.config)
+        from config import config
+        import llm_search
+        sessions_dir = config.get("sessions_dir")
+        index_path = (config.get("search") or {}).get("index_path")
+        if args.import_histories:
+            from llm_session_store import SessionStore
+            index = llm_search.SearchIndex(index_path or os.path.join(sessions_dir, llm_search.INDEX_FILENAME))
+            count = llm_search.import_histories(args.import_histories, SessionStore(sessions_dir), index)
+            index.close()
+            print(f"Przepisano {count} rozmów do {sessions_dir}")
+        if args.search is not None:
+            sys.exit(llm_search.run_search(args.search, limit=args.limit, sessions_dir=sessions_dir,
+                                           index_path=index_path))
+        return
+
+    # Migawka sesji przywracana jest w trybie CLI (GUI przywraca ją przyciskiem "Przywróć sesję")
+    if args.restore and not args.gui:
+        args.cli = True
+
     # Jeśli nie podano jawnie interfejsu, domyślnie uruchom GUI
-    if not (args.gui or args.cli):
+    if not (args.gui or args.cli or args.daemon):
         args.gui = True
 
     # Załaduj konfigurację z pliku, jeśli podano
@@ -34,6 +109,79 @@ def main():
             print(f"Plik konfiguracyjny {args.config} nie istnieje.")
             sys.exit(1)
 
+    # Eksport metryk (serwer /metrics lub okresowy zapis do pliku)
+    from config import config
+    metrics_settings = dict(config.get("metrics") or {})
+    if args.metrics_port:
+        metrics_settings["port"] = args.metrics_port
+    if metrics_settings.get("port") or metrics_settings.get("file"):
+        import llm_metrics
+        llm_metrics.start_exporters(metrics_settings)
+
+    if args.trace:
+        import llm_trace
+        llm_trace.tracer.enable()
+
+    try:
+        if args.profile:
+            import llm_trace
+            llm_trace.run_profiled(lambda: run_session(args), mode=args.profile)
+        else:
+            run_session(args)
+    finally:
+        if args.trace:
+            count = llm_trace.tracer.export_chrome_trace(args.trace)
+            print(f"Zapisano {count} zdarzeń śladu do {args.trace}")
+
+
+def run_session(args):
+    """Uruchamia wybrany tryb pracy (wsadowy, GUI lub CLI)."""
+    generation_overrides = {}
+    if args.grammar or args.json_schema:
+        from cli import load_grammar_options
+        try:
+            generation_overrides = load_grammar_options(args.grammar, args.json_schema)
+        except (OSError, ValueError) as e:
+            print(f"Nie udało się wczytać gramatyki: {e}")
+            sys.exit(1)
+
+    if args.batch:
+        from cli import run_batch
+        batch_args = {
+            "context_size": args.ctx_size,
+            "n_gpu_layers": args.gpu_layers,
+            "backend": args.backend,
+        }
+        batch_args = {k: v for k, v in batch_args.items() if v is not None}
+        run_batch(args.batch, args.output, model_path=args.model, mode=args.mode or "complete",
+                  generation_overrides=generation_overrides, **batch_args)
+        return
+
+    if args.map_reduce:
+        from cli import run_map_reduce
+        map_reduce_args = {
+            "context_size": args.ctx_size,
+            "n_gpu_layers": args.gpu_layers,
+            "backend": args.backend,
+        }
+        map_reduce_args = {k: v for k, v in map_reduce_args.items() if v is not None}
+        run_map_reduce(args.map_reduce, args.task, args.output, model_path=args.model, mode=args.mode or "chat",
+                       chunk_tokens=args.chunk_tokens, **map_reduce_args)
+        return
+
+    if args.daemon:
+        from cli import run_daemon
+        daemon_args = {
+            "context_size": args.ctx_size,
+            "n_gpu_layers": args.gpu_layers,
+            "n_cpu_threads": args.threads,
+            "isolated_process": args.isolated,
+            "backend": args.backend,
+        }
+        daemon_args = {k: v for k, v in daemon_args.items() if v is not None}
+        run_daemon(args.model, socket_path=args.socket, generation_overrides=generation_overrides, **daemon_args)
+        return
+
     if args.gui:
         try:
             from llm_gui import run_gui
@@ -56,14 +204,17 @@ def main():
                 "model_path": args.model,
                 "context_size": args.ctx_size,
                 "n_gpu_layers": args.gpu_layers,
-                "n_threads": args.threads,
-                "mode": args.mode
+                "n_cpu_threads": args.threads,
+                "isolated_process": args.isolated,
+                "backend": args.backend,
+                "mode": args.mode,
+                "restore": args.restore
             }
 
             # Usuń None wartości
             cli_args = {k: v for k, v in cli_args.items() if v is not None}
 
-            run_cli(**cli_args)
+            run_cli(generation_overrides=generation_overrides, **cli_args)
         except ImportError as e:
             print(f"Błąd podczas importowania modułu CLI: {e}")
             sys.exit(1)
@@ -73,4 +224,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Wymagane przez procesy robocze modelu w wersji spakowanej PyInstallerem
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,35 @@
+from llm_backend import FakeBackend
+from llm_core import StreamingDetokenizer
+
+# Tokenami FakeBackend są pojedyncze bajty, więc każda polska litera jest rozdzielona między dwa tokeny
+TEXT = "Zażółć gęślą jaźń. Źdźbło, żółw i łódź."
+
+
+def test_multibyte_characters_split_across_tokens():
+    backend = FakeBackend()
+    detokenizer = StreamingDetokenizer(backend)
+    pieces = [detokenizer.feed(token) for token in backend.tokenize(TEXT.encode("utf-8"), add_bos=False)]
+    assert "".join(pieces) + detokenizer.flush() == TEXT
+    # Żaden fragment nie zawiera połowy znaku
+    assert all("�" not in piece for piece in pieces)
+    assert "" in pieces
+
+
+def test_shared_pieces_cache():
+    backend = FakeBackend()
+    pieces = {}
+    tokens = backend.tokenize("ąą".encode("utf-8"), add_bos=False)
+    first = StreamingDetokenizer(backend, pieces)
+    assert "".join(first.feed(token) for token in tokens) == "ąą"
+    assert set(pieces) == set(tokens)
+    second = StreamingDetokenizer(backend, pieces)
+    assert "".join(second.feed(token) for token in tokens) == "ąą"
+
+
+def test_flush_replaces_incomplete_character():
+    backend = FakeBackend()
+    detokenizer = StreamingDetokenizer(backend)
+    first_byte = backend.tokenize("ż".encode("utf-8"), add_bos=False)[0]
+    assert detokenizer.feed(first_byte) == ""
+    assert detokenizer.flush() == "�"
+    assert detokenizer.flush() == ""
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from llm_executor import DeadlineExceededError, InferenceExecutor, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from llm_interface import SimpleLLMInterface
+from config import config
+
+
+class _Chunks:
+    """Generator fragmentów, który (jak strumień modelu bez gramatyki) można wywłaszczyć."""
+
+    preemptible = True
+
+    def __init__(self, chunks, before_chunk=None):
+        self._chunks = iter(chunks)
+        self._before_chunk = before_chunk
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._chunks)
+        if self._before_chunk is not None:
+            self._before_chunk(chunk)
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def executor():
+    executor = InferenceExecutor()
+    yield executor
+    executor.shutdown()
+
+
+def _block(executor):
+    """Zajmuje wątek inferencji, dopóki zwrócone zdarzenie nie zostanie ustawione."""
+    started, release = threading.Event(), threading.Event()
+
+    def wait():
+        started.set()
+        release.wait(5)
+
+    executor.submit(wait)
+    assert started.wait(5)
+    return release
+
+
+def test_interactive_jobs_run_before_batch(executor):
+    release = _block(executor)
+    order = []
+    futures = [
+        executor.submit(order.append, "batch-1", priority=PRIORITY_BATCH),
+        executor.submit(order.append, "interactive-1", priority=PRIORITY_INTERACTIVE),
+        executor.submit(order.append, "batch-2", priority=PRIORITY_BATCH),
+        executor.submit(order.append, "interactive-2", priority=PRIORITY_INTERACTIVE),
+    ]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
+
+
+def test_batch_stream_is_preempted_and_resumed(executor):
+    order = []
+
+    def before_chunk(chunk):
+        order.append(f"batch-{chunk}")
+        if chunk == "a":
+            # Pilniejsze zadanie zgłoszone w trakcie generowania wsadowego
+            order.append("submit")
+            executor.submit(order.append, "interactive")
+
+    result = _Chunks(["a", "b", "c"], before_chunk)
+    stream = executor.submit_stream(lambda: result, priority=PRIORITY_BATCH)
+    assert "".join(stream) == "abc"
+    assert order == ["batch-a", "submit", "interactive", "batch-b", "batch-c"]
+    assert result.closed
+    assert executor.stats()["batch"]["preemptions"] == 1
+    assert executor.parked() == 0
+
+
+def test_abort_parked_closes_stream(executor):
+    release = threading.Event()
+    result = _Chunks(["a", "b"], lambda chunk: chunk == "a" and executor.submit(release.wait, 5))
+    stream = executor.submit_stream(lambda: result, priority=PRIORITY_BATCH)
+    assert next(stream) == "a"
+    # Strumień czeka na wznowienie za zadaniem interaktywnym
+    executor.submit(lambda: executor.abort_parked(RuntimeError("model podmieniony")))
+    release.set()
+    with pytest.raises(RuntimeError, match="model podmieniony"):
+        list(stream)
+    assert result.closed
+
+
+def test_deadline_already_passed_is_rejected(executor):
+    stream = executor.submit_stream(lambda deadline: "odpowiedź", deadline=time.time() - 1)
+    with pytest.raises(DeadlineExceededError):
+        list(stream)
+    assert executor.stats()["interactive"]["deadline_rejections"] == 1
+
+
+def test_deadline_rejected_when_queue_is_too_long(executor):
+    executor.submit(time.sleep, 0.3).result(5)
+    release = _block(executor)
+    try:
+        stream = executor.submit_stream(lambda deadline: "odpowiedź", deadline=time.time() + 0.1)
+        with pytest.raises(DeadlineExceededError):
+            list(stream)
+        # Termin, który kolejka pozwala dotrzymać, nie jest odrzucany
+        stream = executor.submit_stream(lambda deadline: "odpowiedź", deadline=time.time() + 30)
+    finally:
+        release.set()
+    assert "".join(stream) == "odpowiedź"
+
+
+def test_fake_model_batch_preempted_by_chat(monkeypatch):
+    monkeypatch.setattr(config, "save_config", lambda *args, **kwargs: True)
+    response = "Długa odpowiedź wsadowa. " * 10
+    interface = SimpleLLMInterface()
+    try:
+        assert interface.submit_load_model(
+            "fake", backend="fake",
+            backend_options={"decode_ms_per_token": 2, "response": response}).result(10)
+        batch = interface.submit_complete("Dokument", priority=PRIORITY_BATCH, stream=True, max_tokens=400)
+        first = next(batch)
+        chat = interface.submit_chat("Pytanie?", history=[], stream=True, max_tokens=5)
+        assert "".join(chat)
+        # Odpowiedź czatu kończy się, zanim skończy się odpowiedź wsadowa
+        assert not batch.done
+        assert first + "".join(batch) == response
+        assert interface.executor.stats()["batch"]["preemptions"] >= 1
+    finally:
+        interface.executor.shutdown()
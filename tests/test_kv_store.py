@@ -0,0 +1,120 @@
+import os
+import threading
+
+from llm_core import EMBEDDING_SESSION, SimpleLLM
+from llm_kv_store import SessionStateStore, _state_size
+
+
+def _state(number: int, size: int = 1000):
+    return list(range(number, number + size)), number
+
+
+class _SlowState:
+    """Stan, którego serializacja czeka na sygnał - pozwala sprawdzić, co blokuje zapis na dysk."""
+
+    started = threading.Event()
+    release = threading.Event()
+    # Rozmiar jak w LlamaState - szacowanie rozmiaru nie serializuje stanu
+    llama_state_size = 100
+
+    def __reduce__(self):
+        _SlowState.started.set()
+        _SlowState.release.wait(5)
+        return (list, ([1, 2, 3],))
+
+
+def test_lru_evicts_oldest_without_spill_dir():
+    size = _state_size(_state(0))
+    store = SessionStateStore(memory_budget=int(size * 2.5))
+    for number in range(3):
+        store.put(f"s{number}", _state(number))
+    # Odczyt przenosi sesję na koniec kolejki LRU
+    store.get_blob("s1")
+    store.put("s3", _state(3))
+    assert "s0" not in store and "s1" not in store
+    assert store.take("s2") == _state(2)
+    assert store.stats()["evicted"] == 2
+
+
+def test_put_and_take_keep_raw_state():
+    store = SessionStateStore()
+    state = _state(7)
+    store.put("a", state)
+    assert store.take("a") is state
+    assert store.take("a") is None
+    assert len(store) == 0
+
+
+def test_spill_round_trip(tmp_path):
+    size = _state_size(_state(0))
+    store = SessionStateStore(memory_budget=int(size * 1.5), spill_dir=str(tmp_path))
+    for number in range(4):
+        store.put(f"s{number}", _state(number))
+    stats = store.stats()
+    assert stats["sessions_in_memory"] == 1 and stats["sessions_on_disk"] == 3
+    assert len(os.listdir(tmp_path)) == 3
+    for number in range(4):
+        assert store.take(f"s{number}") == _state(number)
+    assert os.listdir(tmp_path) == []
+    assert store.stats()["disk_bytes"] == 0
+
+
+def test_disk_budget_removes_oldest(tmp_path):
+    blob_size = len(SessionStateStore().encode(_state(0)))
+    store = SessionStateStore(memory_budget=0, spill_dir=str(tmp_path), disk_budget=int(blob_size * 2.5))
+    for number in range(4):
+        store.put(f"s{number}", _state(number))
+    assert "s0" not in store and "s1" not in store
+    assert store.take("s3") == _state(3)
+
+
+def test_blob_round_trip(tmp_path):
+    for compress in (True, False):
+        store = SessionStateStore(compress=compress)
+        blob = store.encode(_state(3))
+        store.put_blob("a", blob)
+        assert store.get_blob("a") == blob
+        assert store.take("a") == _state(3)
+        store.put("b", _state(4))
+        assert store.decode(store.get_blob("b")) == _state(4)
+
+
+def test_spill_does_not_block_stats(tmp_path):
+    store = SessionStateStore(memory_budget=0, spill_dir=str(tmp_path))
+    writer = threading.Thread(target=store.put, args=("slow", _SlowState()))
+    writer.start()
+    try:
+        assert _SlowState.started.wait(5)
+        # Stan jest serializowany poza blokadą - stats() i sprawdzanie sesji nie czekają
+        assert store.stats()["sessions_on_disk"] == 0
+        assert "slow" in store
+    finally:
+        _SlowState.release.set()
+        writer.join()
+    assert store.take("slow") == [1, 2, 3]
+
+
+def test_take_during_spill_returns_state(tmp_path):
+    store = SessionStateStore(memory_budget=0, spill_dir=str(tmp_path))
+    state = _state(5)
+    with store._lock:
+        store._memory["a"] = (state, False, 1)
+        store._memory_bytes += 1
+        victims = store._over_budget()
+    assert store.take("a") is state
+    # Zapis porzuconego stanu nie rejestruje go ponownie
+    store._spill(victims)
+    assert "a" not in store
+    assert os.listdir(tmp_path) == []
+
+
+def test_embedding_session_state_is_not_stored():
+    model = SimpleLLM("fake", backend="fake", verbose=False)
+    model.switch_session("rozmowa")
+    model.embed("tekst")
+    model.switch_session("rozmowa")
+    model.embed("inny tekst")
+    model.switch_session("inna")
+    assert EMBEDDING_SESSION not in model._session_states
+    assert "rozmowa" in model._session_states
+    model.close()
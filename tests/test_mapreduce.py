@@ -0,0 +1,52 @@
+from llm_backend import FakeBackend
+from llm_mapreduce import iter_token_chunks
+
+_backend = FakeBackend()
+
+
+def _count_tokens(text: str) -> int:
+    return len(_backend.tokenize(text.encode("utf-8"), add_bos=False))
+
+
+def _count_quarter(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _document(lines: int) -> str:
+    return "".join(f"Wiersz {number}: zażółć gęślą jaźń, {'słowo ' * (number % 7)}\n" for number in range(lines))
+
+
+def test_chunks_respect_token_limit_and_reassemble():
+    text = _document(300)
+    blocks = [text[start:start + 500] for start in range(0, len(text), 500)]
+    chunks = list(iter_token_chunks(blocks, _count_tokens, 200))
+    assert len(chunks) > 1
+    assert all(_count_tokens(chunk) <= 200 for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_chunks_end_on_line_boundaries():
+    text = _document(200)
+    chunks = list(iter_token_chunks([text], _count_tokens, 300))
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+
+def test_line_longer_than_limit_is_split_on_words():
+    text = "słowo " * 400
+    chunks = list(iter_token_chunks([text], _count_tokens, 50))
+    assert all(_count_tokens(chunk) <= 50 for chunk in chunks)
+    assert all(chunk.endswith(" ") for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_whitespace_run_does_not_end_document():
+    # Długi ciąg pustych linii (np. puste strony PDF) nie może ucinać reszty dokumentu
+    blocks = ["intro text\n", "\n" * 50, "IMPORTANT TAIL CONTENT\n"]
+    chunks = list(iter_token_chunks(blocks, _count_quarter, 5))
+    assert "".join(chunks).split() == "".join(blocks).split()
+    assert "TAIL" in "".join(chunks)
+
+
+def test_empty_input():
+    assert list(iter_token_chunks([], _count_tokens, 10)) == []
+    assert list(iter_token_chunks(["\n\n  \n"], _count_tokens, 10)) == []
@@ -0,0 +1,41 @@
+from llm_backend import FakeBackend, register_backend
+from llm_interface import SimpleLLMInterface
+from cli import apply_model_overrides
+from config import config
+
+
+class _RecordingBackend(FakeBackend):
+    """Backend testowy zapamiętujący parametry, z którymi został utworzony."""
+
+    created = []
+
+    def __init__(self, model_path: str = "fake", **params):
+        super().__init__(model_path, **params)
+        _RecordingBackend.created.append(params)
+
+
+def test_threads_override_reaches_model_params(monkeypatch):
+    # Ładowanie modelu zapisuje konfigurację - test nie może zmienić pliku użytkownika
+    monkeypatch.setattr(config, "save_config", lambda *args, **kwargs: True)
+    register_backend("recording", _RecordingBackend)
+    saved = config.get_model_params()
+    try:
+        apply_model_overrides({"n_cpu_threads": 3, "backend": "recording"})
+        assert config.get_model_params()["n_cpu_threads"] == 3
+
+        interface = SimpleLLMInterface()
+        assert interface.load_model("fake")
+        assert _RecordingBackend.created[-1]["n_threads"] == 3
+        interface.executor.shutdown()
+    finally:
+        config.config["model"] = saved
+
+
+def test_threads_alias_maps_to_config_key():
+    saved = config.get_model_params()
+    try:
+        apply_model_overrides({"n_threads": 5})
+        assert config.get_model_params()["n_cpu_threads"] == 5
+        assert "n_threads" not in config.get_model_params()
+    finally:
+        config.config["model"] = saved
@@ -0,0 +1,45 @@
+from llm_backend import FakeBackend
+from llm_tokenizer import IncrementalTokenizer
+
+
+class _PrefixSpaceBackend(FakeBackend):
+    """Backend testowy dodający spację przed tekstem, jak tokenizery SentencePiece."""
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        return super().tokenize(b" " + text, add_bos=add_bos, special=special)
+
+
+def _appended(backend, parts):
+    tokenizer = IncrementalTokenizer(backend)
+    for part in parts:
+        tokenizer.append(part)
+    return tokenizer
+
+
+def test_incremental_tokens_match_whole_text():
+    parts = ["Zażółć gęślą", " jaźń.\nDrugi", " wiersz\n\n  wcięty\nKoniec"]
+    backend = FakeBackend()
+    tokenizer = _appended(backend, parts)
+    assert tokenizer.incremental
+    assert tokenizer.text == "".join(parts)
+    assert list(tokenizer.tokens()) == backend.tokenize("".join(parts).encode("utf-8"))
+    assert len(tokenizer) == len(tokenizer.tokens())
+
+
+def test_prefix_space_tokenizer_stays_incremental():
+    parts = ["Ala ma kota.\n", "Kot ma Alę.\n", "Ostatnia linia"]
+    backend = _PrefixSpaceBackend()
+    tokenizer = _appended(backend, parts)
+    assert tokenizer.incremental
+    assert list(tokenizer.tokens()) == backend.tokenize("".join(parts).encode("utf-8"))
+
+
+def test_only_appended_text_is_tokenized():
+    backend = FakeBackend()
+    tokenizer = _appended(backend, ["Pierwsza linia\n" * 100, "Druga"])
+    calls = []
+    original = backend.tokenize
+    backend.tokenize = lambda text, **kwargs: calls.append(text) or original(text, **kwargs)
+    tokenizer.append(" część\nTrzecia")
+    len(tokenizer)
+    assert all(len(text) < 40 for text in calls)